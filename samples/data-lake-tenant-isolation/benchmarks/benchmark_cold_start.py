@@ -0,0 +1,127 @@
+"""
+Import-time and first-invocation benchmark of the getTenantData Lambda.
+
+Every run starts a fresh interpreter, the way a new execution environment
+does, and measures:
+
+* the `-X importtime` report of the handler module (slowest imports first)
+* init: importing getTenantData, which also builds the boto3 clients
+* the first (cold) and following (warm) invocations with a locally signed token
+
+Use the thresholds to fail a CI job on a regression:
+
+    python benchmarks/benchmark_cold_start.py --runs 5 --max-init-ms 1500 --max-cold-invoke-ms 200
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'compute_layer', 'lambda')
+HANDLER_PATHS = [os.path.abspath(os.path.join(ROOT, 'getTenantData')),
+                 os.path.abspath(os.path.join(ROOT, 'layers', 'python'))]
+
+
+def child_env():
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(HANDLER_PATHS + [env.get('PYTHONPATH', '')])
+    env.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    env.setdefault('TENANT_ROLE_ARN', 'arn:aws:iam::111122223333:role/TenantRole')
+    env.setdefault('TOKEN_ISSUERS', 'https://cognito-idp.us-east-1.amazonaws.com/us-east-1_example')
+    return env
+
+
+def import_time_report(top):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import getTenantData'],
+                            env=child_env(), capture_output=True, text=True, check=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative_us), int(self_us), name.strip()))
+    rows.sort(reverse=True)
+    print('Slowest imports (cumulative us, self us, module):')
+    for cumulative_us, self_us, name in rows[:top]:
+        print('  {0:>9} {1:>9}  {2}'.format(cumulative_us, self_us, name))
+
+
+def run_child(warm_invokes):
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', '--warm-invokes', str(warm_invokes)],
+                            env=child_env(), capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def child(warm_invokes):
+    # Runs inside a fresh interpreter: time the init phase, then invoke the handler.
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                    serialization.NoEncryption()).decode()
+    public_pem = key.public_key().public_bytes(serialization.Encoding.PEM,
+                                               serialization.PublicFormat.SubjectPublicKeyInfo)
+
+    start = time.perf_counter()
+    import getTenantData
+    init_ms = (time.perf_counter() - start) * 1000
+
+    from jose import jwk, jwt
+    public_key = jwk.construct(public_pem, 'RS256').to_dict()
+    public_key.update({'kid': 'kid-1', 'alg': 'RS256'})
+    getTenantData.token_verifier.jwks.fetch = lambda url: [public_key]
+    token = jwt.encode({'iss': 'https://cognito-idp.us-east-1.amazonaws.com/us-east-1_example',
+                        'exp': int(time.time()) + 3600, 'custom:tenant_id': 'tenant-1'},
+                       private_pem, algorithm='RS256', headers={'kid': 'kid-1'})
+    event = {'headers': {'Authorization': 'Bearer ' + token}, 'body': '{}'}
+
+    start = time.perf_counter()
+    response = getTenantData.lambda_handler(event, None)
+    cold_ms = (time.perf_counter() - start) * 1000
+    assert response['statusCode'] == 200, response
+
+    warm = []
+    for _ in range(warm_invokes):
+        start = time.perf_counter()
+        getTenantData.lambda_handler(event, None)
+        warm.append((time.perf_counter() - start) * 1000)
+    print(json.dumps({'init_ms': init_ms, 'cold_invoke_ms': cold_ms, 'warm_invoke_ms': statistics.median(warm)}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='number of fresh interpreters to start')
+    parser.add_argument('--warm-invokes', type=int, default=100)
+    parser.add_argument('--top', type=int, default=15, help='number of imports listed in the report')
+    parser.add_argument('--max-init-ms', type=float, help='fail when the median init time is above this')
+    parser.add_argument('--max-cold-invoke-ms', type=float, help='fail when the median first invocation is above this')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.warm_invokes)
+        return
+
+    import_time_report(args.top)
+    runs = [run_child(args.warm_invokes) for _ in range(args.runs)]
+    summary = {name: statistics.median(run[name] for run in runs)
+               for name in ('init_ms', 'cold_invoke_ms', 'warm_invoke_ms')}
+    print('Median of {0} runs: init {init_ms:.1f} ms, cold invoke {cold_invoke_ms:.2f} ms, '
+          'warm invoke {warm_invoke_ms:.3f} ms'.format(args.runs, **summary))
+
+    failures = []
+    if args.max_init_ms is not None and summary['init_ms'] > args.max_init_ms:
+        failures.append('init {0:.1f} ms > {1} ms'.format(summary['init_ms'], args.max_init_ms))
+    if args.max_cold_invoke_ms is not None and summary['cold_invoke_ms'] > args.max_cold_invoke_ms:
+        failures.append('cold invoke {0:.2f} ms > {1} ms'.format(summary['cold_invoke_ms'], args.max_cold_invoke_ms))
+    if failures:
+        print('Regression: ' + ', '.join(failures))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Microbenchmark of Cognito token verification in getTenantData.process_token.
+
+Compares the previous approach (linear kid scan and jwk.construct for every
+token) with TokenVerifier from the jwtManager layer, for a first-seen token
+and for a repeat token. Keys are generated locally, no network is used:
+
+    python benchmarks/benchmark_jwt.py --iterations 2000
+"""
+import argparse
+import os
+import sys
+import time
+import timeit
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk, jwt
+from jose.utils import base64url_decode
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'compute_layer', 'lambda', 'layers', 'python'))
+from jwtManager import JwksManager, TokenVerifier  # noqa: E402
+
+ISSUER = 'https://cognito-idp.us-east-1.amazonaws.com/us-east-1_example'
+
+
+def generate_key_set(count):
+    private_keys, public_keys = {}, []
+    for i in range(count):
+        kid = 'kid-{0}'.format(i)
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        private_keys[kid] = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                              serialization.NoEncryption()).decode()
+        public_pem = key.public_key().public_bytes(serialization.Encoding.PEM,
+                                                   serialization.PublicFormat.SubjectPublicKeyInfo)
+        public_key = jwk.construct(public_pem, 'RS256').to_dict()
+        public_key.update({'kid': kid, 'alg': 'RS256', 'use': 'sig'})
+        public_keys.append(public_key)
+    return private_keys, public_keys
+
+
+def sign(private_keys, kid, tenant_id):
+    claims = {'iss': ISSUER, 'exp': int(time.time()) + 3600, 'custom:tenant_id': tenant_id}
+    return jwt.encode(claims, private_keys[kid], algorithm='RS256', headers={'kid': kid})
+
+
+def verify_baseline(token, keys):
+    # The per-request work of the original process_token once keys_map is warm.
+    claims = jwt.get_unverified_claims(token)
+    kid = jwt.get_unverified_headers(token)['kid']
+    key_index = -1
+    for i in range(len(keys)):
+        if kid == keys[i]['kid']:
+            key_index = i
+            break
+    if key_index == -1:
+        raise ValueError('Public key not found in jwks.json')
+    public_key = jwk.construct(keys[key_index])
+    message, encoded_signature = str(token).rsplit('.', 1)
+    if not public_key.verify(message.encode('utf8'), base64url_decode(encoded_signature.encode('utf-8'))):
+        raise ValueError('Signature verification failed')
+    if time.time() > claims['exp']:
+        raise ValueError('Token is expired')
+    return claims
+
+
+def report(name, seconds, iterations):
+    print('{0:<28} {1:>10.1f} us/token'.format(name, seconds / iterations * 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=1000)
+    parser.add_argument('--keys', type=int, default=4, help='number of keys in the JWKS')
+    args = parser.parse_args()
+
+    private_keys, public_keys = generate_key_set(args.keys)
+    last_kid = public_keys[-1]['kid']
+    tokens = [sign(private_keys, last_kid, 'tenant-{0}'.format(i)) for i in range(args.iterations)]
+    repeat_token = tokens[0]
+
+    report('baseline', timeit.timeit(lambda: verify_baseline(repeat_token, public_keys), number=args.iterations),
+           args.iterations)
+
+    verifier = TokenVerifier(jwks=JwksManager([ISSUER], fetch=lambda url: public_keys))
+    it = iter(tokens)
+    report('verifier, first-seen token', timeit.timeit(lambda: verifier.verify(next(it)), number=args.iterations),
+           args.iterations)
+    report('verifier, repeat token', timeit.timeit(lambda: verifier.verify(repeat_token), number=args.iterations),
+           args.iterations)
+
+
+if __name__ == '__main__':
+    main()
@@ -20,18 +20,55 @@ class compute_layer_stack(Stack):
         super().__init__(scope, construct_id, **kwargs)
         # Overriding LambdaRestApiProps with type Any
         gateway_props = dict[Any, Any]
+        # shared tenant session helpers (tempSession.py), packaged under python/ as Lambda layers expect
+        tenant_session_layer = _lambda.LayerVersion(self, 'TenantSessionLayer',
+                                        code=_lambda.Code.from_asset('compute_layer/lambda/layers'),
+                                        compatible_runtimes=[_lambda.Runtime.PYTHON_3_12]
+                                        )
+        # role assumed by getTenantData with the TenantID session tag, Lake Formation grants the tenant's data by tag
+        tenant_role = iam.Role(self, 'TenantRole',
+                               assumed_by=iam.AccountRootPrincipal().with_session_tags())
+        tenant_role.add_to_policy(
+            iam.PolicyStatement(
+                actions=["athena:StartQueryExecution",
+                         "athena:GetQueryExecution",
+                         "athena:GetQueryResults",
+                         "athena:GetWorkGroup",
+                         "glue:GetDatabase",
+                         "glue:GetTable",
+                         "glue:GetPartitions",
+                         "lakeformation:GetDataAccess",
+                         "s3:GetObject",
+                         "s3:PutObject",
+                         "s3:GetBucketLocation",
+                         "s3:ListBucket"
+                         ],
+                effect=iam.Effect.ALLOW,
+                resources=["*"]
+            )
+        )
         # create a standard API GW that authenticates using Cognito and transfers Lambda the JWT token
         construct = CognitoToApiGatewayToLambda(self, 'test-cognito-apigateway-lambda',
                                         lambda_function_props=_lambda.FunctionProps(
                                             code=_lambda.Code.from_asset(
                                                 'compute_layer/lambda/getTenantData'),
                                             runtime=_lambda.Runtime.PYTHON_3_12,
-                                            handler='getTenantData.handler'
+                                            handler='getTenantData.lambda_handler',
+                                            layers=[tenant_session_layer],
+                                            environment={'LOG_LEVEL': 'INFO', 'LOG_SAMPLE_RATE': '0.01',
+                                                         'ATHENA_WORKGROUP': 'athena-default',
+                                                         'TENANT_ROLE_ARN': tenant_role.role_arn}
                                         ),
                                         api_gateway_props=gateway_props(
                                             proxy=False
                                         )
                                         )        
+        construct.lambda_function.add_environment('TOKEN_ISSUERS',
+                                                  'https://' + construct.user_pool.user_pool_provider_url)
+        tenant_role.grant_assume_role(construct.lambda_function.role)
+        construct.lambda_function.add_to_role_policy(
+            iam.PolicyStatement(actions=["sts:TagSession"], effect=iam.Effect.ALLOW, resources=[tenant_role.role_arn])
+        )
         resource = construct.api_gateway.root.add_resource('getTenantData')
         resource.add_method('POST')
 # Mandatory to call this method to Apply the Cognito Authorizers on all API methods
@@ -39,7 +76,7 @@ class compute_layer_stack(Stack):
         addTenantLambdacont=ApiGatewayToLambda(self, 'ApiGatewayToLambdaPattern',
             lambda_function_props=_lambda.FunctionProps(
                 runtime=_lambda.Runtime.PYTHON_3_12,
-                handler='addTenant.handler',
+                handler='addTenant.lambda_handler',
                 code=_lambda.Code.from_asset('compute_layer/lambda/addTenant')
             )
             )
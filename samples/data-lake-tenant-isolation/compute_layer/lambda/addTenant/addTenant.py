@@ -1,19 +1,17 @@
-import base64
 import os
-import time
-import requests
-from flask import session
-from jose import jwt
-from requests import get, post
+import random
 import logging
 import json
-from botocore.exceptions import ClientError
+
+logger = logging.getLogger()
+logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
+# fraction of invocations logged at DEBUG level, including the full event
+log_sample_rate = float(os.environ.get('LOG_SAMPLE_RATE', '0'))
 
 def lambda_handler(event, context):
-    #logging.basicConfig(level=logging.INFO)
-    logging.getLogger().setLevel(logging.DEBUG)
-    logging.info(event)
-    if not str(event).__contains__('headers'):
+    if log_sample_rate > 0 and random.random() < log_sample_rate:
+        logger.info(event)
+    if not event.get('headers'):
         return {
             "statusCode": 500,
             "body": json.dumps({
@@ -0,0 +1,208 @@
+import codecs
+import csv
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from botocore.exceptions import ClientError
+
+TERMINAL_STATES = ('SUCCEEDED', 'FAILED', 'CANCELLED')
+
+
+class AthenaQueryError(Exception):
+    def __init__(self, query_execution_id, state, reason):
+        super().__init__('Query {0} {1}: {2}'.format(query_execution_id, state, reason))
+        self.query_execution_id = query_execution_id
+        self.state = state
+        self.reason = reason
+
+
+class TenantAthenaExecutor:
+    """
+    Runs Athena queries with tenant-scoped credentials and streams their results
+
+    Clients come from a TenantSessionCache, so every call is made with the
+    credentials of the tenant the query belongs to.
+    :param session_cache: The TenantSessionCache used to build athena and s3 clients
+    :param access_role_arn: The ARN of the tenant role
+    :param workgroup: The Athena workgroup, the default workgroup is used when omitted
+    :param output_location: The S3 location of query results, when the workgroup does not enforce one
+    :param reuse_max_age_minutes: Reuse the results of an identical query up to this age, 0 disables reuse
+    :param initial_poll_sec: The first delay between two get_query_execution calls
+    :param max_poll_sec: The upper bound of the delay between two get_query_execution calls
+    :param poll_backoff: The factor applied to the delay after each poll
+    :param s3_threshold_bytes: In 'auto' result mode, result files larger than this are read from S3
+    :param max_workers: The number of queries polled concurrently by execute_many
+    :param sleep: Function used to wait between polls
+    """
+
+    def __init__(self, session_cache, access_role_arn, workgroup=None, output_location=None,
+                 reuse_max_age_minutes=60, initial_poll_sec=0.2, max_poll_sec=5.0, poll_backoff=1.5,
+                 s3_threshold_bytes=10 * 1024 * 1024, max_workers=8, sleep=time.sleep):
+        self.session_cache = session_cache
+        self.access_role_arn = access_role_arn
+        self.workgroup = workgroup
+        self.output_location = output_location
+        self.reuse_max_age_minutes = reuse_max_age_minutes
+        self.initial_poll_sec = initial_poll_sec
+        self.max_poll_sec = max_poll_sec
+        self.poll_backoff = poll_backoff
+        self.s3_threshold_bytes = s3_threshold_bytes
+        self.max_workers = max_workers
+        self.sleep = sleep
+
+    def _client(self, service_name, tenant_id):
+        return self.session_cache.client(service_name, self.access_role_arn, tenant_id, session_name='tenantSession')
+
+    def start(self, tenant_id, query, database, parameters=None, output_location=None):
+        """
+        Start a query
+        :param tenant_id: The tenant the query runs for
+        :param query: The SQL query, with ? placeholders for parameters
+        :param database: The Glue database
+        :param parameters: Values bound to the ? placeholders, as strings
+        :param output_location: Overrides the executor output location
+        :return: The query execution ID
+        """
+        request = {
+            'QueryString': query,
+            'QueryExecutionContext': {'Database': database},
+        }
+        output_location = output_location or self.output_location
+        if output_location:
+            request['ResultConfiguration'] = {'OutputLocation': output_location}
+        if self.workgroup:
+            request['WorkGroup'] = self.workgroup
+        if parameters:
+            request['ExecutionParameters'] = list(parameters)
+        if self.reuse_max_age_minutes:
+            # identical queries of the same tenant are answered from the previous result files
+            request['ResultReuseConfiguration'] = {
+                'ResultReuseByAgeConfiguration': {'Enabled': True, 'MaxAgeInMinutes': self.reuse_max_age_minutes}
+            }
+        return self._client('athena', tenant_id).start_query_execution(**request)['QueryExecutionId']
+
+    def wait(self, tenant_id, query_execution_id, timeout_sec=None):
+        """
+        Poll a query until it finishes, waiting longer between polls as the query runs
+        :param tenant_id: The tenant the query runs for
+        :param query_execution_id: The query execution ID
+        :param timeout_sec: Give up after this many seconds
+        :return: The QueryExecution of the succeeded query
+        """
+        client = self._client('athena', tenant_id)
+        delay = self.initial_poll_sec
+        deadline = None if timeout_sec is None else time.monotonic() + timeout_sec
+        while True:
+            execution = client.get_query_execution(QueryExecutionId=query_execution_id)['QueryExecution']
+            status = execution['Status']
+            if status['State'] in TERMINAL_STATES:
+                break
+            if deadline is not None and time.monotonic() + delay > deadline:
+                raise TimeoutError('Query {0} did not finish in {1}s'.format(query_execution_id, timeout_sec))
+            self.sleep(delay)
+            delay = min(self.max_poll_sec, delay * self.poll_backoff)
+        if status['State'] != 'SUCCEEDED':
+            raise AthenaQueryError(query_execution_id, status['State'], status.get('StateChangeReason', ''))
+        return execution
+
+    def iter_rows(self, tenant_id, query_execution_id, page_size=1000):
+        """
+        Stream the rows of a query through get_query_results pagination
+        :param tenant_id: The tenant the query runs for
+        :param query_execution_id: The query execution ID of a succeeded query
+        :param page_size: The number of rows requested per page
+        :return: A generator of dicts mapping column names to values
+        """
+        client = self._client('athena', tenant_id)
+        request = {'QueryExecutionId': query_execution_id, 'MaxResults': page_size}
+        columns = None
+        while True:
+            page = client.get_query_results(**request)
+            rows = page['ResultSet']['Rows']
+            if columns is None:
+                columns = [c['Name'] for c in page['ResultSet']['ResultSetMetadata']['ColumnInfo']]
+                # the first row of the first page holds the column names
+                rows = rows[1:]
+            for row in rows:
+                yield dict(zip(columns, (field.get('VarCharValue') for field in row['Data'])))
+            if not page.get('NextToken'):
+                return
+            request['NextToken'] = page['NextToken']
+
+    def iter_rows_from_s3(self, tenant_id, execution):
+        """
+        Stream the rows of a query from its result CSV in S3
+        :param tenant_id: The tenant the query runs for
+        :param execution: The QueryExecution returned by wait
+        :return: A generator of dicts mapping column names to values
+        """
+        location = urlparse(execution['ResultConfiguration']['OutputLocation'])
+        body = self._client('s3', tenant_id).get_object(Bucket=location.netloc, Key=location.path.lstrip('/'))['Body']
+        reader = csv.reader(codecs.getreader('utf-8')(body))
+        columns = next(reader, None)
+        for row in reader:
+            yield dict(zip(columns, row))
+
+    def _result_size(self, tenant_id, execution):
+        location = urlparse(execution['ResultConfiguration']['OutputLocation'])
+        response = self._client('s3', tenant_id).head_object(Bucket=location.netloc, Key=location.path.lstrip('/'))
+        return response['ContentLength']
+
+    def execute(self, tenant_id, query, database, parameters=None, output_location=None, result_mode='api',
+                timeout_sec=None):
+        """
+        Run a query and stream its rows
+        :param tenant_id: The tenant the query runs for
+        :param query: The SQL query, with ? placeholders for parameters
+        :param database: The Glue database
+        :param parameters: Values bound to the ? placeholders, as strings
+        :param output_location: Overrides the executor output location
+        :param result_mode: 'api' pages through get_query_results, 's3' reads the result CSV,
+            'auto' reads from S3 when the result file is larger than s3_threshold_bytes
+        :param timeout_sec: Give up waiting for the query after this many seconds
+        :return: A generator of dicts mapping column names to values
+        """
+        query_execution_id = self.start(tenant_id, query, database, parameters, output_location)
+        execution = self.wait(tenant_id, query_execution_id, timeout_sec)
+        return self._rows(tenant_id, execution, result_mode)
+
+    def _rows(self, tenant_id, execution, result_mode):
+        if result_mode == 'auto':
+            result_mode = 's3' if self._result_size(tenant_id, execution) > self.s3_threshold_bytes else 'api'
+        if result_mode == 's3':
+            return self.iter_rows_from_s3(tenant_id, execution)
+        return self.iter_rows(tenant_id, execution['QueryExecutionId'])
+
+    def execute_many(self, queries, result_mode='api', timeout_sec=None):
+        """
+        Start many tenant queries at once and collect their results concurrently
+        :param queries: An iterable of (tenant_id, query, database) or (tenant_id, query, database, parameters)
+        :param result_mode: See execute
+        :param timeout_sec: Give up waiting for each query after this many seconds
+        :return: A list with the rows of each query, in the order of queries. A query that failed,
+            timed out or whose calls were refused has its AthenaQueryError, TimeoutError or ClientError
+            in place of the rows, so one query does not lose the results of the others.
+        """
+        started = []
+        for item in queries:
+            tenant_id, query, database = item[:3]
+            parameters = item[3] if len(item) > 3 else None
+            try:
+                started.append((tenant_id, self.start(tenant_id, query, database, parameters)))
+            except ClientError as err:
+                # a refused start or session only fails its own query, the others are already running
+                started.append((tenant_id, err))
+
+        def collect(entry):
+            tenant_id, query_execution_id = entry
+            if isinstance(query_execution_id, ClientError):
+                return query_execution_id
+            try:
+                execution = self.wait(tenant_id, query_execution_id, timeout_sec)
+                return list(self._rows(tenant_id, execution, result_mode))
+            except (AthenaQueryError, TimeoutError, ClientError) as err:
+                return err
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            return list(pool.map(collect, started))
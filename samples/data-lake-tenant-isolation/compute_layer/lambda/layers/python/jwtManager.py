@@ -0,0 +1,185 @@
+import hashlib
+import json
+import threading
+import time
+import urllib.request
+from collections import OrderedDict
+
+from jose import jwk, jwt
+from jose.exceptions import JOSEError
+from jose.utils import base64url_decode
+
+
+def fetch_jwks(keys_url):
+    """
+    Download a JSON Web Key Set
+    :param keys_url: The URL of the jwks.json document
+    :return: The list of keys in the set
+    """
+    with urllib.request.urlopen(keys_url) as f:
+        response = f.read()
+    return json.loads(response.decode('utf-8'))['keys']
+
+
+class _KeySet:
+    def __init__(self, keys, fetched_at):
+        self.keys = keys
+        self.fetched_at = fetched_at
+
+
+class JwksManager:
+    """
+    Constructed public keys per issuer, indexed by kid
+
+    Only the configured issuers are trusted: the iss claim of a token is not
+    verified yet when its key is looked up, so any other issuer is rejected
+    before a download, and at most one key set per configured issuer is kept.
+    A key set is refreshed when it is older than ttl_sec, or when a token carries
+    an unknown kid (key rotation). Refreshes of one issuer are rate limited to one
+    every min_refresh_interval_sec so unknown kids cannot be used to flood the issuer.
+    :param issuers: The trusted issuers, e.g. 'https://cognito-idp.<region>.amazonaws.com/<user pool id>'
+    :param ttl_sec: How long a downloaded key set is used before it is refreshed
+    :param min_refresh_interval_sec: Minimum time between two downloads of the same key set
+    :param fetch: Function returning the list of keys of a jwks.json URL
+    :param clock: Function returning the current epoch time, in seconds
+    """
+
+    def __init__(self, issuers, ttl_sec=3600, min_refresh_interval_sec=60, fetch=fetch_jwks, clock=time.time):
+        self.issuers = frozenset(issuer.rstrip('/') for issuer in issuers if issuer)
+        self.ttl_sec = ttl_sec
+        self.min_refresh_interval_sec = min_refresh_interval_sec
+        self.fetch = fetch
+        self.clock = clock
+        self.refreshes = 0
+        self._key_sets = {}
+        self._lock = threading.Lock()
+        # one download per issuer at a time, made without holding _lock
+        self._refresh_locks = {issuer: threading.Lock() for issuer in self.issuers}
+
+    def _needs_refresh(self, key_set, kid):
+        now = self.clock()
+        if key_set is None or now - key_set.fetched_at > self.ttl_sec:
+            return True
+        return kid not in key_set.keys and now - key_set.fetched_at >= self.min_refresh_interval_sec
+
+    def _refresh(self, issuer):
+        keys = {}
+        for key in self.fetch(issuer + '/.well-known/jwks.json'):
+            keys[key['kid']] = jwk.construct(key)
+        key_set = _KeySet(keys, self.clock())
+        with self._lock:
+            self._key_sets[issuer] = key_set
+            self.refreshes += 1
+        return key_set
+
+    def get_key(self, issuer, kid):
+        """
+        Get the constructed public key of an issuer
+        :param issuer: The iss claim of the token
+        :param kid: The kid header of the token
+        :return: The public key object
+        """
+        issuer = issuer.rstrip('/')
+        if issuer not in self.issuers:
+            raise ValueError('Untrusted token issuer')
+        with self._lock:
+            key_set = self._key_sets.get(issuer)
+        if self._needs_refresh(key_set, kid):
+            with self._refresh_locks[issuer]:
+                # another request may have refreshed the key set while this one waited
+                with self._lock:
+                    key_set = self._key_sets.get(issuer)
+                if self._needs_refresh(key_set, kid):
+                    key_set = self._refresh(issuer)
+        public_key = key_set.keys.get(kid)
+        if public_key is None:
+            raise ValueError('Public key not found in jwks.json')
+        return public_key
+
+
+class VerifiedTokenCache:
+    """
+    Bounded cache of the claims of tokens whose signature was already verified
+
+    Entries are keyed by the SHA-256 of the token, so raw tokens are not kept
+    in memory, and are never returned after the token's exp claim.
+    :param max_size: The maximum number of cached tokens
+    :param clock: Function returning the current epoch time, in seconds
+    """
+
+    def __init__(self, max_size=1024, clock=time.time):
+        self.max_size = max_size
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token):
+        return hashlib.sha256(token.encode('utf-8')).digest()
+
+    def get(self, token):
+        key = self._key(token)
+        with self._lock:
+            claims = self._entries.get(key)
+            if claims is None:
+                return None
+            if self.clock() > claims['exp']:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return claims
+
+    def put(self, token, claims):
+        with self._lock:
+            self._entries[self._key(token)] = claims
+            self._entries.move_to_end(self._key(token))
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+class TokenVerifier:
+    """
+    Verifies Cognito JWTs using a JwksManager and a VerifiedTokenCache
+
+    Malformed tokens raise ValueError, like tokens that fail verification.
+    :param issuers: The trusted issuers of the default JwksManager
+    :param jwks: The JwksManager, a default one is created for issuers when omitted
+    :param verified_tokens: The VerifiedTokenCache, a default one is created when omitted
+    :param clock: Function returning the current epoch time, in seconds
+    """
+
+    def __init__(self, issuers=(), jwks=None, verified_tokens=None, clock=time.time):
+        self.clock = clock
+        self.jwks = jwks or JwksManager(issuers, clock=clock)
+        self.verified_tokens = verified_tokens or VerifiedTokenCache(clock=clock)
+
+    def verify(self, token):
+        """
+        Verify the signature and expiration of a token
+        :param token: The encoded JWT
+        :return: The claims of the token
+        """
+        claims = self.verified_tokens.get(token)
+        if claims is not None:
+            return claims
+
+        try:
+            claims = jwt.get_unverified_claims(token)
+            kid = jwt.get_unverified_headers(token)['kid']
+            issuer = str(claims['iss'])
+            expires_at = float(claims['exp'])
+        except (JOSEError, KeyError, TypeError, ValueError) as err:
+            # garbage, or a token without the kid header or the iss and exp claims
+            raise ValueError('Malformed token') from err
+        public_key = self.jwks.get_key(issuer, kid)
+        # get the last two sections of the token,
+        # message and signature (encoded in base64)
+        message, encoded_signature = str(token).rsplit('.', 1)
+        decoded_signature = base64url_decode(encoded_signature.encode('utf-8'))
+        if not public_key.verify(message.encode('utf8'), decoded_signature):
+            raise ValueError('Signature verification failed')
+        if self.clock() > expires_at:
+            raise ValueError('Token is expired')
+
+        self.verified_tokens.put(token, claims)
+        return claims
@@ -0,0 +1,189 @@
+import threading
+import time
+from collections import OrderedDict
+
+import boto3
+
+def create_temp_tenant_session(access_role_arn, session_name, tenant_id, duration_sec):
+    """
+    Create a temporary session
+    :param access_role_arn: The ARN of the role that the caller is assuming
+    :param session_name: An identifier for the assumed session
+    :param tenant_id: The tenant identifier the session is created for
+    :param duration_sec: The duration, in seconds, of the temporary session
+    :return: The session object that allows you to create service clients and resources
+    """
+    sts = boto3.client('sts')
+    assume_role_response = sts.assume_role(
+        RoleArn=access_role_arn,
+        DurationSeconds=duration_sec,
+        RoleSessionName=session_name,
+        Tags=[
+            {
+                'Key': 'TenantID',
+                'Value': tenant_id
+            }
+        ]
+    )
+    session = boto3.Session(aws_access_key_id=assume_role_response['Credentials']['AccessKeyId'],
+                    aws_secret_access_key=assume_role_response['Credentials']['SecretAccessKey'],
+                    aws_session_token=assume_role_response['Credentials']['SessionToken'])
+    return session
+
+
+class _CachedSession:
+    def __init__(self, session, expiration):
+        self.session = session
+        self.expiration = expiration
+        self.clients = {}
+        self.clients_lock = threading.Lock()
+
+
+class TenantSessionCache:
+    """
+    Cache of tenant-scoped sessions keyed on (role ARN, tenant ID, session tags)
+
+    Sessions are refreshed refresh_margin_sec before their credentials expire, the
+    least recently used tenants are evicted beyond max_tenants, and concurrent
+    requests for a cold tenant share a single AssumeRole call.
+    :param max_tenants: The maximum number of cached tenant sessions
+    :param duration_sec: The duration, in seconds, of each temporary session
+    :param refresh_margin_sec: How long before expiry a session is refreshed
+    :param sts_client: The STS client, a default client is created when omitted
+    :param clock: Function returning the current epoch time, in seconds
+    """
+
+    def __init__(self, max_tenants=256, duration_sec=900, refresh_margin_sec=120, sts_client=None, clock=time.time):
+        self.max_tenants = max_tenants
+        self.duration_sec = duration_sec
+        self.refresh_margin_sec = refresh_margin_sec
+        self.clock = clock
+        self._sts = sts_client
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._metrics = {'hits': 0, 'misses': 0, 'refreshes': 0, 'evictions': 0}
+
+    @staticmethod
+    def _key(access_role_arn, tenant_id, tags):
+        return (access_role_arn, tenant_id, tuple(sorted((tags or {}).items())))
+
+    def _sts_client(self):
+        if self._sts is None:
+            self._sts = boto3.client('sts')
+        return self._sts
+
+    def _assume_role(self, access_role_arn, session_name, tenant_id, tags):
+        session_tags = [{'Key': 'TenantID', 'Value': tenant_id}]
+        session_tags += [{'Key': k, 'Value': v} for k, v in sorted((tags or {}).items())]
+        assume_role_response = self._sts_client().assume_role(
+            RoleArn=access_role_arn,
+            DurationSeconds=self.duration_sec,
+            RoleSessionName=session_name,
+            Tags=session_tags
+        )
+        credentials = assume_role_response['Credentials']
+        session = boto3.Session(aws_access_key_id=credentials['AccessKeyId'],
+                        aws_secret_access_key=credentials['SecretAccessKey'],
+                        aws_session_token=credentials['SessionToken'])
+        expiration = credentials.get('Expiration')
+        if hasattr(expiration, 'timestamp'):
+            expiration = expiration.timestamp()
+        elif expiration is None:
+            expiration = self.clock() + self.duration_sec
+        return _CachedSession(session, expiration)
+
+    def _fresh(self, entry):
+        return entry.expiration - self.refresh_margin_sec > self.clock()
+
+    def _get_entry(self, access_role_arn, tenant_id, session_name, tags):
+        key = self._key(access_role_arn, tenant_id, tags)
+        while True:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and self._fresh(entry):
+                    self._entries.move_to_end(key)
+                    self._metrics['hits'] += 1
+                    return entry
+                waiter = self._in_flight.get(key)
+                if waiter is not None and entry is not None and entry.expiration > self.clock():
+                    # Another caller is refreshing, the current credentials are still valid.
+                    self._metrics['hits'] += 1
+                    return entry
+                if waiter is None:
+                    # This caller becomes the leader and performs the AssumeRole call.
+                    waiter = threading.Event()
+                    self._in_flight[key] = waiter
+                    self._metrics['refreshes' if entry is not None else 'misses'] += 1
+                    break
+            waiter.wait()
+
+        try:
+            entry = self._assume_role(access_role_arn, session_name, tenant_id, tags)
+            with self._lock:
+                self._entries[key] = entry
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_tenants:
+                    self._entries.popitem(last=False)
+                    self._metrics['evictions'] += 1
+            return entry
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            waiter.set()
+
+    def get_session(self, access_role_arn, tenant_id, session_name='tenantSession', tags=None):
+        """
+        Get a cached tenant-scoped session, assuming the role only when needed
+        :param access_role_arn: The ARN of the role that the caller is assuming
+        :param tenant_id: The tenant identifier the session is created for
+        :param session_name: An identifier for the assumed session
+        :param tags: Additional session tags as a dict
+        :return: The boto3 session for the tenant
+        """
+        return self._get_entry(access_role_arn, tenant_id, session_name, tags).session
+
+    def client(self, service_name, access_role_arn, tenant_id, session_name='tenantSession', tags=None, **client_kwargs):
+        """
+        Get a service client built from the cached tenant session
+        :param service_name: The AWS service, e.g. 'athena'
+        :param access_role_arn: The ARN of the role that the caller is assuming
+        :param tenant_id: The tenant identifier the session is created for
+        :param session_name: An identifier for the assumed session
+        :param tags: Additional session tags as a dict
+        :return: The client, reused until the tenant session is refreshed or evicted
+        """
+        entry = self._get_entry(access_role_arn, tenant_id, session_name, tags)
+        client_key = (service_name, tuple(sorted(client_kwargs.items())))
+        with entry.clients_lock:
+            client = entry.clients.get(client_key)
+            if client is None:
+                client = entry.session.client(service_name, **client_kwargs)
+                entry.clients[client_key] = client
+        return client
+
+    def invalidate(self, access_role_arn, tenant_id, tags=None):
+        with self._lock:
+            self._entries.pop(self._key(access_role_arn, tenant_id, tags), None)
+
+    def metrics(self):
+        """
+        :return: A snapshot of the hit, miss, refresh and eviction counters and the cache size
+        """
+        with self._lock:
+            snapshot = dict(self._metrics)
+            snapshot['size'] = len(self._entries)
+        return snapshot
+
+
+tenant_session_cache = TenantSessionCache()
+
+def get_tenant_session(access_role_arn, session_name, tenant_id):
+    """
+    Cached counterpart of create_temp_tenant_session using the module level cache
+    :param access_role_arn: The ARN of the role that the caller is assuming
+    :param session_name: An identifier for the assumed session
+    :param tenant_id: The tenant identifier the session is created for
+    :return: The session object that allows you to create service clients and resources
+    """
+    return tenant_session_cache.get_session(access_role_arn, tenant_id, session_name=session_name)
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The Lambda sources live in folders that are not Python packages ("lambda" is a keyword),
+# so make them importable the same way the Lambda runtime does.
+LAMBDA_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'compute_layer', 'lambda')
+for path in ('layers/python', 'getTenantData'):
+    sys.path.insert(0, os.path.abspath(os.path.join(LAMBDA_DIR, path)))
@@ -0,0 +1,195 @@
+import csv
+import io
+import itertools
+import sqlite3
+import threading
+from urllib.parse import urlparse
+
+import pytest
+from botocore.exceptions import ClientError
+
+from athenaExecutor import AthenaQueryError, TenantAthenaExecutor
+
+
+class LocalS3:
+    def __init__(self):
+        self.objects = {}
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[(Bucket, Key)] = Body
+
+    def get_object(self, Bucket, Key):
+        return {'Body': io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def head_object(self, Bucket, Key):
+        return {'ContentLength': len(self.objects[(Bucket, Key)])}
+
+
+class LocalAthena:
+    """Runs queries on SQLite, writes result CSVs to LocalS3 and reports RUNNING for a few polls."""
+
+    def __init__(self, s3, polls_until_done=2):
+        self.s3 = s3
+        self.polls_until_done = polls_until_done
+        self.db = sqlite3.connect(':memory:', check_same_thread=False)
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.executions = {}
+        self.reused = 0
+        self.get_query_execution_calls = 0
+
+    def start_query_execution(self, QueryString, QueryExecutionContext, ResultConfiguration=None, WorkGroup=None,
+                              ExecutionParameters=None, ResultReuseConfiguration=None):
+        with self.lock:
+            reuse = (ResultReuseConfiguration or {}).get('ResultReuseByAgeConfiguration', {}).get('Enabled')
+            key = (QueryString, tuple(ExecutionParameters or ()))
+            for execution in self.executions.values():
+                if reuse and execution['key'] == key and execution['state'] == 'SUCCEEDED':
+                    self.reused += 1
+                    return {'QueryExecutionId': execution['id']}
+            query_execution_id = 'q-{0}'.format(next(self.ids))
+            output = '{0}{1}.csv'.format(ResultConfiguration['OutputLocation'], query_execution_id)
+            self.executions[query_execution_id] = {'id': query_execution_id, 'key': key, 'polls': 0,
+                                                   'state': 'RUNNING', 'output': output, 'error': None}
+            try:
+                cursor = self.db.execute(QueryString, ExecutionParameters or ())
+                columns = [c[0] for c in cursor.description]
+                rows = cursor.fetchall()
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerow(columns)
+                writer.writerows(rows)
+                location = urlparse(output)
+                self.s3.put_object(location.netloc, location.path.lstrip('/'), buffer.getvalue().encode('utf-8'))
+                self.executions[query_execution_id].update(columns=columns, rows=rows)
+            except sqlite3.Error as err:
+                self.executions[query_execution_id]['error'] = str(err)
+            return {'QueryExecutionId': query_execution_id}
+
+    def get_query_execution(self, QueryExecutionId):
+        with self.lock:
+            self.get_query_execution_calls += 1
+            execution = self.executions[QueryExecutionId]
+            execution['polls'] += 1
+            if execution['state'] == 'RUNNING' and execution['polls'] > self.polls_until_done:
+                execution['state'] = 'FAILED' if execution['error'] else 'SUCCEEDED'
+            status = {'State': execution['state']}
+            if execution['error']:
+                status['StateChangeReason'] = execution['error']
+            return {'QueryExecution': {'QueryExecutionId': QueryExecutionId, 'Status': status,
+                                       'ResultConfiguration': {'OutputLocation': execution['output']}}}
+
+    def get_query_results(self, QueryExecutionId, MaxResults=1000, NextToken=None):
+        execution = self.executions[QueryExecutionId]
+        header = [{'Data': [{'VarCharValue': c} for c in execution['columns']]}]
+        rows = header + [{'Data': [{'VarCharValue': str(v)} for v in row]} for row in execution['rows']]
+        start = int(NextToken or 0)
+        page = {'ResultSet': {'Rows': rows[start:start + MaxResults],
+                              'ResultSetMetadata': {'ColumnInfo': [{'Name': c} for c in execution['columns']]}}}
+        if start + MaxResults < len(rows):
+            page['NextToken'] = str(start + MaxResults)
+        return page
+
+
+class LocalSessionCache:
+    def __init__(self, clients):
+        self.clients = clients
+        self.tenants = []
+
+    def client(self, service_name, access_role_arn, tenant_id, session_name='tenantSession', **kwargs):
+        self.tenants.append(tenant_id)
+        return self.clients[service_name]
+
+
+@pytest.fixture
+def executor():
+    s3 = LocalS3()
+    athena = LocalAthena(s3)
+    athena.db.execute('CREATE TABLE orders (tenant TEXT, amount INTEGER)')
+    athena.db.executemany('INSERT INTO orders VALUES (?, ?)',
+                          [('tenant-1', i) for i in range(25)] + [('tenant-2', i) for i in range(5)])
+    cache = LocalSessionCache({'athena': athena, 's3': s3})
+    sleeps = []
+    executor = TenantAthenaExecutor(cache, 'arn:aws:iam::111122223333:role/TenantRole',
+                                    output_location='s3://results/athena/', sleep=sleeps.append,
+                                    s3_threshold_bytes=100)
+    executor.athena, executor.cache, executor.sleeps = athena, cache, sleeps
+    return executor
+
+
+def test_execute_polls_with_backoff_and_pages_results(executor):
+    query_execution_id = executor.start('tenant-1', 'SELECT amount FROM orders WHERE tenant = ?', 'db', ['tenant-1'])
+    executor.wait('tenant-1', query_execution_id)
+    assert executor.sleeps == [0.2, 0.2 * 1.5]
+
+    rows = executor.iter_rows('tenant-1', query_execution_id, page_size=10)
+    assert [int(r['amount']) for r in rows] == list(range(25))
+    assert set(executor.cache.tenants) == {'tenant-1'}
+
+
+def test_repeated_query_reuses_results(executor):
+    query = 'SELECT count(*) AS n FROM orders WHERE tenant = ?'
+    assert list(executor.execute('tenant-2', query, 'db', ['tenant-2'])) == [{'n': '5'}]
+    assert list(executor.execute('tenant-2', query, 'db', ['tenant-2'])) == [{'n': '5'}]
+    assert executor.athena.reused == 1
+
+
+def test_large_results_are_read_from_s3(executor):
+    rows = executor.execute('tenant-1', "SELECT tenant, amount FROM orders WHERE tenant = 'tenant-1'", 'db',
+                            result_mode='auto')
+    assert [r['amount'] for r in rows] == [str(i) for i in range(25)]
+
+
+def test_execute_many_collects_results_and_failures(executor):
+    results = executor.execute_many([
+        ('tenant-1', 'SELECT count(*) AS n FROM orders WHERE tenant = ?', 'db', ['tenant-1']),
+        ('tenant-2', 'SELECT count(*) AS n FROM orders WHERE tenant = ?', 'db', ['tenant-2']),
+        ('tenant-2', 'SELECT * FROM missing', 'db'),
+    ])
+    assert results[:2] == [[{'n': '25'}], [{'n': '5'}]]
+    assert isinstance(results[2], AthenaQueryError)
+    assert results[2].state == 'FAILED'
+
+
+def test_execute_many_collects_timeouts_and_client_errors(executor, monkeypatch):
+    athena = executor.athena
+    athena.polls_until_done = 0
+    poll = athena.get_query_execution
+
+    def get_query_execution(QueryExecutionId):
+        if QueryExecutionId == 'q-2':
+            raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}},
+                              'GetQueryExecution')
+        response = poll(QueryExecutionId)
+        if QueryExecutionId == 'q-3':
+            response['QueryExecution']['Status'] = {'State': 'RUNNING'}
+        return response
+
+    monkeypatch.setattr(athena, 'get_query_execution', get_query_execution)
+    query = 'SELECT count(*) AS n FROM orders WHERE tenant = ?'
+    results = executor.execute_many([('tenant-1', query, 'db', ['tenant-1']),
+                                     ('tenant-2', query, 'db', ['tenant-2']),
+                                     ('tenant-2', 'SELECT 1 AS n', 'db')], timeout_sec=0.1)
+    assert results[0] == [{'n': '25'}]
+    assert isinstance(results[1], ClientError)
+    assert isinstance(results[2], TimeoutError)
+
+
+def test_execute_many_collects_start_errors(executor, monkeypatch):
+    athena = executor.athena
+    start_query_execution = athena.start_query_execution
+
+    def refuse_tenant_2(**kwargs):
+        if kwargs.get('ExecutionParameters') == ['tenant-2']:
+            raise ClientError({'Error': {'Code': 'AccessDeniedException', 'Message': 'Not authorized'}},
+                              'StartQueryExecution')
+        return start_query_execution(**kwargs)
+
+    monkeypatch.setattr(athena, 'start_query_execution', refuse_tenant_2)
+    query = 'SELECT count(*) AS n FROM orders WHERE tenant = ?'
+    results = executor.execute_many([('tenant-1', query, 'db', ['tenant-1']),
+                                     ('tenant-2', query, 'db', ['tenant-2']),
+                                     ('tenant-1', 'SELECT 1 AS n', 'db')])
+    assert results[0] == [{'n': '25'}]
+    assert isinstance(results[1], ClientError)
+    assert results[2] == [{'n': '1'}]
@@ -0,0 +1,34 @@
+import json
+import os
+import subprocess
+import sys
+
+LAMBDA_DIR = os.path.join(os.path.dirname(__file__), '..', '..', 'compute_layer', 'lambda')
+
+
+def test_handler_module_keeps_unused_imports_out_of_init():
+    env = dict(os.environ, AWS_DEFAULT_REGION='us-east-1')
+    env['PYTHONPATH'] = os.pathsep.join(os.path.abspath(os.path.join(LAMBDA_DIR, path))
+                                        for path in ('getTenantData', 'layers/python'))
+    script = 'import sys, json, getTenantData; print(json.dumps(sorted(sys.modules)))'
+    result = subprocess.run([sys.executable, '-c', script], env=env, capture_output=True, text=True, check=True)
+    modules = set(json.loads(result.stdout))
+    assert not modules & {'flask', 'requests'}
+
+
+def test_handler_rejects_requests_without_token(monkeypatch):
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    import getTenantData
+
+    assert getTenantData.lambda_handler({'body': '{}'}, None)['statusCode'] == 500
+    response = getTenantData.lambda_handler({'headers': {'Host': 'example.com'}, 'body': '{}'}, None)
+    assert json.loads(response['body']) == {'message': 'Invalid token'}
+
+
+def test_handler_rejects_malformed_tokens(monkeypatch):
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    import getTenantData
+
+    for token in ('garbage', 'a.b.c', 'eyJhbGciOiJSUzI1NiJ9.eyJleHAiOjF9.c2ln'):
+        response = getTenantData.lambda_handler({'headers': {'Authorization': 'Bearer ' + token}, 'body': '{}'}, None)
+        assert json.loads(response['body']) == {'message': 'Invalid token'}
@@ -0,0 +1,144 @@
+import json
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('cryptography')
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk, jwt
+from jose.utils import base64url_encode
+
+from jwtManager import JwksManager, TokenVerifier
+
+ISSUER = 'https://cognito-idp.us-east-1.amazonaws.com/us-east-1_example'
+
+
+def make_key(kid):
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                    serialization.NoEncryption()).decode()
+    public_pem = key.public_key().public_bytes(serialization.Encoding.PEM,
+                                               serialization.PublicFormat.SubjectPublicKeyInfo)
+    public_key = jwk.construct(public_pem, 'RS256').to_dict()
+    public_key.update({'kid': kid, 'alg': 'RS256'})
+    return private_pem, public_key
+
+
+def sign(private_pem, kid, exp):
+    return jwt.encode({'iss': ISSUER, 'exp': exp, 'custom:tenant_id': 'tenant-1'}, private_pem,
+                      algorithm='RS256', headers={'kid': kid})
+
+
+class Clock:
+    def __init__(self):
+        self.now = time.time()
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(scope='module')
+def keys():
+    return {kid: make_key(kid) for kid in ('kid-1', 'kid-2')}
+
+
+def test_repeat_token_skips_key_lookup(keys):
+    fetches = []
+    clock = Clock()
+    verifier = TokenVerifier(jwks=JwksManager([ISSUER], fetch=lambda url: fetches.append(url) or [keys['kid-1'][1]],
+                                              clock=clock), clock=clock)
+    token = sign(keys['kid-1'][0], 'kid-1', int(clock.now) + 60)
+    assert verifier.verify(token)['custom:tenant_id'] == 'tenant-1'
+    assert verifier.verify(token)['custom:tenant_id'] == 'tenant-1'
+    assert fetches == [ISSUER + '/.well-known/jwks.json']
+
+    clock.now += 120
+    with pytest.raises(ValueError, match='expired'):
+        verifier.verify(token)
+
+
+def test_unknown_kid_refreshes_rate_limited(keys):
+    published = [keys['kid-1'][1]]
+    fetches = []
+    clock = Clock()
+
+    def fetch(url):
+        fetches.append(url)
+        return list(published)
+
+    verifier = TokenVerifier(jwks=JwksManager([ISSUER], fetch=fetch, min_refresh_interval_sec=60, clock=clock), clock=clock)
+    verifier.verify(sign(keys['kid-1'][0], 'kid-1', int(clock.now) + 3600))
+
+    # the issuer rotates in kid-2, but the key set was fetched too recently to refresh again
+    published.append(keys['kid-2'][1])
+    rotated = sign(keys['kid-2'][0], 'kid-2', int(clock.now) + 3600)
+    with pytest.raises(ValueError, match='Public key not found'):
+        verifier.verify(rotated)
+    assert len(fetches) == 1
+
+    clock.now += 61
+    assert verifier.verify(rotated)['iss'] == ISSUER
+    assert len(fetches) == 2
+
+
+def test_tampered_token_is_rejected(keys):
+    verifier = TokenVerifier(jwks=JwksManager([ISSUER], fetch=lambda url: [keys['kid-1'][1]]))
+    forged = sign(keys['kid-2'][0], 'kid-1', int(time.time()) + 60)
+    with pytest.raises(ValueError, match='Signature verification failed'):
+        verifier.verify(forged)
+
+
+def unsigned(header, claims):
+    encode = lambda part: base64url_encode(json.dumps(part).encode('utf-8')).decode('utf-8')
+    return '{0}.{1}.{2}'.format(encode(header), encode(claims), 'c2lnbmF0dXJl')
+
+
+@pytest.mark.parametrize('token', [
+    'not-a-token',
+    'a.b.c',
+    unsigned({'alg': 'RS256'}, {'iss': ISSUER, 'exp': int(time.time()) + 60}),
+    unsigned({'alg': 'RS256', 'kid': 'kid-1'}, {'iss': ISSUER}),
+    unsigned({'alg': 'RS256', 'kid': 'kid-1'}, {'exp': int(time.time()) + 60}),
+], ids=['garbage', 'bad-segments', 'no-kid', 'no-exp', 'no-iss'])
+def test_malformed_token_raises_value_error(keys, token):
+    fetches = []
+    verifier = TokenVerifier(jwks=JwksManager([ISSUER], fetch=lambda url: fetches.append(url) or [keys['kid-1'][1]]))
+    with pytest.raises(ValueError, match='Malformed token'):
+        verifier.verify(token)
+    assert fetches == []
+
+
+def test_untrusted_issuer_is_rejected_before_fetching(keys):
+    fetches = []
+    verifier = TokenVerifier(jwks=JwksManager([ISSUER], fetch=lambda url: fetches.append(url) or [keys['kid-1'][1]]))
+    for n in range(3):
+        token = jwt.encode({'iss': 'https://attacker.example/{0}'.format(n), 'exp': int(time.time()) + 60},
+                           keys['kid-1'][0], algorithm='RS256', headers={'kid': 'kid-1'})
+        with pytest.raises(ValueError, match='Untrusted token issuer'):
+            verifier.verify(token)
+    assert fetches == []
+    assert verifier.jwks._key_sets == {}
+
+
+def test_concurrent_refreshes_fetch_once(keys):
+    fetches = []
+    release = threading.Event()
+
+    def fetch(url):
+        fetches.append(url)
+        release.wait(5)
+        return [keys['kid-1'][1]]
+
+    jwks = JwksManager([ISSUER], fetch=fetch)
+    threads = [threading.Thread(target=jwks.get_key, args=(ISSUER, 'kid-1')) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    # the download does not hold the lock of the key sets
+    assert jwks._lock.acquire(timeout=1)
+    jwks._lock.release()
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(fetches) == 1
@@ -0,0 +1,87 @@
+import threading
+import time
+
+from tempSession import TenantSessionCache
+
+ROLE_ARN = 'arn:aws:iam::111122223333:role/TenantRole'
+
+
+class FakeSts:
+    def __init__(self, duration=900, delay=0.0):
+        self.calls = 0
+        self.duration = duration
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.now = 1000.0
+
+    def assume_role(self, RoleArn, DurationSeconds, RoleSessionName, Tags):
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        return {'Credentials': {
+            'AccessKeyId': 'AKIA' + str(self.calls),
+            'SecretAccessKey': 'secret',
+            'SessionToken': 'token',
+            'Expiration': self.now + self.duration,
+        }}
+
+
+def make_cache(sts, **kwargs):
+    return TenantSessionCache(sts_client=sts, clock=lambda: sts.now, **kwargs)
+
+
+def test_session_is_reused_until_refresh_margin():
+    sts = FakeSts()
+    cache = make_cache(sts, refresh_margin_sec=60)
+    first = cache.get_session(ROLE_ARN, 'tenant-1')
+    assert cache.get_session(ROLE_ARN, 'tenant-1') is first
+    assert sts.calls == 1
+
+    sts.now += 900 - 30
+    assert cache.get_session(ROLE_ARN, 'tenant-1') is not first
+    assert sts.calls == 2
+    assert cache.metrics() == {'hits': 1, 'misses': 1, 'refreshes': 1, 'evictions': 0, 'size': 1}
+
+
+def test_tags_are_part_of_the_key():
+    sts = FakeSts()
+    cache = make_cache(sts)
+    cache.get_session(ROLE_ARN, 'tenant-1', tags={'Tier': 'gold'})
+    cache.get_session(ROLE_ARN, 'tenant-1', tags={'Tier': 'basic'})
+    assert sts.calls == 2
+
+
+def test_least_recently_used_tenant_is_evicted():
+    sts = FakeSts()
+    cache = make_cache(sts, max_tenants=2)
+    cache.get_session(ROLE_ARN, 'tenant-1')
+    cache.get_session(ROLE_ARN, 'tenant-2')
+    cache.get_session(ROLE_ARN, 'tenant-1')
+    cache.get_session(ROLE_ARN, 'tenant-3')
+    assert cache.metrics()['evictions'] == 1
+    cache.get_session(ROLE_ARN, 'tenant-1')
+    assert sts.calls == 3
+    cache.get_session(ROLE_ARN, 'tenant-2')
+    assert sts.calls == 4
+
+
+def test_cold_tenant_burst_makes_a_single_assume_role_call():
+    sts = FakeSts(delay=0.05)
+    cache = make_cache(sts)
+    sessions = []
+    threads = [threading.Thread(target=lambda: sessions.append(cache.get_session(ROLE_ARN, 'tenant-1')))
+               for _ in range(20)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sts.calls == 1
+    assert len(set(map(id, sessions))) == 1
+
+
+def test_clients_are_reused_per_session():
+    sts = FakeSts()
+    cache = make_cache(sts)
+    client = cache.client('athena', ROLE_ARN, 'tenant-1', region_name='us-east-1')
+    assert cache.client('athena', ROLE_ARN, 'tenant-1', region_name='us-east-1') is client
+    assert cache.client('athena', ROLE_ARN, 'tenant-2', region_name='us-east-1') is not client
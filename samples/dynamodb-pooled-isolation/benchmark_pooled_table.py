@@ -0,0 +1,171 @@
+"""
+Load test of the pooled table: a naive client against PooledTable.
+
+Every tenant writes its items, reads them back by key and queries them, all
+tenants at the same time. Tenant sizes follow a Zipf distribution, so the
+first tenants are much larger than the rest:
+
+* naive             - AssumeRole and a new client for every request, then a single-item PutItem or GetItem
+* pooled            - TenantSessionCache, BatchWriteItem / BatchGetItem and paginated queries
+* pooled+sharding   - the same, with the --shard-tenants largest tenants spread over --shards partition keys
+
+The table is served by local_dynamodb.py, which limits the throughput of each
+partition key like DynamoDB does, or by DynamoDB Local with --dynamodb-endpoint,
+which does not. STS is always the local stand-in:
+
+    python benchmark_pooled_table.py --tenants 10 --items 10000
+    java -Djava.library.path=./DynamoDBLocal_lib -jar DynamoDBLocal.jar -inMemory
+    python benchmark_pooled_table.py --dynamodb-endpoint http://localhost:8000
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+
+from local_dynamodb import LocalDynamoDB, LocalSts
+from pooled_table import PooledTable, TenantSessionCache
+
+ROLE_ARN = 'arn:aws:iam::111122223333:role/TenantRole'
+
+
+def tenant_sizes(tenants, items, skew):
+    weights = [1.0 / (t + 1) ** skew for t in range(tenants)]
+    return {'tenant-{0}'.format(t + 1): max(1, int(items * w / sum(weights))) for t, w in enumerate(weights)}
+
+
+def tenant_items(tenant_id, count):
+    return [{'sk': 'order#{0:07d}'.format(n), 'tenant': tenant_id, 'total': n % 100, 'status': 'OPEN'}
+            for n in range(count)]
+
+
+def dynamodb_local_client(endpoint, credentials=None):
+    credentials = credentials or {'AccessKeyId': 'local', 'SecretAccessKey': 'local', 'SessionToken': None}
+    return boto3.client('dynamodb', endpoint_url=endpoint, region_name='us-east-1',
+                        aws_access_key_id=credentials['AccessKeyId'],
+                        aws_secret_access_key=credentials['SecretAccessKey'],
+                        aws_session_token=credentials['SessionToken'])
+
+
+def create_table(client, table_name):
+    try:
+        client.delete_table(TableName=table_name)
+        client.get_waiter('table_not_exists').wait(TableName=table_name)
+    except client.exceptions.ResourceNotFoundException:
+        pass
+    client.create_table(
+        TableName=table_name,
+        KeySchema=[{'AttributeName': 'pk', 'KeyType': 'HASH'}, {'AttributeName': 'sk', 'KeyType': 'RANGE'}],
+        AttributeDefinitions=[{'AttributeName': 'pk', 'AttributeType': 'S'},
+                              {'AttributeName': 'sk', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST',
+    )
+    client.get_waiter('table_exists').wait(TableName=table_name)
+
+
+def run_naive(sts, client_factory, table_name, sizes, workers):
+    def client_for_tenant(tenant_id):
+        # a naive microservice assumes the TenantRole for every request
+        credentials = sts.assume_role(RoleArn=ROLE_ARN, RoleSessionName=tenant_id, DurationSeconds=900,
+                                      Tags=[{'Key': 'tenant', 'Value': tenant_id}])['Credentials']
+        return client_factory(credentials)
+
+    table = PooledTable(client_for_tenant, table_name, max_retries=20)
+
+    def run_tenant(tenant_id, count):
+        items = tenant_items(tenant_id, count)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            start = time.perf_counter()
+            list(pool.map(lambda item: table.put_item(tenant_id, item), items))
+            written = time.perf_counter()
+            list(pool.map(lambda item: table.get_item(tenant_id, item['sk']), items))
+            read = time.perf_counter()
+        queried = len(table.query(tenant_id))
+        return count, written - start, read - written, time.perf_counter() - read, queried
+
+    return run_all(sizes, run_tenant), table
+
+
+def run_pooled(sts, client_factory, table_name, sizes, workers, shard_counts):
+    sessions = TenantSessionCache(sts, ROLE_ARN, client_factory)
+    table = PooledTable(sessions, table_name, shard_counts=shard_counts, max_workers=workers, max_retries=20)
+
+    def run_tenant(tenant_id, count):
+        items = tenant_items(tenant_id, count)
+        start = time.perf_counter()
+        table.batch_write(tenant_id, items)
+        written = time.perf_counter()
+        found = table.batch_get(tenant_id, [item['sk'] for item in items])
+        read = time.perf_counter()
+        assert len(found) == count, (tenant_id, len(found), count)
+        queried = len(table.query(tenant_id))
+        return count, written - start, read - written, time.perf_counter() - read, queried
+
+    return run_all(sizes, run_tenant), table
+
+
+def run_all(sizes, run_tenant):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(sizes)) as pool:
+        futures = {tenant_id: pool.submit(run_tenant, tenant_id, count) for tenant_id, count in sizes.items()}
+        results = {tenant_id: future.result() for tenant_id, future in futures.items()}
+    return results, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tenants', type=int, default=10)
+    parser.add_argument('--items', type=int, default=10000, help='items over all tenants')
+    parser.add_argument('--skew', type=float, default=1.2, help='Zipf exponent of the tenant sizes')
+    parser.add_argument('--workers', type=int, default=8, help='concurrent calls per tenant')
+    parser.add_argument('--round-trip-ms', type=float, default=5.0)
+    parser.add_argument('--sts-ms', type=float, default=30.0, help='latency of AssumeRole')
+    parser.add_argument('--partition-writes-per-sec', type=int, default=1000)
+    parser.add_argument('--partition-reads-per-sec', type=int, default=3000)
+    parser.add_argument('--shard-tenants', type=int, default=2, help='the largest tenants get write shards')
+    parser.add_argument('--shards', type=int, default=8)
+    parser.add_argument('--dynamodb-endpoint', help='e.g. http://localhost:8000 for DynamoDB Local')
+    parser.add_argument('--skip-naive', action='store_true')
+    args = parser.parse_args()
+
+    sizes = tenant_sizes(args.tenants, args.items, args.skew)
+    largest = sorted(sizes, key=lambda t: -sizes[t])[:args.shard_tenants]
+    modes = [('naive', None), ('pooled', {}), ('pooled+sharding', {t: args.shards for t in largest})]
+    if args.skip_naive:
+        modes = modes[1:]
+
+    print('{0:<16} {1:<10} {2:>7} {3:>11} {4:>11} {5:>11} {6:>9}'.format(
+        'mode', 'tenant', 'items', 'writes/s', 'reads/s', 'query ms', 'shards'))
+    for mode, shard_counts in modes:
+        sts = LocalSts(args.sts_ms)
+        table_name = 'pooled_{0}'.format(mode.replace('+', '_'))
+        if args.dynamodb_endpoint:
+            create_table(dynamodb_local_client(args.dynamodb_endpoint), table_name)
+
+            def client_factory(credentials):
+                return dynamodb_local_client(args.dynamodb_endpoint, credentials)
+        else:
+            local = LocalDynamoDB(args.round_trip_ms, args.partition_writes_per_sec, args.partition_reads_per_sec)
+
+            def client_factory(credentials, local=local):
+                return local
+
+        if shard_counts is None:
+            (results, elapsed), table = run_naive(sts, client_factory, table_name, sizes, args.workers)
+        else:
+            (results, elapsed), table = run_pooled(sts, client_factory, table_name, sizes, args.workers, shard_counts)
+        for tenant_id, (count, write_sec, read_sec, query_sec, queried) in results.items():
+            assert queried == count, (mode, tenant_id, queried, count)
+            print('{0:<16} {1:<10} {2:>7} {3:>11.0f} {4:>11.0f} {5:>11.1f} {6:>9}'.format(
+                mode, tenant_id, count, count / write_sec, count / read_sec, query_sec * 1000,
+                table.shard_count(tenant_id)))
+        total = sum(sizes.values())
+        print('{0:<16} {1:<10} {2:>7} elapsed {3:.2f}s, {4:.0f} items/s, {5} DynamoDB calls, {6} throttled, '
+              '{7} unprocessed retries, {8} AssumeRole calls'.format(
+                  mode, 'all', total, elapsed, 2 * total / elapsed, table.metrics['calls'], table.metrics['throttles'],
+                  table.metrics['unprocessed_retries'], sts.calls))
+        table.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+"""
+In-memory stand-ins for the DynamoDB and STS calls of the pooled table.
+
+LocalDynamoDB accepts the put_item, get_item, delete_item, batch_get_item,
+batch_write_item and query calls that PooledTable makes on
+boto3.client('dynamodb') for a table with a string partition and sort key.
+Every call sleeps for round_trip_ms. Like a DynamoDB partition, each partition key
+accepts at most partition_writes_per_sec writes and partition_reads_per_sec
+reads per second. Calls above it raise ProvisionedThroughputExceededException,
+and batch calls return the excess as UnprocessedItems or UnprocessedKeys.
+DynamoDB Local does not enforce partition limits, so hot partitions only show up here.
+
+LocalSts answers assume_role with fake credentials after round_trip_ms.
+"""
+import copy
+import datetime
+import threading
+import time
+import uuid
+
+from botocore.exceptions import ClientError
+
+
+def throughput_exceeded(operation_name):
+    return ClientError({'Error': {'Code': 'ProvisionedThroughputExceededException',
+                                  'Message': 'The level of configured provisioned throughput for the table was exceeded'}},
+                       operation_name)
+
+
+class LocalDynamoDB:
+    """
+    dynamodb client stand-in
+    :param round_trip_ms: Simulated network latency added to every call
+    :param partition_writes_per_sec: Writes per second one partition key accepts, None for no limit
+    :param partition_reads_per_sec: Reads per second one partition key accepts, None for no limit
+    :param partition_key: The partition key attribute
+    :param sort_key: The sort key attribute
+    :param page_size: The number of items of a query page
+    """
+
+    def __init__(self, round_trip_ms=0.0, partition_writes_per_sec=1000, partition_reads_per_sec=3000,
+                 partition_key='pk', sort_key='sk', page_size=100):
+        self.round_trip_ms = round_trip_ms
+        self.partition_writes_per_sec = partition_writes_per_sec
+        self.partition_reads_per_sec = partition_reads_per_sec
+        self.partition_key = partition_key
+        self.sort_key = sort_key
+        self.page_size = page_size
+        self.tables = {}
+        self.calls = {}
+        self._usage = {}
+        self._lock = threading.Lock()
+
+    def _round_trip(self, operation_name):
+        with self._lock:
+            self.calls[operation_name] = self.calls.get(operation_name, 0) + 1
+        if self.round_trip_ms:
+            time.sleep(self.round_trip_ms / 1000.0)
+
+    @property
+    def total_calls(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+    def reset_calls(self):
+        with self._lock:
+            self.calls = {}
+
+    def _consume(self, kind, partition, units=1):
+        # called with the lock held, a partition's capacity is counted per wall clock second
+        limit = self.partition_writes_per_sec if kind == 'write' else self.partition_reads_per_sec
+        if limit is None:
+            return True
+        second = int(time.monotonic())
+        key = (kind, partition)
+        window, used = self._usage.get(key, (second, 0))
+        if window != second:
+            used = 0
+        if used + units > limit:
+            self._usage[key] = (second, used)
+            return False
+        self._usage[key] = (second, used + units)
+        return True
+
+    def _keys(self, key):
+        return key[self.partition_key]['S'], key[self.sort_key]['S']
+
+    def _table(self, name):
+        return self.tables.setdefault(name, {})
+
+    def put_item(self, TableName, Item, **kwargs):
+        self._round_trip('PutItem')
+        pk, sk = self._keys(Item)
+        with self._lock:
+            if not self._consume('write', pk):
+                raise throughput_exceeded('PutItem')
+            self._table(TableName).setdefault(pk, {})[sk] = copy.deepcopy(Item)
+        return {}
+
+    def get_item(self, TableName, Key, ConsistentRead=False, **kwargs):
+        self._round_trip('GetItem')
+        pk, sk = self._keys(Key)
+        with self._lock:
+            if not self._consume('read', pk):
+                raise throughput_exceeded('GetItem')
+            item = self._table(TableName).get(pk, {}).get(sk)
+        return {'Item': copy.deepcopy(item)} if item is not None else {}
+
+    def delete_item(self, TableName, Key, **kwargs):
+        self._round_trip('DeleteItem')
+        pk, sk = self._keys(Key)
+        with self._lock:
+            if not self._consume('write', pk):
+                raise throughput_exceeded('DeleteItem')
+            self._table(TableName).get(pk, {}).pop(sk, None)
+        return {}
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        self._round_trip('BatchGetItem')
+        responses, unprocessed = {}, {}
+        with self._lock:
+            for table_name, request in RequestItems.items():
+                if len(request['Keys']) > 100:
+                    raise ClientError({'Error': {'Code': 'ValidationException',
+                                                 'Message': 'Too many items requested for the BatchGetItem call'}},
+                                      'BatchGetItem')
+                table = self._table(table_name)
+                found = responses.setdefault(table_name, [])
+                for key in request['Keys']:
+                    pk, sk = self._keys(key)
+                    if not self._consume('read', pk):
+                        unprocessed.setdefault(table_name, {'Keys': []})['Keys'].append(key)
+                        continue
+                    item = table.get(pk, {}).get(sk)
+                    if item is not None:
+                        found.append(copy.deepcopy(item))
+        return {'Responses': responses, 'UnprocessedKeys': unprocessed}
+
+    @staticmethod
+    def _request_key(request):
+        return request['PutRequest']['Item'] if 'PutRequest' in request else request['DeleteRequest']['Key']
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        self._round_trip('BatchWriteItem')
+        unprocessed = {}
+        with self._lock:
+            # like DynamoDB, a request that is invalid as a whole writes nothing
+            for table_name, requests in RequestItems.items():
+                if len(requests) > 25:
+                    raise ClientError({'Error': {'Code': 'ValidationException',
+                                                 'Message': 'Too many items requested for the BatchWriteItem call'}},
+                                      'BatchWriteItem')
+                keys = [self._keys(self._request_key(request)) for request in requests]
+                if len(set(keys)) != len(keys):
+                    raise ClientError({'Error': {'Code': 'ValidationException',
+                                                 'Message': 'Provided list of item keys contains duplicates'}},
+                                      'BatchWriteItem')
+            for table_name, requests in RequestItems.items():
+                table = self._table(table_name)
+                for request in requests:
+                    key = self._request_key(request)
+                    pk, sk = self._keys(key)
+                    if not self._consume('write', pk):
+                        unprocessed.setdefault(table_name, []).append(request)
+                    elif 'PutRequest' in request:
+                        table.setdefault(pk, {})[sk] = copy.deepcopy(key)
+                    else:
+                        table.get(pk, {}).pop(sk, None)
+        return {'UnprocessedItems': unprocessed}
+
+    def query(self, TableName, KeyConditionExpression, ExpressionAttributeValues, ExpressionAttributeNames=None,
+              Limit=None, ExclusiveStartKey=None, ConsistentRead=False, **kwargs):
+        # only the key conditions PooledTable builds: '#pk = :pk' and an optional 'AND begins_with(#sk, :prefix)'
+        self._round_trip('Query')
+        pk = ExpressionAttributeValues[':pk']['S']
+        prefix = ExpressionAttributeValues.get(':prefix', {}).get('S', '')
+        start = ExclusiveStartKey[self.sort_key]['S'] if ExclusiveStartKey else None
+        page_size = min(Limit or self.page_size, self.page_size)
+        with self._lock:
+            if not self._consume('read', pk):
+                raise throughput_exceeded('Query')
+            partition = self._table(TableName).get(pk, {})
+            sort_keys = sorted(sk for sk in partition if sk.startswith(prefix) and (start is None or sk > start))
+            items = [copy.deepcopy(partition[sk]) for sk in sort_keys[:page_size]]
+        response = {'Items': items, 'Count': len(items)}
+        if len(sort_keys) > page_size:
+            response['LastEvaluatedKey'] = {self.partition_key: {'S': pk}, self.sort_key: {'S': sort_keys[page_size - 1]}}
+        return response
+
+
+class LocalSts:
+    """
+    sts client stand-in
+    :param round_trip_ms: Simulated latency of every call
+    """
+
+    def __init__(self, round_trip_ms=0.0):
+        self.round_trip_ms = round_trip_ms
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def assume_role(self, RoleArn, RoleSessionName, DurationSeconds=3600, Tags=None, **kwargs):
+        with self._lock:
+            self.calls += 1
+        if self.round_trip_ms:
+            time.sleep(self.round_trip_ms / 1000.0)
+        expiration = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=DurationSeconds)
+        return {
+            'Credentials': {
+                'AccessKeyId': 'ASIA' + uuid.uuid4().hex[:16].upper(),
+                'SecretAccessKey': uuid.uuid4().hex,
+                'SessionToken': uuid.uuid4().hex,
+                'Expiration': expiration,
+            },
+            'AssumedRoleUser': {'AssumedRoleId': 'AROA:' + RoleSessionName, 'Arn': RoleArn + '/' + RoleSessionName},
+        }
@@ -0,0 +1,360 @@
+"""
+Data access layer for the DynamoDB pooled isolation reference architecture.
+
+All tenants share one table. Every partition key starts with the tenant ID, so
+the TenantScoped policy's dynamodb:LeadingKeys condition still holds for each
+call (see tenant_scoped_policy.json):
+
+* TenantSessionCache assumes the TenantRole once per tenant with the tenant
+  session tag and reuses the scoped client until its credentials are about to
+  expire, instead of calling STS on every request.
+* PooledTable builds the tenant's keys and groups the tenant's operations into
+  BatchGetItem and BatchWriteItem calls, retrying unprocessed items with backoff.
+  A hot tenant can be given a shard count: its items are spread over the
+  partition keys 'tenant-1#0' ... 'tenant-1#<n-1>' by a hash of the sort key,
+  point reads go to the one shard of the item, and queries read all shards in
+  parallel and merge the pages.
+* The parallel calls of all tenants share one pool of workers. Each tenant has
+  at most max_workers_per_tenant calls on it at a time, so a throttled tenant
+  backing off in its workers does not hold up the calls of the others.
+
+Items are plain Python dicts, e.g. {'sk': 'order#0001', 'total': 12}. The
+partition key attribute is set by PooledTable and removed from the items it returns.
+"""
+import random
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
+from botocore.exceptions import ClientError
+
+KEY_SEPARATOR = '#'
+BATCH_GET_MAX_KEYS = 100
+BATCH_WRITE_MAX_ITEMS = 25
+THROTTLING_ERROR_CODES = ('ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded')
+
+
+def is_throttling_error(err):
+    return isinstance(err, ClientError) and err.response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+
+
+def validate_tenant_id(tenant_id):
+    # 'tenant-1' must not be able to reach 'tenant-1#...' keys of another tenant through its prefix
+    if not tenant_id or KEY_SEPARATOR in tenant_id:
+        raise ValueError('Invalid tenant ID {0!r}'.format(tenant_id))
+    return tenant_id
+
+
+class TenantSessionCache:
+    """
+    Tenant-scoped DynamoDB clients from STS AssumeRole with the tenant session tag, reused until they expire
+    :param sts: The STS client of the microservice
+    :param role_arn: The ARN of the TenantRole
+    :param client_factory: Function of an AssumeRole Credentials dict returning a DynamoDB client
+    :param duration_sec: The duration of the scoped credentials
+    :param refresh_margin_sec: Credentials are renewed this long before they expire
+    :param tag_key: The session tag holding the tenant ID, ${aws:PrincipalTag/<tag_key>} in the policy
+    :param clock: Function returning the current time, in seconds since the epoch
+    """
+
+    def __init__(self, sts, role_arn, client_factory, duration_sec=900, refresh_margin_sec=60, tag_key='tenant',
+                 clock=time.time):
+        self.sts = sts
+        self.role_arn = role_arn
+        self.client_factory = client_factory
+        self.duration_sec = duration_sec
+        self.refresh_margin_sec = refresh_margin_sec
+        self.tag_key = tag_key
+        self.clock = clock
+        self.metrics = {'hits': 0, 'assume_role_calls': 0}
+        self._clients = {}
+        self._lock = threading.Lock()
+        self._tenant_locks = {}
+
+    def client(self, tenant_id):
+        """
+        Get the scoped DynamoDB client of a tenant
+        :param tenant_id: The tenant identifier
+        :return: A DynamoDB client that can only access the tenant's items
+        """
+        validate_tenant_id(tenant_id)
+        with self._lock:
+            cached = self._clients.get(tenant_id)
+            if cached is not None and cached[1] - self.refresh_margin_sec > self.clock():
+                self.metrics['hits'] += 1
+                return cached[0]
+            tenant_lock = self._tenant_locks.setdefault(tenant_id, threading.Lock())
+        # one AssumeRole per tenant at a time, other threads of the tenant wait for its result
+        with tenant_lock:
+            with self._lock:
+                cached = self._clients.get(tenant_id)
+                if cached is not None and cached[1] - self.refresh_margin_sec > self.clock():
+                    self.metrics['hits'] += 1
+                    return cached[0]
+                self.metrics['assume_role_calls'] += 1
+            credentials = self.sts.assume_role(
+                RoleArn=self.role_arn,
+                RoleSessionName=tenant_id,
+                DurationSeconds=self.duration_sec,
+                Tags=[{'Key': self.tag_key, 'Value': tenant_id}],
+            )['Credentials']
+            client = self.client_factory(credentials)
+            with self._lock:
+                self._clients[tenant_id] = (client, credentials['Expiration'].timestamp())
+            return client
+
+    def __call__(self, tenant_id):
+        return self.client(tenant_id)
+
+
+class PooledTable:
+    """
+    Tenant-scoped access to the pooled table
+    :param client_for_tenant: Function of a tenant ID returning the DynamoDB client to use, e.g. a
+        TenantSessionCache, or lambda tenant_id: client
+    :param table_name: The pooled table
+    :param partition_key: The partition key attribute, a string starting with the tenant ID
+    :param sort_key: The sort key attribute, a string
+    :param shard_counts: A dict of tenant IDs and the number of partition keys their items are spread over.
+        Do not change the shard count of a tenant that has items, point reads would look in the wrong shard
+    :param max_workers: The number of calls run in parallel by batch operations and scatter-gather queries
+    :param max_workers_per_tenant: The number of those calls one tenant can run at a time, max_workers // 2 by default
+    :param max_retries: Retries of throttled calls and unprocessed items
+    :param base_delay: The initial backoff delay, in seconds
+    :param max_delay: The upper bound of the backoff delay, in seconds
+    """
+
+    def __init__(self, client_for_tenant, table_name, partition_key='pk', sort_key='sk', shard_counts=None,
+                 max_workers=8, max_workers_per_tenant=None, max_retries=8, base_delay=0.05, max_delay=2.0):
+        self.client_for_tenant = client_for_tenant
+        self.table_name = table_name
+        self.partition_key = partition_key
+        self.sort_key = sort_key
+        self.shard_counts = dict(shard_counts or {})
+        self.max_workers_per_tenant = max_workers_per_tenant or max(1, max_workers // 2)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.metrics = {'calls': 0, 'throttles': 0, 'unprocessed_retries': 0}
+        self._serializer = TypeSerializer()
+        self._deserializer = TypeDeserializer()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='pooled-table')
+        self._lock = threading.Lock()
+        self._tenant_slots = {}
+
+    def shard_count(self, tenant_id):
+        return self.shard_counts.get(tenant_id, 1)
+
+    def partition_keys(self, tenant_id):
+        """
+        All partition keys of a tenant
+        :param tenant_id: The tenant identifier
+        :return: ['tenant-1'] or ['tenant-1#0', ..., 'tenant-1#<n-1>'] for a sharded tenant
+        """
+        validate_tenant_id(tenant_id)
+        count = self.shard_count(tenant_id)
+        if count == 1:
+            return [tenant_id]
+        return ['{0}{1}{2}'.format(tenant_id, KEY_SEPARATOR, shard) for shard in range(count)]
+
+    def partition_key_for(self, tenant_id, sort_key_value):
+        """
+        The partition key of an item
+        :param tenant_id: The tenant identifier
+        :param sort_key_value: The sort key of the item, which selects its shard
+        :return: The partition key value
+        """
+        keys = self.partition_keys(tenant_id)
+        if len(keys) == 1:
+            return keys[0]
+        return keys[zlib.crc32(sort_key_value.encode('utf-8')) % len(keys)]
+
+    def _key(self, tenant_id, sort_key_value):
+        return {
+            self.partition_key: {'S': self.partition_key_for(tenant_id, sort_key_value)},
+            self.sort_key: {'S': sort_key_value},
+        }
+
+    def _serialize(self, tenant_id, item):
+        serialized = {k: self._serializer.serialize(v) for k, v in item.items() if k != self.partition_key}
+        serialized.update(self._key(tenant_id, item[self.sort_key]))
+        return serialized
+
+    def _deserialize(self, item):
+        return {k: self._deserializer.deserialize(v) for k, v in item.items() if k != self.partition_key}
+
+    def _backoff(self, attempt):
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        time.sleep(random.uniform(delay / 2, delay))
+
+    def _call(self, tenant_id, operation, **kwargs):
+        client = self.client_for_tenant(tenant_id)
+        attempt = 0
+        while True:
+            with self._lock:
+                self.metrics['calls'] += 1
+            try:
+                return getattr(client, operation)(**kwargs)
+            except ClientError as err:
+                if not is_throttling_error(err) or attempt >= self.max_retries:
+                    raise
+                with self._lock:
+                    self.metrics['throttles'] += 1
+                self._backoff(attempt)
+                attempt += 1
+
+    def _map(self, tenant_id, fn, args):
+        """
+        Run fn on each of args on the shared workers, with at most max_workers_per_tenant calls of the tenant at a time
+        :return: The results, in the order of args
+        """
+        args = list(args)
+        if len(args) == 1:
+            return [fn(args[0])]
+        with self._lock:
+            slots = self._tenant_slots.setdefault(tenant_id, threading.BoundedSemaphore(self.max_workers_per_tenant))
+        futures = []
+        for arg in args:
+            # wait on the calling thread, so the tenant's calls queue here instead of in front of other tenants' calls
+            slots.acquire()
+            try:
+                future = self._executor.submit(fn, arg)
+            except BaseException:
+                slots.release()
+                raise
+            future.add_done_callback(lambda _: slots.release())
+            futures.append(future)
+        return [future.result() for future in futures]
+
+    def put_item(self, tenant_id, item):
+        self._call(tenant_id, 'put_item', TableName=self.table_name, Item=self._serialize(tenant_id, item))
+
+    def get_item(self, tenant_id, sort_key_value, consistent_read=False):
+        """
+        Read one item of a tenant
+        :return: The item, or None
+        """
+        response = self._call(tenant_id, 'get_item', TableName=self.table_name,
+                              Key=self._key(tenant_id, sort_key_value), ConsistentRead=consistent_read)
+        return self._deserialize(response['Item']) if 'Item' in response else None
+
+    def delete_item(self, tenant_id, sort_key_value):
+        self._call(tenant_id, 'delete_item', TableName=self.table_name, Key=self._key(tenant_id, sort_key_value))
+
+    def _batch_get_chunk(self, tenant_id, keys, consistent_read):
+        request = {self.table_name: {'Keys': keys, 'ConsistentRead': consistent_read}}
+        items, attempt = [], 0
+        while request:
+            response = self._call(tenant_id, 'batch_get_item', RequestItems=request)
+            items.extend(response.get('Responses', {}).get(self.table_name, []))
+            request = response.get('UnprocessedKeys') or {}
+            if request:
+                if attempt >= self.max_retries:
+                    raise RuntimeError('BatchGetItem left {0} keys unprocessed'.format(
+                        len(request[self.table_name]['Keys'])))
+                with self._lock:
+                    self.metrics['unprocessed_retries'] += 1
+                self._backoff(attempt)
+                attempt += 1
+        return items
+
+    def batch_get(self, tenant_id, sort_key_values, consistent_read=False):
+        """
+        Read many items of a tenant with BatchGetItem, 100 keys per call, the calls run in parallel
+        :param tenant_id: The tenant identifier
+        :param sort_key_values: The sort keys of the items
+        :param consistent_read: Use strongly consistent reads
+        :return: A dict of sort keys and items, missing items are left out
+        """
+        keys = [self._key(tenant_id, s) for s in dict.fromkeys(sort_key_values)]
+        chunks = [keys[i:i + BATCH_GET_MAX_KEYS] for i in range(0, len(keys), BATCH_GET_MAX_KEYS)]
+        found = {}
+        for items in self._map(tenant_id, lambda chunk: self._batch_get_chunk(tenant_id, chunk, consistent_read),
+                               chunks):
+            for item in items:
+                item = self._deserialize(item)
+                found[item[self.sort_key]] = item
+        return found
+
+    def _batch_write_chunk(self, tenant_id, requests):
+        request = {self.table_name: requests}
+        attempt = 0
+        while request:
+            response = self._call(tenant_id, 'batch_write_item', RequestItems=request)
+            request = response.get('UnprocessedItems') or {}
+            if request:
+                if attempt >= self.max_retries:
+                    raise RuntimeError('BatchWriteItem left {0} items unprocessed'.format(len(request[self.table_name])))
+                with self._lock:
+                    self.metrics['unprocessed_retries'] += 1
+                self._backoff(attempt)
+                attempt += 1
+
+    def batch_write(self, tenant_id, items=(), delete_sort_keys=()):
+        """
+        Put and delete many items of a tenant with BatchWriteItem, 25 per call, the calls run in parallel
+        :param tenant_id: The tenant identifier
+        :param items: The items to put
+        :param delete_sort_keys: The sort keys of the items to delete, applied after the puts
+        :return: The number of items written, once per sort key
+        """
+        # BatchWriteItem rejects a call with two requests for one key, the last request of a key wins
+        requests = {}
+        for item in items:
+            requests[item[self.sort_key]] = {'PutRequest': {'Item': self._serialize(tenant_id, item)}}
+        for sort_key_value in delete_sort_keys:
+            requests.pop(sort_key_value, None)
+            requests[sort_key_value] = {'DeleteRequest': {'Key': self._key(tenant_id, sort_key_value)}}
+        requests = list(requests.values())
+        chunks = [requests[i:i + BATCH_WRITE_MAX_ITEMS] for i in range(0, len(requests), BATCH_WRITE_MAX_ITEMS)]
+        self._map(tenant_id, lambda chunk: self._batch_write_chunk(tenant_id, chunk), chunks)
+        return len(requests)
+
+    def _query_partition(self, tenant_id, partition_key_value, sort_key_prefix, limit, consistent_read):
+        kwargs = {
+            'TableName': self.table_name,
+            'KeyConditionExpression': '#pk = :pk',
+            'ExpressionAttributeNames': {'#pk': self.partition_key},
+            'ExpressionAttributeValues': {':pk': {'S': partition_key_value}},
+            'ConsistentRead': consistent_read,
+        }
+        if sort_key_prefix:
+            kwargs['KeyConditionExpression'] += ' AND begins_with(#sk, :prefix)'
+            kwargs['ExpressionAttributeNames']['#sk'] = self.sort_key
+            kwargs['ExpressionAttributeValues'][':prefix'] = {'S': sort_key_prefix}
+        items = []
+        while True:
+            if limit is not None:
+                kwargs['Limit'] = limit - len(items)
+            response = self._call(tenant_id, 'query', **kwargs)
+            items.extend(response.get('Items', []))
+            if 'LastEvaluatedKey' not in response or (limit is not None and len(items) >= limit):
+                return items
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def query(self, tenant_id, sort_key_prefix=None, limit=None, consistent_read=False):
+        """
+        Read the items of a tenant, following the pages of each partition key. The shards of a
+        sharded tenant are queried in parallel and the results merged in sort key order. The pages of
+        an unsharded tenant are read one after another, since a Query cannot be split without knowing
+        how the sort keys are distributed
+        :param tenant_id: The tenant identifier
+        :param sort_key_prefix: Only return items whose sort key starts with it
+        :param limit: The maximum number of items to return
+        :param consistent_read: Use strongly consistent reads
+        :return: A list of items, ordered by sort key
+        """
+        partitions = self.partition_keys(tenant_id)
+        # each shard holds about 1/n of the items, but any one of them may hold the first `limit` items
+        pages = self._map(
+            tenant_id, lambda pk: self._query_partition(tenant_id, pk, sort_key_prefix, limit, consistent_read),
+            partitions)
+        items = [self._deserialize(item) for page in pages for item in page]
+        if len(partitions) > 1:
+            items.sort(key=lambda item: item[self.sort_key])
+        return items[:limit] if limit is not None else items
+
+    def close(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,27 @@
+--Alternative to 1_build_vector_db_on_aurora.sql : one partition and one HNSW index per tenant.
+--Queries for a tenant only scan the tenant's partition, and index builds and vacuum run per tenant.
+--To move an existing pooled aws_managed.kb table to this layout, use
+--../self-managed/partitioned_kb.py --schema aws_managed --app-role bedrock_user --privileges ALL --no-rls.
+
+--Bedrock fills the tenantid column from the tenantid metadata attribute, so upload the .metadata.json of
+--each document (see ../metadata_tags) before ingesting it. Rows without a tenant have no partition and fail to ingest.
+
+--Step 1 : Enable the pgvector extension
+
+CREATE EXTENSION IF NOT EXISTS vector;
+
+--Step 2 : Create a schema and grant permissions 
+
+CREATE SCHEMA aws_managed;
+CREATE ROLE bedrock_user WITH PASSWORD '<update with secure password>' LOGIN;
+GRANT ALL ON SCHEMA aws_managed to bedrock_user;
+
+--Step 3 : Create the Vector table, partitioned by tenant. The primary key must include the partition key.
+
+CREATE TABLE aws_managed.kb (id uuid, embedding vector(1536), chunks text, metadata json, tenantid varchar(10) NOT NULL, PRIMARY KEY (tenantid, id)) PARTITION BY LIST (tenantid);
+GRANT ALL ON TABLE aws_managed.kb to bedrock_user;
+
+--Step 4 : Create a partition and its index when a tenant is onboarded, before its documents are ingested
+
+CREATE TABLE aws_managed.kb_tenant1 PARTITION OF aws_managed.kb FOR VALUES IN ('Tenant1');
+CREATE INDEX on aws_managed.kb_tenant1 USING hnsw (embedding vector_cosine_ops);
@@ -0,0 +1,129 @@
+"""
+Offline benchmark of the notebook's upload and ingestion steps against KnowledgeBaseIngestion.
+
+Runs against the stub S3 and bedrock-agent clients in ../self-managed/local_stubs.py,
+so no AWS resources are needed. Each tenant gets --documents generated
+documents of --document-mb MB with a metadata sidecar:
+
+* serial       - upload_file_to_s3 for every document and sidecar, then start_ingestion_job and
+                 wait_for_ingestion polling get_ingestion_job without sleeping, as in the notebook
+* orchestrator - KnowledgeBaseIngestion.sync, run once for all tenants and once more after
+                 the documents of --changed-tenants tenants changed
+
+With --data-source-per-tenant every tenant has its own data source, so the
+second sync only ingests the data sources of the changed tenants:
+
+    python benchmark_kb_ingestion.py --tenants 20 --documents 2 --document-mb 16
+    python benchmark_kb_ingestion.py --tenants 20 --data-source-per-tenant --changed-tenants 2
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from kb_ingestion import KnowledgeBaseIngestion
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "self-managed"))
+from local_stubs import StubBedrockAgent, StubS3  # noqa: E402
+
+
+def write_documents(directory, tenants, documents, document_mb):
+    tenant_documents = {}
+    metadata_dir = os.path.join(directory, "metadata_tags")
+    os.makedirs(metadata_dir)
+    for t in range(tenants):
+        tenantid = "Tenant{0}".format(t + 1)
+        paths = []
+        for d in range(documents):
+            path = os.path.join(directory, "Home_Survey_{0}_{1}.pdf".format(tenantid, d + 1))
+            with open(path, "wb") as f:
+                f.write(os.urandom(int(document_mb * 1024 * 1024)))
+            with open(os.path.join(metadata_dir, os.path.basename(path) + ".metadata.json"), "w") as f:
+                f.write('{{"metadataAttributes": {{"tenantid": "{0}"}}}}'.format(tenantid))
+            paths.append(path)
+        tenant_documents[tenantid] = paths
+    return tenant_documents, metadata_dir
+
+
+def serial(s3, bedrock_agent, bucket, tenant_documents, metadata_dir, data_source):
+    # Mirrors upload_file_to_s3 and wait_for_ingestion from the notebook.
+    start = time.perf_counter()
+    for paths in tenant_documents.values():
+        for path in paths:
+            key = "multi_tenant_survey_reports/" + os.path.basename(path)
+            s3.upload_file(path, bucket, key)
+            s3.upload_file(os.path.join(metadata_dir, os.path.basename(path) + ".metadata.json"), bucket,
+                           key + ".metadata.json")
+    uploaded = time.perf_counter() - start
+    job = bedrock_agent.start_ingestion_job(knowledgeBaseId=data_source[0], dataSourceId=data_source[1])["ingestionJob"]
+    while job["status"] != "COMPLETE":
+        job = bedrock_agent.get_ingestion_job(knowledgeBaseId=data_source[0], dataSourceId=data_source[1],
+                                              ingestionJobId=job["ingestionJobId"])["ingestionJob"]
+    return uploaded, time.perf_counter() - start - uploaded, 1
+
+
+async def orchestrated(kb_ingestion, tenant_documents, metadata_dir):
+    start = time.perf_counter()
+    report = await kb_ingestion.upload(tenant_documents, metadata_dir)
+    uploaded = time.perf_counter() - start
+    jobs = await kb_ingestion.ingest(report.changed_tenants) if report.changed_tenants else []
+    return uploaded, time.perf_counter() - start - uploaded, len(jobs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tenants", type=int, default=10)
+    parser.add_argument("--documents", type=int, default=2, help="documents per tenant")
+    parser.add_argument("--document-mb", type=float, default=12.0)
+    parser.add_argument("--bandwidth-mbps", type=float, default=200.0, help="upload bandwidth of one connection")
+    parser.add_argument("--job-duration", type=float, default=2.0, help="seconds an ingestion job runs")
+    parser.add_argument("--concurrency", type=int, default=8, help="files uploaded at the same time")
+    parser.add_argument("--data-source-per-tenant", action="store_true")
+    parser.add_argument("--changed-tenants", type=int, default=1)
+    parser.add_argument("--skip-serial", action="store_true", help="Only run the orchestrator")
+    args = parser.parse_args()
+
+    bucket, data_source = "multi-tenant-home-survey-reports", ("kb", "ds")
+    with tempfile.TemporaryDirectory() as directory:
+        tenant_documents, metadata_dir = write_documents(directory, args.tenants, args.documents, args.document_mb)
+        print("{0:<24} {1:>9} {2:>9} {3:>8} {4:>8} {5:>8} {6:>6}".format(
+            "mode", "upload s", "ingest s", "puts", "parts", "polls", "jobs"))
+
+        def report(mode, s3, bedrock_agent, results):
+            uploaded, ingested, jobs = results
+            print("{0:<24} {1:>9.2f} {2:>9.2f} {3:>8} {4:>8} {5:>8} {6:>6}".format(
+                mode, uploaded, ingested, s3.calls.get("PutObject", 0), s3.calls.get("UploadPart", 0),
+                bedrock_agent.calls.get("GetIngestionJob", 0), jobs))
+            s3.calls.clear()
+            bedrock_agent.calls.clear()
+
+        if not args.skip_serial:
+            s3 = StubS3(bandwidth_mbps=args.bandwidth_mbps)
+            bedrock_agent = StubBedrockAgent(s3, job_duration=args.job_duration)
+            report("serial", s3, bedrock_agent, serial(s3, bedrock_agent, bucket, tenant_documents, metadata_dir,
+                                                       data_source))
+
+        s3 = StubS3(bandwidth_mbps=args.bandwidth_mbps)
+        bedrock_agent = StubBedrockAgent(s3, job_duration=args.job_duration)
+        tenant_data_sources = None
+        if args.data_source_per_tenant:
+            tenant_data_sources = {tenantid: ("kb", "ds-" + tenantid) for tenantid in tenant_documents}
+        kb_ingestion = KnowledgeBaseIngestion(s3, bedrock_agent, bucket, data_source=data_source,
+                                              tenant_data_sources=tenant_data_sources,
+                                              max_concurrency=args.concurrency, poll_base_delay=0.25,
+                                              poll_max_delay=2.0)
+        report("orchestrator", s3, bedrock_agent, asyncio.run(
+            orchestrated(kb_ingestion, tenant_documents, metadata_dir)))
+
+        for tenantid in sorted(tenant_documents)[:args.changed_tenants]:
+            with open(tenant_documents[tenantid][0], "r+b") as f:
+                f.write(os.urandom(1024))
+        report("orchestrator, {0} changed".format(args.changed_tenants), s3, bedrock_agent, asyncio.run(
+            orchestrated(kb_ingestion, tenant_documents, metadata_dir)))
+        kb_ingestion.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+"""
+Concurrent uploads and non-blocking ingestion jobs for the Bedrock knowledge base.
+
+The notebook uploads each tenant document and .metadata.json sidecar one at a
+time with upload_file_to_s3, and wait_for_ingestion calls get_ingestion_job in
+a loop without sleeping. KnowledgeBaseIngestion:
+
+* uploads the documents and sidecars of all tenants concurrently, large files
+  in parallel parts with the multipart settings of transfer_config
+* skips files whose content is already in S3, by comparing a SHA-256 digest
+  stored in the object metadata, and reports which tenants changed
+* starts an ingestion job only on the data sources of the changed tenants and
+  polls every job with exponential backoff and jitter, all from one event loop
+
+Usage from the notebook, where the event loop is already running:
+
+    kb_ingestion = KnowledgeBaseIngestion(s3_client, bedrock_agent_client, bucket_name, data_source=(kb_id, ds_id))
+    report, jobs = await kb_ingestion.sync({"Tenant2": ["../multi_tenant_survey_reports/Home_Survey_Tenant2.pdf"]},
+                                           metadata_dir="../metadata_tags")
+
+Tenants can also have their own data sources, e.g. one per tenant prefix, with
+tenant_data_sources={"Tenant2": (kb_id, ds_id_tenant2)}.
+"""
+import asyncio
+import functools
+import hashlib
+import json
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+
+MB = 1024 * 1024
+DIGEST_METADATA_KEY = "sha256"
+TERMINAL_STATUSES = ("COMPLETE", "FAILED", "STOPPED")
+THROTTLING_ERROR_CODES = ("ThrottlingException", "TooManyRequestsException", "ServiceQuotaExceededException")
+
+
+def error_code(err):
+    return err.response.get("Error", {}).get("Code") if isinstance(err, ClientError) else None
+
+
+def backoff_delays(base_delay, max_delay):
+    """
+    Generate exponentially growing delays with jitter
+    :param base_delay: The first delay, in seconds
+    :param max_delay: The upper bound of the delays, in seconds
+    :return: An infinite generator of delays, each between half and all of the current step
+    """
+    attempt = 0
+    while True:
+        delay = min(max_delay, base_delay * (2 ** attempt))
+        yield random.uniform(delay / 2, delay)
+        attempt += 1
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(MB), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def metadata_sidecar(tenantid, attribute="tenantid"):
+    """
+    Build the .metadata.json sidecar of a tenant document, as in metadata_tags
+    :param tenantid: The tenant
+    :param attribute: The metadata attribute holding the tenant ID
+    :return: The sidecar content
+    """
+    return json.dumps({"metadataAttributes": {attribute: tenantid}}, indent=4).encode("utf-8")
+
+
+def wait_for_ingestion_job(bedrock_agent, knowledge_base_id, data_source_id, ingestion_job_id,
+                           base_delay=2.0, max_delay=30.0, timeout=3600):
+    """
+    Wait for an ingestion job to finish, polling with exponential backoff and jitter
+    :param bedrock_agent: The bedrock-agent client
+    :param knowledge_base_id: The knowledge base ID
+    :param data_source_id: The data source ID
+    :param ingestion_job_id: The ingestion job ID
+    :param base_delay: The first polling delay, in seconds
+    :param max_delay: The upper bound of the polling delay, in seconds
+    :param timeout: Seconds after which TimeoutError is raised
+    :return: The ingestion job in a terminal status
+    """
+    deadline = time.monotonic() + timeout
+    for delay in backoff_delays(base_delay, max_delay):
+        try:
+            job = bedrock_agent.get_ingestion_job(
+                knowledgeBaseId=knowledge_base_id, dataSourceId=data_source_id, ingestionJobId=ingestion_job_id
+            )["ingestionJob"]
+            if job["status"] in TERMINAL_STATUSES:
+                return job
+        except ClientError as err:
+            if error_code(err) not in THROTTLING_ERROR_CODES:
+                raise
+        if time.monotonic() + delay > deadline:
+            raise TimeoutError("Ingestion job {0} did not finish in {1}s".format(ingestion_job_id, timeout))
+        time.sleep(delay)
+
+
+class UploadReport:
+    """What an upload of tenant documents did."""
+
+    def __init__(self):
+        self.uploaded = []
+        self.unchanged = []
+        self.changed_tenants = set()
+        self.bytes = 0
+        self.elapsed = 0.0
+
+    def to_dict(self):
+        return {
+            "uploaded": self.uploaded,
+            "unchanged": self.unchanged,
+            "changed_tenants": sorted(self.changed_tenants),
+            "bytes": self.bytes,
+            "elapsed": round(self.elapsed, 3),
+        }
+
+    def __repr__(self):
+        return "UploadReport(uploaded={0}, unchanged={1}, changed_tenants={2}, bytes={3}, elapsed={4:.2f}s)".format(
+            len(self.uploaded), len(self.unchanged), sorted(self.changed_tenants), self.bytes, self.elapsed)
+
+
+class KnowledgeBaseIngestion:
+    """
+    Uploads tenant documents to the data source bucket and runs the knowledge base ingestion jobs
+    :param s3_client: The S3 client
+    :param bedrock_agent: The bedrock-agent client
+    :param bucket: The data source bucket
+    :param prefix: The key prefix of the tenant documents
+    :param data_source: The (knowledge base ID, data source ID) ingesting the documents of all tenants
+    :param tenant_data_sources: A dict of tenant IDs and their own (knowledge base ID, data source ID)
+    :param max_concurrency: The number of files uploaded at the same time
+    :param transfer_config: The boto3 TransferConfig of each upload, files above its multipart_threshold
+        are uploaded in parts, max_concurrency of them at a time
+    :param metadata_attribute: The metadata attribute of generated sidecars
+    :param poll_base_delay: The first delay between get_ingestion_job calls, in seconds
+    :param poll_max_delay: The upper bound of the delay between get_ingestion_job calls, in seconds
+    :param timeout: Seconds an ingestion job may take
+    :param on_ingested: Function called with the tenant ID and the job when an ingestion job of the tenant's
+        data source completed, e.g. to invalidate the tenant's entries of a SemanticRetrievalCache
+    """
+
+    def __init__(self, s3_client, bedrock_agent, bucket, prefix="multi_tenant_survey_reports/", data_source=None,
+                 tenant_data_sources=None, max_concurrency=8, transfer_config=None, metadata_attribute="tenantid",
+                 poll_base_delay=2.0, poll_max_delay=30.0, timeout=3600, on_ingested=None):
+        self.s3_client = s3_client
+        self.bedrock_agent = bedrock_agent
+        self.bucket = bucket
+        self.prefix = prefix
+        self.data_source = data_source
+        self.tenant_data_sources = dict(tenant_data_sources or {})
+        self.max_concurrency = max_concurrency
+        self.transfer_config = transfer_config or TransferConfig(
+            multipart_threshold=8 * MB, multipart_chunksize=8 * MB, max_concurrency=4)
+        self.metadata_attribute = metadata_attribute
+        self.poll_base_delay = poll_base_delay
+        self.poll_max_delay = poll_max_delay
+        self.timeout = timeout
+        self.on_ingested = on_ingested
+        self.metrics = {"uploads": 0, "skipped_uploads": 0, "jobs_started": 0, "polls": 0, "throttles": 0,
+                        "conflicts": 0}
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="kb-ingestion")
+
+    def _run(self, fn, **kwargs):
+        return asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(fn, **kwargs))
+
+    def _stored_digest(self, key):
+        try:
+            response = self.s3_client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as err:
+            if error_code(err) in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        return response.get("Metadata", {}).get(DIGEST_METADATA_KEY)
+
+    def _upload_file(self, path, key):
+        digest = file_digest(path)
+        if self._stored_digest(key) == digest:
+            return False, 0
+        self.s3_client.upload_file(path, self.bucket, key, ExtraArgs={"Metadata": {DIGEST_METADATA_KEY: digest}},
+                                   Config=self.transfer_config)
+        return True, os.path.getsize(path)
+
+    def _upload_bytes(self, body, key):
+        digest = hashlib.sha256(body).hexdigest()
+        if self._stored_digest(key) == digest:
+            return False, 0
+        self.s3_client.put_object(Bucket=self.bucket, Key=key, Body=body, Metadata={DIGEST_METADATA_KEY: digest})
+        return True, len(body)
+
+    def _uploads(self, tenant_documents, metadata_dir):
+        for tenantid, paths in sorted(tenant_documents.items()):
+            for path in paths:
+                key = self.prefix + os.path.basename(path)
+                yield tenantid, key, functools.partial(self._upload_file, path=path, key=key)
+                if metadata_dir is None:
+                    continue
+                sidecar = os.path.join(metadata_dir, os.path.basename(path) + ".metadata.json")
+                if os.path.exists(sidecar):
+                    upload = functools.partial(self._upload_file, path=sidecar, key=key + ".metadata.json")
+                else:
+                    upload = functools.partial(self._upload_bytes, body=metadata_sidecar(
+                        tenantid, self.metadata_attribute), key=key + ".metadata.json")
+                yield tenantid, key + ".metadata.json", upload
+
+    async def upload(self, tenant_documents, metadata_dir=None):
+        """
+        Upload the new or changed documents of the tenants, with their metadata sidecars
+        :param tenant_documents: A dict of tenant IDs and the local paths of their documents
+        :param metadata_dir: The directory of the <document>.metadata.json sidecars, a sidecar is generated
+            for documents without one. None to upload the documents only
+        :return: The UploadReport
+        """
+        report = UploadReport()
+        start = time.perf_counter()
+
+        async def upload_one(tenantid, key, upload):
+            uploaded, size = await self._run(upload)
+            if uploaded:
+                report.uploaded.append(key)
+                report.changed_tenants.add(tenantid)
+                report.bytes += size
+                self.metrics["uploads"] += 1
+            else:
+                report.unchanged.append(key)
+                self.metrics["skipped_uploads"] += 1
+
+        # the thread pool bounds the uploads in flight to max_concurrency
+        await asyncio.gather(*(upload_one(*upload) for upload in self._uploads(tenant_documents, metadata_dir)))
+        report.elapsed = time.perf_counter() - start
+        return report
+
+    def data_sources_for(self, tenants):
+        """
+        The data sources holding the documents of the tenants
+        :param tenants: Tenant IDs
+        :return: A sorted list of (knowledge base ID, data source ID)
+        """
+        data_sources = set()
+        for tenantid in tenants:
+            data_source = self.tenant_data_sources.get(tenantid, self.data_source)
+            if data_source is None:
+                raise KeyError("No data source for tenant {0}".format(tenantid))
+            data_sources.add(tuple(data_source))
+        return sorted(data_sources)
+
+    async def _call_with_backoff(self, fn, retry_codes, **kwargs):
+        for delay in backoff_delays(self.poll_base_delay, self.poll_max_delay):
+            try:
+                return await self._run(fn, **kwargs)
+            except ClientError as err:
+                code = error_code(err)
+                if code not in retry_codes:
+                    raise
+                self.metrics["conflicts" if code == "ConflictException" else "throttles"] += 1
+            await asyncio.sleep(delay)
+
+    async def start_job(self, knowledge_base_id, data_source_id):
+        """
+        Start an ingestion job, waiting for a job already running on the data source to finish first
+        :return: The ingestion job
+        """
+        response = await self._call_with_backoff(
+            self.bedrock_agent.start_ingestion_job, THROTTLING_ERROR_CODES + ("ConflictException",),
+            knowledgeBaseId=knowledge_base_id, dataSourceId=data_source_id)
+        self.metrics["jobs_started"] += 1
+        return response["ingestionJob"]
+
+    async def wait_for_job(self, knowledge_base_id, data_source_id, ingestion_job_id):
+        """
+        Wait for an ingestion job to finish, polling with exponential backoff and jitter
+        :return: The ingestion job in a terminal status
+        """
+        deadline = time.monotonic() + self.timeout
+        for delay in backoff_delays(self.poll_base_delay, self.poll_max_delay):
+            self.metrics["polls"] += 1
+            response = await self._call_with_backoff(
+                self.bedrock_agent.get_ingestion_job, THROTTLING_ERROR_CODES, knowledgeBaseId=knowledge_base_id,
+                dataSourceId=data_source_id, ingestionJobId=ingestion_job_id)
+            job = response["ingestionJob"]
+            if job["status"] in TERMINAL_STATUSES:
+                return job
+            if time.monotonic() + delay > deadline:
+                raise TimeoutError("Ingestion job {0} did not finish in {1}s".format(ingestion_job_id, self.timeout))
+            await asyncio.sleep(delay)
+
+    async def wait_for_jobs(self, jobs):
+        """
+        Wait for many ingestion jobs at once
+        :param jobs: Ingestion jobs, as returned by start_job
+        :return: The jobs in a terminal status, in the same order
+        """
+        return await asyncio.gather(*(
+            self.wait_for_job(job["knowledgeBaseId"], job["dataSourceId"], job["ingestionJobId"]) for job in jobs))
+
+    async def ingest(self, tenants):
+        """
+        Run one ingestion job on each data source of the tenants, concurrently
+        :param tenants: The tenants whose documents changed
+        :return: The finished ingestion jobs
+        """
+
+        tenants = sorted(tenants)
+
+        async def run(data_source):
+            job = await self.start_job(*data_source)
+            job = await self.wait_for_job(job["knowledgeBaseId"], job["dataSourceId"], job["ingestionJobId"])
+            if job["status"] == "COMPLETE" and self.on_ingested is not None:
+                for tenantid in tenants:
+                    if self.data_sources_for([tenantid]) == [data_source]:
+                        self.on_ingested(tenantid, job)
+            return job
+
+        return await asyncio.gather(*(run(data_source) for data_source in self.data_sources_for(tenants)))
+
+    async def sync(self, tenant_documents, metadata_dir=None):
+        """
+        Upload the tenants' documents and ingest the data sources of the tenants whose documents changed
+        :param tenant_documents: A dict of tenant IDs and the local paths of their documents
+        :param metadata_dir: The directory of the metadata sidecars, see upload
+        :return: The UploadReport and the finished ingestion jobs, none when nothing changed
+        """
+        report = await self.upload(tenant_documents, metadata_dir)
+        jobs = await self.ingest(report.changed_tenants) if report.changed_tenants else []
+        return report, jobs
+
+    def close(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,29 @@
+--Alternative to 1_build_vector_db_on_aurora.sql : one partition and one HNSW index per tenant.
+--Queries for a tenant only scan the tenant's partition, and index builds and vacuum run per tenant.
+--To move an existing pooled self_managed.kb table to this layout, use partitioned_kb.py.
+
+--Step 1 : Enable the pgvector extension
+
+CREATE EXTENSION IF NOT EXISTS vector;
+
+--Step 2 : Create a schema 
+CREATE SCHEMA self_managed;
+
+--Step 3 : Create the Vector table, partitioned by tenant. The primary key must include the partition key.
+
+CREATE TABLE self_managed.kb (id uuid, embedding vector(1536), chunks text, metadata json, tenantid varchar(10) NOT NULL, PRIMARY KEY (tenantid, id)) PARTITION BY LIST (tenantid);
+
+--Step 4 : Create a partition and its index when a tenant is onboarded (or run: python partitioned_kb.py --dsn ... --target kb onboard Tenant1)
+
+CREATE TABLE self_managed.kb_tenant1 PARTITION OF self_managed.kb FOR VALUES IN ('Tenant1');
+CREATE INDEX on self_managed.kb_tenant1 USING hnsw (embedding vector_cosine_ops);
+
+-- Step 5 : Enable Row Level Security. The policy on the partitioned table applies to all partitions queried through it.
+CREATE POLICY tenant_policy ON self_managed.kb USING (tenantid = current_setting('self_managed.kb.tenantid')::varchar);
+
+ALTER TABLE self_managed.kb enable row level security;
+
+CREATE ROLE app_user WITH PASSWORD '<update with secure password>' LOGIN;
+
+GRANT ALL ON SCHEMA self_managed to app_user;
+GRANT SELECT ON TABLE self_managed.kb to app_user;
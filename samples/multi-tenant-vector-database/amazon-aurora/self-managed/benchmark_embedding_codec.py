@@ -0,0 +1,124 @@
+"""
+Compare the embedding encodings of EmbeddingCodec.
+
+For each encoding reports the payload size of one embedding parameter, the
+time to serialize it in Python, and the insert and query latency through
+LocalDataApi against a local PostgreSQL with pgvector. --bandwidth-mbps adds
+the time to send the request body over the network, which the Data API pays
+and a local database does not. Recall@k is measured against an exact search
+over the full precision embeddings. halfvec runs are skipped on pgvector
+versions before 0.7.0:
+
+    docker run -e POSTGRES_HOST_AUTH_METHOD=trust -p 5432:5432 pgvector/pgvector:pg16
+    python benchmark_embedding_codec.py --dsn postgresql://postgres@localhost/postgres
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import uuid
+
+import numpy as np
+import psycopg
+
+from benchmark_stats import percentile
+from embedding_codec import FLOAT4LE_FUNCTION_SQL, EmbeddingCodec, payload_size
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "rds-data-api-rls"))
+from local_data_api import LocalDataApi  # noqa: E402
+
+CONFIGURATIONS = [
+    ("text", "vector", None),
+    ("trimmed", "vector", None),
+    ("blob", "vector", None),
+    ("trimmed", "halfvec", None),
+    ("blob", "halfvec", None),
+    ("trimmed", "vector", 512),
+]
+
+
+def setup(dsn, codec):
+    with psycopg.connect(dsn, autocommit=True) as conn:
+        conn.execute("CREATE EXTENSION IF NOT EXISTS vector; CREATE SCHEMA IF NOT EXISTS self_managed")
+        conn.execute(FLOAT4LE_FUNCTION_SQL)
+        conn.execute("DROP TABLE IF EXISTS self_managed.kb_codec")
+        conn.execute("CREATE TABLE self_managed.kb_codec (id uuid PRIMARY KEY, embedding {0}, chunks text, "
+                     "metadata json, tenantid varchar(10))".format(codec.column_type))
+        conn.execute("CREATE INDEX ON self_managed.kb_codec USING hnsw (embedding {0})".format(codec.index_ops))
+
+
+def pgvector_version(dsn):
+    with psycopg.connect(dsn, autocommit=True) as conn:
+        conn.execute("CREATE EXTENSION IF NOT EXISTS vector")
+        version = conn.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'").fetchone()[0]
+    return tuple(int(p) for p in version.split("."))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", required=True, help="libpq connection string of a superuser")
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=25)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--bandwidth-mbps", type=float, default=100.0, help="0 to leave out the transfer time")
+    args = parser.parse_args()
+
+    halfvec = pgvector_version(args.dsn) >= (0, 7, 0)
+    rng = np.random.default_rng(7)
+    print("{0:<8} {1:<8} {2:>5} {3:>10} {4:>10} {5:>14} {6:>12} {7:>12} {8:>9}".format(
+        "encoding", "storage", "dims", "bytes/vec", "encode us", "insert ms/row", "query p50 ms", "query p95 ms",
+        "recall@" + str(args.k)))
+    for encoding, storage, dimensions in CONFIGURATIONS:
+        if storage == "halfvec" and not halfvec:
+            print("{0:<8} {1:<8} skipped, halfvec needs pgvector 0.7.0".format(encoding, storage))
+            continue
+        dimensions = dimensions or 1536
+        codec = EmbeddingCodec(encoding, storage=storage, dimensions=dimensions)
+        setup(args.dsn, codec)
+        vectors = rng.standard_normal((args.rows, dimensions)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        embeddings = vectors.tolist()
+
+        start = time.perf_counter()
+        encoded = [codec.parameter("embedding", e) for e in embeddings]
+        encode_us = (time.perf_counter() - start) / len(embeddings) * 1e6
+        size = statistics.mean(payload_size(p) for p in encoded[:100])
+        transfer_sec = size * 8 / (args.bandwidth_mbps * 1e6) if args.bandwidth_mbps else 0.0
+
+        data_api = LocalDataApi(args.dsn)
+        insert_sql = codec.insert_sql("self_managed.kb_codec")
+        start = time.perf_counter()
+        for offset in range(0, args.rows, args.batch_size):
+            data_api.batch_execute_statement(
+                resourceArn="cluster", secretArn="secret", database="postgres", sql=insert_sql,
+                parameterSets=[[
+                    {"name": "id", "value": {"stringValue": str(uuid.uuid4())}},
+                    parameter,
+                    {"name": "chunks", "value": {"stringValue": str(offset + i)}},
+                    {"name": "metadata", "value": {"stringValue": "{}"}},
+                    {"name": "tenantid", "value": {"stringValue": "Tenant1"}},
+                ] for i, parameter in enumerate(encoded[offset:offset + args.batch_size])])
+        insert_ms = ((time.perf_counter() - start) / args.rows + transfer_sec) * 1000
+
+        query_sql = codec.query_sql("self_managed.kb_codec", columns="chunks", limit=args.k)
+        latencies, recalls = [], []
+        for _ in range(args.queries):
+            query = vectors[rng.integers(0, args.rows)] + 0.5 * rng.standard_normal(dimensions).astype(np.float32) / np.sqrt(dimensions)
+            expected = set(np.argsort(-(vectors @ query))[:args.k].tolist())
+            start = time.perf_counter()
+            response = data_api.execute_statement(
+                resourceArn="cluster", secretArn="secret", database="postgres", sql=query_sql,
+                parameters=[codec.parameter("embedding", query.tolist())])
+            latencies.append((time.perf_counter() - start + transfer_sec) * 1000)
+            found = {int(record[0]["stringValue"]) for record in response["records"]}
+            recalls.append(len(found & expected) / float(args.k))
+
+        print("{0:<8} {1:<8} {2:>5} {3:>10.0f} {4:>10.1f} {5:>14.3f} {6:>12.2f} {7:>12.2f} {8:>9.3f}".format(
+            encoding, storage, dimensions, size, encode_us, insert_ms, statistics.median(latencies),
+            percentile(latencies, 95), statistics.mean(recalls)))
+
+
+if __name__ == "__main__":
+    main()
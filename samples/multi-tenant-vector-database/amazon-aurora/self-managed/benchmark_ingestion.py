@@ -0,0 +1,105 @@
+"""
+Offline benchmark of the serial notebook ingestion loop against IngestionPipeline.
+
+Both run against the stub Bedrock and Data API clients in local_stubs.py, so
+no AWS resources are needed. With --cache the pipeline also ingests the
+document a second time through an EmbeddingCache, as when a document is
+re-ingested, and reports the model calls the cache saved:
+
+    python benchmark_ingestion.py --chunks 500 --workers 16 --throttle-rate 0.05
+    python benchmark_ingestion.py --chunks 500 --duplicate-rate 0.2 --cache --skip-serial
+"""
+import argparse
+import json
+import random
+import tempfile
+import time
+import uuid
+
+from embedding_cache import EmbeddingCache
+from ingestion_pipeline import INSERT_SQL, IngestionPipeline
+from local_stubs import StubBedrockRuntime, StubRdsData
+
+
+def serial_ingest(bedrock_runtime, rds_data, chunks, metadata, tenantid):
+    # Mirrors generate_vector_embeddings + insert_into_vector_db from the notebook.
+    start = time.perf_counter()
+    for chunk in chunks:
+        response = bedrock_runtime.invoke_model(
+            body=json.dumps({"inputText": chunk}),
+            modelId="amazon.titan-embed-text-v1",
+            accept="application/json",
+            contentType="application/json",
+        )
+        embedding = json.loads(response["body"].read()).get("embedding")
+        rds_data.execute_statement(
+            resourceArn="cluster",
+            secretArn="secret",
+            database="postgres",
+            sql=INSERT_SQL,
+            parameters=[
+                {"name": "id", "value": {"stringValue": str(uuid.uuid4())}},
+                {"name": "embedding", "value": {"stringValue": str(embedding)}},
+                {"name": "chunks", "value": {"stringValue": chunk}},
+                {"name": "metadata", "value": {"stringValue": json.dumps(metadata)}, "typeHint": "JSON"},
+                {"name": "tenantid", "value": {"stringValue": tenantid}},
+            ],
+        )
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chunks", type=int, default=200)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=25)
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--write-latency", type=float, default=0.02)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--skip-serial", action="store_true", help="Only run the pipeline")
+    parser.add_argument("--duplicate-rate", type=float, default=0.0, help="Share of chunks repeating an earlier one")
+    parser.add_argument("--cache", action="store_true", help="Also ingest twice through an EmbeddingCache")
+    args = parser.parse_args()
+
+    rng = random.Random(3)
+    chunks = []
+    for i in range(args.chunks):
+        if chunks and rng.random() < args.duplicate_rate:
+            chunks.append(rng.choice(chunks))
+        else:
+            chunks.append("survey chunk {0} ".format(i) * 20)
+
+    if not args.skip_serial:
+        bedrock_runtime = StubBedrockRuntime(latency=args.embed_latency)
+        rds_data = StubRdsData(latency=args.write_latency)
+        elapsed = serial_ingest(bedrock_runtime, rds_data, chunks, "bench.pdf", "Tenant1")
+        print("serial:   {0} chunks in {1:.2f}s, {2:.1f} chunks/s, {3} Data API calls".format(
+            len(rds_data.rows), elapsed, len(rds_data.rows) / elapsed, rds_data.total))
+
+    bedrock_runtime = StubBedrockRuntime(latency=args.embed_latency, throttle_rate=args.throttle_rate)
+    rds_data = StubRdsData(latency=args.write_latency)
+    pipeline = IngestionPipeline(bedrock_runtime, rds_data, "cluster", "secret", "postgres",
+                                 max_workers=args.workers, batch_size=args.batch_size, base_delay=0.05)
+    stats = pipeline.ingest(chunks, "bench.pdf", "Tenant1")
+    print("pipeline: {0} chunks in {1:.2f}s, {2:.1f} chunks/s, {3} Data API calls, {4} throttles".format(
+        len(rds_data.rows), stats.elapsed, stats.chunks_per_second, rds_data.total, stats.throttles))
+
+    if args.cache:
+        with tempfile.TemporaryDirectory() as directory:
+            cache = EmbeddingCache(directory=directory)
+            for run in ("first", "reingest"):
+                bedrock_runtime = StubBedrockRuntime(latency=args.embed_latency, throttle_rate=args.throttle_rate)
+                pipeline = IngestionPipeline(bedrock_runtime, StubRdsData(latency=args.write_latency), "cluster",
+                                             "secret", "postgres", max_workers=args.workers,
+                                             batch_size=args.batch_size, base_delay=0.05, embedding_cache=cache)
+                stats = pipeline.ingest(chunks, "bench.pdf", "Tenant1")
+                print("cached {0:<9} {1} chunks in {2:.2f}s, {3:.1f} chunks/s, {4} InvokeModel calls".format(
+                    run + ":", stats.chunks, stats.elapsed, stats.chunks_per_second,
+                    bedrock_runtime.calls.get("InvokeModel", 0)))
+                # the second run starts from the disk tier, like a new notebook session
+                cache.clear_memory()
+            print(cache.stats)
+
+
+if __name__ == "__main__":
+    main()
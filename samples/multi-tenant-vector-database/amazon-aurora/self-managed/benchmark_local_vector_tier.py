@@ -0,0 +1,167 @@
+"""
+Compare the recall and latency of LocalVectorTier with the pgvector RLS query.
+
+Creates self_managed.kb, its HNSW index and the RLS policy of
+1_build_vector_db_on_aurora.sql in a local PostgreSQL with pgvector, loads one
+large tenant and many small ones, and then runs the same questions for the
+small tenants through both paths:
+
+* pgvector - a transaction that sets the tenant and queries the HNSW index as app_user,
+             with --round-trip-ms added to each of its 4 statements to model the Data API
+* local    - LocalVectorTier, synced from the same table
+
+Recall is measured against an exact top-k computed over all rows of the tenant.
+The pgvector query uses the cosine distance operator <=> of the vector_cosine_ops index:
+
+    docker run -e POSTGRES_HOST_AUTH_METHOD=trust -p 5432:5432 pgvector/pgvector:pg16
+    python benchmark_local_vector_tier.py --dsn postgresql://postgres@localhost/postgres
+"""
+import argparse
+import statistics
+import time
+import uuid
+
+import numpy as np
+import psycopg
+
+from benchmark_stats import percentile
+from local_vector_tier import KB_IDS_SQL, LocalVectorTier
+
+SETUP_SQL = """
+CREATE EXTENSION IF NOT EXISTS vector;
+DROP SCHEMA IF EXISTS self_managed CASCADE;
+CREATE SCHEMA self_managed;
+CREATE TABLE self_managed.kb (id uuid PRIMARY KEY, embedding vector({dimensions}), chunks text, metadata json,
+                              tenantid varchar(10));
+CREATE POLICY tenant_policy ON self_managed.kb USING (tenantid = current_setting('self_managed.kb.tenantid')::varchar);
+ALTER TABLE self_managed.kb enable row level security;
+DO $$ BEGIN
+   IF NOT EXISTS (SELECT FROM pg_roles WHERE rolname = 'app_user') THEN CREATE ROLE app_user; END IF;
+END $$;
+GRANT ALL ON SCHEMA self_managed to app_user;
+GRANT SELECT ON TABLE self_managed.kb to app_user;
+"""
+
+RLS_QUERY_SQL = (
+    "SELECT id::text, chunks FROM self_managed.kb ORDER BY embedding <=> %s::vector LIMIT %s"
+)
+
+
+def vector_literal(vector):
+    return "[" + ",".join("{0:.6f}".format(v) for v in vector) + "]"
+
+
+class PsycopgKbLoader:
+    """LocalVectorTier loader that reads self_managed.kb directly as app_user."""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def _rows(self, tenantid, sql, params=None):
+        with self.conn.transaction():
+            self.conn.execute("SELECT set_config('self_managed.kb.tenantid', %s, true)", (tenantid,))
+            return self.conn.execute(sql, params).fetchall()
+
+    def fetch_ids(self, tenantid):
+        return [r[0] for r in self._rows(tenantid, KB_IDS_SQL)]
+
+    def fetch_rows(self, tenantid, ids):
+        rows = self._rows(tenantid, "SELECT id::text, embedding::text, chunks, metadata::text FROM self_managed.kb "
+                                    "WHERE id = ANY(%s::uuid[])", (ids,))
+        return [(r[0], [float(v) for v in r[1][1:-1].split(",")], r[2], r[3]) for r in rows]
+
+
+def generate(rng, tenant_sizes, dimensions):
+    # each tenant's documents cluster around a few topics, like chunks of the same reports
+    for tenantid, size in tenant_sizes.items():
+        topics = rng.standard_normal((4, dimensions)).astype(np.float32)
+        vectors = topics[rng.integers(0, 4, size)] + 0.6 * rng.standard_normal((size, dimensions)).astype(np.float32)
+        yield tenantid, topics, vectors
+
+
+def setup(dsn, tenant_sizes, dimensions, seed):
+    rng = np.random.default_rng(seed)
+    data = {}
+    with psycopg.connect(dsn, autocommit=True) as conn:
+        conn.execute(SETUP_SQL.format(dimensions=dimensions))
+        with conn.cursor().copy("COPY self_managed.kb (id, embedding, chunks, metadata, tenantid) FROM STDIN") as copy:
+            for tenantid, topics, vectors in generate(rng, tenant_sizes, dimensions):
+                for i, vector in enumerate(vectors):
+                    copy.write_row((str(uuid.uuid4()), vector_literal(vector), "{0} chunk {1}".format(tenantid, i),
+                                    '"{0}.pdf"'.format(tenantid), tenantid))
+                data[tenantid] = (topics, vectors)
+        conn.execute("CREATE INDEX on self_managed.kb USING hnsw (embedding vector_cosine_ops)")
+        conn.execute("ANALYZE self_managed.kb")
+    return data
+
+
+def exact_top_k(vectors, query, k):
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    scores = normalized @ (query / np.linalg.norm(query))
+    return set(np.argsort(-scores)[:k].tolist())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", required=True, help="libpq connection string of a superuser")
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--large-tenant-rows", type=int, default=20000)
+    parser.add_argument("--small-tenants", type=int, default=20)
+    parser.add_argument("--small-tenant-rows", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--round-trip-ms", type=float, default=10.0, help="simulated Data API latency per statement")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    tenant_sizes = {"Tenant0": args.large_tenant_rows}
+    tenant_sizes.update({"Tenant{0}".format(n): args.small_tenant_rows for n in range(1, args.small_tenants + 1)})
+    print("loading {0} rows of {1} tenants".format(sum(tenant_sizes.values()), len(tenant_sizes)))
+    data = setup(args.dsn, tenant_sizes, args.dimensions, args.seed)
+
+    conn = psycopg.connect(args.dsn, autocommit=True)
+    conn.execute("SET ROLE app_user")
+    loader_conn = psycopg.connect(args.dsn, autocommit=True)
+    loader_conn.execute("SET ROLE app_user")
+    tier = LocalVectorTier(PsycopgKbLoader(loader_conn), dimensions=args.dimensions)
+
+    rng = np.random.default_rng(args.seed + 1)
+    small = [t for t in tenant_sizes if t != "Tenant0"]
+    results = {"pgvector": ([], []), "local": ([], [])}
+    start = time.perf_counter()
+    for tenantid in small:
+        tier.sync(tenantid)
+    sync_ms = (time.perf_counter() - start) * 1000
+
+    for n in range(args.queries):
+        tenantid = small[n % len(small)]
+        topics, vectors = data[tenantid]
+        query = topics[rng.integers(0, len(topics))] + 0.6 * rng.standard_normal(args.dimensions).astype(np.float32)
+        expected = exact_top_k(vectors, query, args.k)
+
+        begin = time.perf_counter()
+        time.sleep(4 * args.round_trip_ms / 1000.0)
+        with conn.transaction():
+            conn.execute("SELECT set_config('self_managed.kb.tenantid', %s, true)", (tenantid,))
+            rows = conn.execute(RLS_QUERY_SQL, (vector_literal(query), args.k)).fetchall()
+        elapsed = (time.perf_counter() - begin) * 1000
+        found = {int(r[1].rsplit(" ", 1)[1]) for r in rows}
+        results["pgvector"][0].append(elapsed)
+        results["pgvector"][1].append(len(found & expected) / float(args.k))
+
+        begin = time.perf_counter()
+        rows = tier.search(tenantid, query, args.k)
+        elapsed = (time.perf_counter() - begin) * 1000
+        found = {int(r["chunks"].rsplit(" ", 1)[1]) for r in rows}
+        results["local"][0].append(elapsed)
+        results["local"][1].append(len(found & expected) / float(args.k))
+
+    print("initial sync of {0} tenants: {1:.0f} ms, {2:.1f} MB".format(len(small), sync_ms, tier.nbytes / 1e6))
+    print("{0:<10} {1:>10} {2:>10} {3:>10}".format("path", "recall@" + str(args.k), "p50 ms", "p95 ms"))
+    for path, (latencies, recalls) in results.items():
+        print("{0:<10} {1:>10.3f} {2:>10.3f} {3:>10.3f}".format(
+            path, statistics.mean(recalls), statistics.median(latencies), percentile(latencies, 95)))
+
+
+if __name__ == "__main__":
+    main()
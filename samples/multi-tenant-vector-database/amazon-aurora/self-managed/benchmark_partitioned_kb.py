@@ -0,0 +1,101 @@
+"""
+Compare the query latency and recall of the pooled and tenant-partitioned kb layouts.
+
+For each tenant count, loads --rows rows spread over the tenants into the pooled
+self_managed.kb of 1_build_vector_db_on_aurora.sql on a local PostgreSQL with
+pgvector, migrates them to kb_partitioned with partitioned_kb.py, and runs the
+same questions as app_user with the RLS context set against both tables:
+
+* pooled               - the RLS query of the notebook on kb
+* partitioned          - the same query on kb_partitioned, the partitions are pruned when the query runs
+* partitioned+tenantid - with an explicit tenantid = %s, so the planner only plans the tenant's partition
+
+Recall is measured against an exact top-k over all rows of the tenant:
+
+    docker run -e POSTGRES_HOST_AUTH_METHOD=trust -p 5432:5432 pgvector/pgvector:pg16
+    python benchmark_partitioned_kb.py --dsn postgresql://postgres@localhost/postgres --tenants 5 50 200
+"""
+import argparse
+import statistics
+import time
+
+import numpy as np
+import psycopg
+
+from benchmark_local_vector_tier import exact_top_k, setup, vector_literal
+from benchmark_stats import percentile
+from partitioned_kb import PartitionedKbMigrator
+
+QUERY_SQL = "SELECT chunks FROM self_managed.{0} ORDER BY embedding <=> %s::vector LIMIT %s"
+TENANT_QUERY_SQL = "SELECT chunks FROM self_managed.{0} WHERE tenantid = %s ORDER BY embedding <=> %s::vector LIMIT %s"
+
+
+def run_queries(conn, table, data, queries, k, seed, tenant_predicate=False):
+    rng = np.random.default_rng(seed)
+    tenants = sorted(data)
+    latencies, recalls = [], []
+    for n in range(queries):
+        tenantid = tenants[n % len(tenants)]
+        topics, vectors = data[tenantid]
+        query = topics[rng.integers(0, len(topics))] + 0.6 * rng.standard_normal(vectors.shape[1]).astype(np.float32)
+        expected = exact_top_k(vectors, query, k)
+        start = time.perf_counter()
+        with conn.transaction():
+            conn.execute("SELECT set_config('self_managed.kb.tenantid', %s, true)", (tenantid,))
+            if tenant_predicate:
+                rows = conn.execute(TENANT_QUERY_SQL.format(table), (tenantid, vector_literal(query), k)).fetchall()
+            else:
+                rows = conn.execute(QUERY_SQL.format(table), (vector_literal(query), k)).fetchall()
+        latencies.append((time.perf_counter() - start) * 1000)
+        found = {int(r[0].rsplit(" ", 1)[1]) for r in rows}
+        recalls.append(len(found & expected) / float(k))
+    return latencies, recalls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", required=True, help="libpq connection string of a superuser")
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--rows", type=int, default=20000, help="rows over all tenants")
+    parser.add_argument("--tenants", type=int, nargs="+", default=[5, 50, 200])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=2000, help="rows per migration batch")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    print("{0:>8} {1:<22} {2:>10} {3:>10} {4:>10} {5:>8}".format(
+        "tenants", "layout", "recall@" + str(args.k), "p50 ms", "p95 ms", "build s"))
+
+    def report(tenants, layout, results, build):
+        latencies, recalls = results
+        print("{0:>8} {1:<22} {2:>10.3f} {3:>10.2f} {4:>10.2f} {5:>8.1f}".format(
+            tenants, layout, statistics.mean(recalls), statistics.median(latencies), percentile(latencies, 95), build))
+
+    for tenants in args.tenants:
+        tenant_sizes = {"Tenant{0}".format(n): args.rows // tenants for n in range(tenants)}
+        start = time.perf_counter()
+        data = setup(args.dsn, tenant_sizes, args.dimensions, args.seed)
+        pooled_build = time.perf_counter() - start
+        # query the pooled table before the migration adds its (tenantid, id) index
+        with psycopg.connect(args.dsn, autocommit=True) as conn:
+            conn.execute("SET ROLE app_user")
+            report(tenants, "pooled", run_queries(conn, "kb", data, args.queries, args.k, args.seed + 1), pooled_build)
+
+        with psycopg.connect(args.dsn, autocommit=True) as conn:
+            migrator = PartitionedKbMigrator(conn, dimensions=args.dimensions)
+            migrator.create_partitioned_table()
+            start = time.perf_counter()
+            migrator.migrate(batch_size=args.batch_size)
+            migration = time.perf_counter() - start
+
+        with psycopg.connect(args.dsn, autocommit=True) as conn:
+            conn.execute("SET ROLE app_user")
+            report(tenants, "partitioned", run_queries(
+                conn, "kb_partitioned", data, args.queries, args.k, args.seed + 1), migration)
+            report(tenants, "partitioned+tenantid", run_queries(
+                conn, "kb_partitioned", data, args.queries, args.k, args.seed + 1, tenant_predicate=True), migration)
+
+
+if __name__ == "__main__":
+    main()
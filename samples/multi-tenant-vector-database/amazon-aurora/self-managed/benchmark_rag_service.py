@@ -0,0 +1,189 @@
+"""
+Offline benchmark of the serial notebook query flow against RagService.
+
+A batch of questions, spread over the tenants with a skewed distribution, is
+answered against the stub Bedrock clients in local_stubs.py and a simulated
+vector store query, so no AWS resources are needed:
+
+* serial      - generate_vector_embeddings, query_vector_database_using_rls, the raw records in the
+                prompt and invoke_llm_with_rag, one question after the other as in the notebook
+* rag_service - RagService.answer_many with streamed completions and a context token budget
+
+With --cache RagService also uses a SemanticRetrievalCache, and the batch is
+answered a second time, as when tenants ask the same questions again.
+
+Latencies are measured from the moment the batch is submitted, so they include
+the time a question waits for the ones before it. Time to first token is the
+time until the first text fragment of the answer is available:
+
+    python benchmark_rag_service.py --questions 64 --max-concurrency 16 --per-tenant 4
+    python benchmark_rag_service.py --knowledge-base
+    python benchmark_rag_service.py --skip-serial --cache
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+
+from benchmark_stats import percentile
+from local_stubs import StubBedrockAgentRuntime, StubBedrockRuntime, fake_embedding
+from rag_service import KnowledgeBaseRetriever, PROMPT_TEMPLATE, RagService, VectorDbRetriever, estimate_tokens
+from semantic_cache import SemanticRetrievalCache
+
+QUESTIONS = [
+    "What is the condition of the roof ?",
+    "Are there any issues with the electrical wiring ?",
+    "Does the property have damp problems ?",
+    "What repairs are recommended for the windows ?",
+]
+
+
+class StubVectorStore:
+    """Answers the notebook's RLS query from in-memory chunks, taking as long as its Data API round trips."""
+
+    def __init__(self, documents, latency):
+        self.documents = documents
+        self.latency = latency
+
+    def query(self, embedding, tenantid, k=5):
+        time.sleep(self.latency)
+        rows = [d for d in self.documents if d["tenantid"] == tenantid]
+        rows.sort(key=lambda d: -sum(a * b for a, b in zip(d["embedding"], embedding)))
+        return {"records": [
+            [{"stringValue": str(n)}, {"stringValue": tenantid}, {"stringValue": json.dumps(d["uri"])},
+             {"stringValue": d["text"]}]
+            for n, d in enumerate(rows[:k])
+        ]}
+
+
+def build_documents(tenants, chunks_per_tenant, chunk_chars, dimensions, seed):
+    rng = random.Random(seed)
+    words = "roof wiring damp windows walls survey inspection repair condition gutter chimney boiler".split()
+    documents = []
+    for t in range(tenants):
+        tenantid = "Tenant{0}".format(t + 1)
+        for c in range(chunks_per_tenant):
+            text = []
+            while sum(len(w) + 1 for w in text) < chunk_chars:
+                text.append(rng.choice(words))
+            text = " ".join(text)
+            documents.append({"tenantid": tenantid, "text": text, "embedding": fake_embedding(text, dimensions),
+                              "uri": "s3://bucket/Home_Survey_{0}.pdf".format(tenantid)})
+    return documents
+
+
+def build_questions(count, tenants, skew, seed):
+    # tenant n gets questions in proportion to 1 / n ** skew
+    rng = random.Random(seed)
+    names = ["Tenant{0}".format(t + 1) for t in range(tenants)]
+    weights = [1.0 / (t + 1) ** skew for t in range(tenants)]
+    return [(rng.choices(names, weights)[0], rng.choice(QUESTIONS)) for _ in range(count)]
+
+
+def serial(embed_runtime, llm_runtime, store, questions, dimensions):
+    # Mirrors Steps 8 to 10 of the notebook for each question.
+    first_tokens, totals, context_tokens = [], [], []
+    start = time.perf_counter()
+    for tenantid, question in questions:
+        response = embed_runtime.invoke_model(
+            body=json.dumps({"inputText": question, "dimensions": dimensions}),
+            modelId="amazon.titan-embed-text-v1",
+        )
+        embedding = json.loads(response["body"].read())["embedding"]
+        query_response = store.query(embedding, tenantid)
+        context = str(query_response["records"])
+        prompt = PROMPT_TEMPLATE.format(context=context, question=question)
+        llm_runtime.invoke_model(
+            body=json.dumps({"prompt": prompt, "max_tokens_to_sample": 300}), modelId="anthropic.claude-v2")
+        # without streaming the first token arrives with the last one
+        first_tokens.append(time.perf_counter() - start)
+        totals.append(time.perf_counter() - start)
+        context_tokens.append(estimate_tokens(context))
+    return first_tokens, totals, context_tokens, time.perf_counter() - start
+
+
+def concurrent(service, questions):
+    start = time.perf_counter()
+    results = asyncio.run(service.answer_many(questions))
+    elapsed = time.perf_counter() - start
+    errors = [r.error for r in results if r.error]
+    if errors:
+        raise errors[0]
+    return ([r.first_token for r in results], [r.total for r in results],
+            [r.context_tokens for r in results], elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", type=int, default=32)
+    parser.add_argument("--tenants", type=int, default=5)
+    parser.add_argument("--skew", type=float, default=1.2, help="Zipf exponent of the questions per tenant")
+    parser.add_argument("--max-concurrency", type=int, default=16)
+    parser.add_argument("--per-tenant", type=int, default=4, help="Questions of one tenant answered at the same time")
+    parser.add_argument("--context-tokens", type=int, default=2000, help="Context token budget of a prompt")
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--retrieve-latency", type=float, default=0.04,
+                        help="Seconds of the 4 Data API calls of query_vector_database_using_rls")
+    parser.add_argument("--first-token-latency", type=float, default=0.4)
+    parser.add_argument("--token-latency", type=float, default=0.01)
+    parser.add_argument("--answer-words", type=int, default=40)
+    parser.add_argument("--chunk-chars", type=int, default=10000, help="chunk_size of the notebook's text splitter")
+    parser.add_argument("--knowledge-base", action="store_true",
+                        help="Retrieve through the knowledge base retrieve API instead of the vector database")
+    parser.add_argument("--cache", action="store_true", help="Answer the batch twice through a SemanticRetrievalCache")
+    parser.add_argument("--skip-serial", action="store_true", help="Only run RagService")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    dimensions = 256
+    documents = build_documents(args.tenants, 8, args.chunk_chars, dimensions, args.seed)
+    questions = build_questions(args.questions, args.tenants, args.skew, args.seed)
+    completion = " ".join(["word"] * args.answer_words)
+    embed_runtime = StubBedrockRuntime(latency=args.embed_latency, dimensions=dimensions)
+    llm_runtime = StubBedrockRuntime(latency=args.first_token_latency, completion=completion,
+                                     token_latency=args.token_latency)
+    store = StubVectorStore(documents, args.retrieve_latency)
+
+    if args.knowledge_base:
+        retriever = KnowledgeBaseRetriever(StubBedrockAgentRuntime(documents, args.embed_latency + args.retrieve_latency),
+                                           "kb")
+    else:
+        def embed(text):
+            response = embed_runtime.invoke_model(body=json.dumps({"inputText": text}), modelId="amazon.titan-embed-text-v1")
+            return json.loads(response["body"].read())["embedding"]
+
+        retriever = VectorDbRetriever(embed, store.query)
+    service = RagService(retriever, llm_runtime, context_token_budget=args.context_tokens,
+                         max_concurrency=args.max_concurrency, max_concurrency_per_tenant=args.per_tenant,
+                         retrieval_cache=SemanticRetrievalCache() if args.cache else None)
+
+    counts = {}
+    for tenantid, _ in questions:
+        counts[tenantid] = counts.get(tenantid, 0) + 1
+    print("questions per tenant: {0}".format(", ".join("{0}={1}".format(t, c) for t, c in sorted(counts.items()))))
+    print("{0:<12} {1:>9} {2:>9} {3:>9} {4:>9} {5:>9} {6:>9} {7:>10} {8:>10}".format(
+        "mode", "ttft p50", "ttft p95", "ttft p99", "total p50", "total p95", "total p99", "context tk",
+        "questions/s"))
+
+    def report(mode, results):
+        first_tokens, totals, context_tokens, elapsed = results
+        print("{0:<12} {1:>9.2f} {2:>9.2f} {3:>9.2f} {4:>9.2f} {5:>9.2f} {6:>9.2f} {7:>10.0f} {8:>10.1f}".format(
+            mode, statistics.median(first_tokens), percentile(first_tokens, 95), percentile(first_tokens, 99),
+            statistics.median(totals), percentile(totals, 95), percentile(totals, 99),
+            statistics.mean(context_tokens), len(totals) / elapsed))
+
+    if not args.skip_serial:
+        report("serial", serial(embed_runtime, llm_runtime, store, questions, dimensions))
+    try:
+        report("rag_service", concurrent(service, questions))
+        if args.cache:
+            report("cached", concurrent(service, questions))
+            print(service.retrieval_cache.stats())
+    finally:
+        service.close()
+
+
+if __name__ == "__main__":
+    main()
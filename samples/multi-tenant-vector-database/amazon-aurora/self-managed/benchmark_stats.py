@@ -0,0 +1,14 @@
+"""
+Statistics shared by the benchmarks of the self-managed sample.
+"""
+
+
+def percentile(samples, p):
+    """
+    Nearest-rank percentile of the samples
+    :param samples: The measured values
+    :param p: The percentile, from 0 to 100
+    :return: The sample at the p-th percentile
+    """
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
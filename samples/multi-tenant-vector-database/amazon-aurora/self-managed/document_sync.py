@@ -0,0 +1,188 @@
+"""
+Streaming, incremental ingestion of tenant documents.
+
+insert_tenant_document loads the whole PDF, splits it in memory and inserts
+every chunk with a new uuid4, so re-ingesting a document duplicates its rows.
+DocumentSync reads the document page by page and passes the chunks of each page
+through IngestionPipeline as a generator, so only a few pages are in memory at
+a time. Every chunk gets an ID derived from the tenant, the document and its
+content, so on re-ingestion:
+
+* chunks already stored are skipped and not embedded again
+* new or changed chunks are embedded and inserted
+* chunks no longer in the document are deleted
+
+Usage from the notebook:
+
+    document_sync = DocumentSync(ingestion_pipeline, text_splitter)
+    manifest = document_sync.sync_document(file_name, "Tenant2")
+    print(manifest)
+"""
+import hashlib
+import json
+import time
+import uuid
+
+from embedding_cache import normalize_text
+
+EXISTING_IDS_SQL = (
+    "SELECT id::text AS id FROM self_managed.kb WHERE tenantid = :tenantid AND metadata::jsonb = :metadata::jsonb"
+)
+DELETE_SQL = "DELETE FROM self_managed.kb WHERE tenantid = :tenantid AND id = ANY(:ids::uuid[])"
+
+
+def iter_pdf_pages(file_name):
+    """
+    Read the text of a PDF one page at a time
+    :param file_name: The PDF file
+    :return: A generator of page texts
+    """
+    from pypdf import PdfReader
+
+    reader = PdfReader(file_name)
+    for page in reader.pages:
+        yield page.extract_text() or ""
+
+
+def chunk_id(tenantid, document, text, occurrence=0):
+    """
+    Build the deterministic ID of a chunk
+    :param tenantid: The tenant
+    :param document: The document the chunk belongs to
+    :param text: The chunk text
+    :param occurrence: How many identical chunks came before it in the document
+    :return: A UUID string
+    """
+    digest = hashlib.sha256(json.dumps([tenantid, document, normalize_text(text), occurrence]).encode("utf-8"))
+    return str(uuid.UUID(bytes=digest.digest()[:16]))
+
+
+class Chunk:
+    """A chunk with its ID, accepted by IngestionPipeline.ingest like a LangChain document."""
+
+    def __init__(self, id, page_content, page):
+        self.id = id
+        self.page_content = page_content
+        self.page = page
+
+
+class DocumentManifest:
+    """What a sync of one document did."""
+
+    def __init__(self, document, tenantid):
+        self.document = document
+        self.tenantid = tenantid
+        self.pages = 0
+        self.skipped = []
+        self.added = []
+        self.removed = []
+        self.elapsed = 0.0
+
+    def to_dict(self):
+        return {
+            "document": self.document,
+            "tenantid": self.tenantid,
+            "pages": self.pages,
+            "skipped": self.skipped,
+            "added": self.added,
+            "removed": self.removed,
+            "elapsed": round(self.elapsed, 3),
+        }
+
+    def __repr__(self):
+        return "DocumentManifest(document={0!r}, tenantid={1!r}, pages={2}, skipped={3}, added={4}, removed={5}, elapsed={6:.2f}s)".format(
+            self.document, self.tenantid, self.pages, len(self.skipped), len(self.added), len(self.removed), self.elapsed
+        )
+
+
+class DocumentSync:
+    """
+    Keeps the chunks of a tenant document in self_managed.kb in line with the document
+    :param pipeline: The IngestionPipeline used to embed and insert chunks, its Data API client and secret are
+        also used to read and delete the document's existing chunks
+    :param text_splitter: Splits the text of a page, e.g. a LangChain RecursiveCharacterTextSplitter
+    :param page_loader: Function returning the page texts of a document, iter_pdf_pages by default
+    :param delete_batch_size: The number of chunk IDs per delete statement
+    :param on_change: Function called with the tenant ID and the manifest when chunks of a tenant were added
+        or removed, e.g. to invalidate the tenant's entries of a SemanticRetrievalCache
+    """
+
+    def __init__(self, pipeline, text_splitter, page_loader=iter_pdf_pages, delete_batch_size=500, on_change=None):
+        self.pipeline = pipeline
+        self.text_splitter = text_splitter
+        self.page_loader = page_loader
+        self.delete_batch_size = delete_batch_size
+        self.on_change = on_change
+
+    def _execute(self, sql, parameters):
+        return self.pipeline._call_with_backoff(
+            self.pipeline.rds_data.execute_statement,
+            resourceArn=self.pipeline.cluster_arn,
+            secretArn=self.pipeline.secret_arn,
+            database=self.pipeline.database,
+            sql=sql,
+            parameters=parameters,
+            formatRecordsAs="JSON",
+        )
+
+    def existing_ids(self, document, tenantid):
+        response = self._execute(EXISTING_IDS_SQL, [
+            {"name": "tenantid", "value": {"stringValue": tenantid}},
+            {"name": "metadata", "value": {"stringValue": json.dumps(document)}},
+        ])
+        return {r["id"] for r in json.loads(response.get("formattedRecords") or "[]")}
+
+    def iter_chunks(self, document, tenantid, manifest=None):
+        """
+        Split the document page by page into chunks with deterministic IDs
+        :param document: The document file name, also stored as the chunk metadata
+        :param tenantid: The tenant the document belongs to
+        :param manifest: A DocumentManifest whose page count is updated
+        :return: A generator of Chunk
+        """
+        occurrences = {}
+        for page_number, text in enumerate(self.page_loader(document), start=1):
+            if manifest is not None:
+                manifest.pages = page_number
+            for text_chunk in self.text_splitter.split_text(text):
+                key = normalize_text(text_chunk)
+                if not key:
+                    continue
+                occurrence = occurrences.get(key, 0)
+                occurrences[key] = occurrence + 1
+                yield Chunk(chunk_id(tenantid, document, text_chunk, occurrence), text_chunk, page_number)
+
+    def sync_document(self, document, tenantid):
+        """
+        Ingest a new or changed document, only embedding the chunks that are not stored yet
+        :param document: The document file name
+        :param tenantid: The tenant the document belongs to
+        :return: The DocumentManifest of the skipped, added and removed chunk IDs
+        """
+        manifest = DocumentManifest(document, tenantid)
+        start = time.perf_counter()
+        existing = self.existing_ids(document, tenantid)
+        seen = set()
+
+        def changed_chunks():
+            for chunk in self.iter_chunks(document, tenantid, manifest):
+                seen.add(chunk.id)
+                if chunk.id in existing:
+                    manifest.skipped.append(chunk.id)
+                else:
+                    manifest.added.append(chunk.id)
+                    yield chunk
+
+        self.pipeline.ingest(changed_chunks(), document, tenantid)
+
+        manifest.removed = sorted(existing - seen)
+        for offset in range(0, len(manifest.removed), self.delete_batch_size):
+            ids = manifest.removed[offset:offset + self.delete_batch_size]
+            self._execute(DELETE_SQL, [
+                {"name": "tenantid", "value": {"stringValue": tenantid}},
+                {"name": "ids", "value": {"stringValue": "{" + ",".join(ids) + "}"}},
+            ])
+        manifest.elapsed = time.perf_counter() - start
+        if self.on_change is not None and (manifest.added or manifest.removed):
+            self.on_change(tenantid, manifest)
+        return manifest
@@ -0,0 +1,234 @@
+"""
+Content-addressed cache of text embeddings.
+
+Embeddings are keyed on (model ID, SHA-256 of the normalized text), so
+re-ingested documents, overlapping chunks and repeated questions are only
+embedded once. The cache has two tiers:
+
+* memory - an LRU of up to max_entries embeddings
+* disk   - one file per embedding with the raw little-endian float32 values,
+           shared between notebook sessions and processes
+
+Usage from the notebook:
+
+    cache = EmbeddingCache(directory=".embedding_cache")
+    embedding = cache.get_or_compute(model_id, text, generate_vector_embeddings)
+    embeddings = cache.get_or_compute_many(model_id, texts, generate_vector_embeddings)
+    print(cache.stats)
+"""
+import hashlib
+import os
+import re
+import sys
+import tempfile
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """
+    Normalize the text the same way for every cache lookup
+    :param text: The text to embed
+    :return: The NFC normalized text, with runs of whitespace collapsed to a single space
+    """
+    return WHITESPACE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+def cache_key(model_id, text):
+    """
+    Build the cache key of a text
+    :param model_id: The embedding model
+    :param text: The text to embed
+    :return: The hex digest of the model ID and the normalized text
+    """
+    digest = hashlib.sha256(model_id.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(normalize_text(text).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class EmbeddingCacheStats:
+    """Counters of the cache lookups."""
+
+    def __init__(self):
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.deduplicated = 0
+
+    @property
+    def lookups(self):
+        return self.memory_hits + self.disk_hits + self.misses + self.deduplicated
+
+    @property
+    def saved_calls(self):
+        # every lookup that did not call the model
+        return self.memory_hits + self.disk_hits + self.deduplicated
+
+    @property
+    def hit_rate(self):
+        return self.saved_calls / self.lookups if self.lookups else 0.0
+
+    def __repr__(self):
+        return ("EmbeddingCacheStats(memory_hits={0}, disk_hits={1}, misses={2}, deduplicated={3}, "
+                "saved_calls={4}, hit_rate={5:.1%})").format(
+            self.memory_hits, self.disk_hits, self.misses, self.deduplicated, self.saved_calls, self.hit_rate
+        )
+
+
+class EmbeddingCache:
+    """
+    Two-tier embedding cache
+    :param max_entries: The number of embeddings kept in memory
+    :param directory: The directory of the disk tier, None to only cache in memory
+    """
+
+    def __init__(self, max_entries=10000, directory=None):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.stats = EmbeddingCacheStats()
+        self._memory = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".f32")
+
+    def _remember(self, key, vector):
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _read(self, key):
+        if self.directory is None:
+            return None
+        try:
+            with open(self._path(key), "rb") as f:
+                vector = array("f")
+                vector.frombytes(f.read())
+        except (FileNotFoundError, ValueError):
+            return None
+        if sys.byteorder != "little":
+            vector.byteswap()
+        return vector
+
+    def _write(self, key, vector):
+        if self.directory is None:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = array("f", vector)
+        if sys.byteorder != "little":
+            data.byteswap()
+        # write to a temporary file first, so readers never see a partial embedding
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data.tobytes())
+        os.replace(tmp, path)
+
+    def _lookup(self, key):
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.stats.memory_hits += 1
+                return vector
+        vector = self._read(key)
+        if vector is not None:
+            self._remember(key, vector)
+            with self._lock:
+                self.stats.disk_hits += 1
+        return vector
+
+    def get(self, model_id, text):
+        """
+        Look up the embedding of a text
+        :param model_id: The embedding model
+        :param text: The text
+        :return: The embedding as a list of floats, or None when it is not cached
+        """
+        vector = self._lookup(cache_key(model_id, text))
+        return vector.tolist() if vector is not None else None
+
+    def put(self, model_id, text, embedding):
+        """
+        Store the embedding of a text in both tiers
+        :param model_id: The embedding model
+        :param text: The text
+        :param embedding: The embedding as a list of floats
+        """
+        key = cache_key(model_id, text)
+        vector = array("f", embedding)
+        self._remember(key, vector)
+        self._write(key, vector)
+
+    def get_or_compute(self, model_id, text, compute):
+        """
+        Look up the embedding of a text, and compute it on a miss. Concurrent calls for the
+        same text wait for the first one instead of calling the model again.
+        :param model_id: The embedding model
+        :param text: The text
+        :param compute: Function returning the embedding of a text, e.g. generate_vector_embeddings
+        :return: The embedding as a list of floats
+        """
+        key = cache_key(model_id, text)
+        vector = self._lookup(key)
+        if vector is not None:
+            return vector.tolist()
+        with self._lock:
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = self._in_flight[key] = Future()
+                self.stats.misses += 1
+            else:
+                self.stats.deduplicated += 1
+        if not owner:
+            return future.result()
+        try:
+            embedding = compute(text)
+            self.put(model_id, text, embedding)
+            future.set_result(embedding)
+            return embedding
+        except BaseException as err:
+            future.set_exception(err)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def get_or_compute_many(self, model_id, texts, compute, max_workers=1):
+        """
+        Embed a batch of texts, calling the model once per distinct uncached text
+        :param model_id: The embedding model
+        :param texts: The texts
+        :param compute: Function returning the embedding of a text
+        :param max_workers: The number of concurrent model calls
+        :return: The embeddings, in the order of the texts
+        """
+        keys = [cache_key(model_id, text) for text in texts]
+        distinct = OrderedDict()
+        for key, text in zip(keys, texts):
+            if key in distinct:
+                with self._lock:
+                    self.stats.deduplicated += 1
+            else:
+                distinct[key] = text
+        if max_workers > 1 and len(distinct) > 1:
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                embeddings = dict(zip(distinct, pool.map(
+                    lambda text: self.get_or_compute(model_id, text, compute), distinct.values())))
+        else:
+            embeddings = {key: self.get_or_compute(model_id, text, compute) for key, text in distinct.items()}
+        return [embeddings[key] for key in keys]
+
+    def clear_memory(self):
+        with self._lock:
+            self._memory.clear()
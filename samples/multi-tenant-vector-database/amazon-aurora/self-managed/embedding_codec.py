@@ -0,0 +1,127 @@
+"""
+Encodings of embeddings sent to Aurora through the RDS Data API.
+
+str(embedding) sends the Python repr of 1536 floats, about 30 KB of text per
+vector that PostgreSQL then parses with ::vector. EmbeddingCodec builds the
+Data API parameter and the matching SQL expression for a more compact encoding:
+
+* text    - str(embedding), the notebook's original format
+* trimmed - a vector literal with `precision` significant digits, about 40% of the size
+* blob    - little-endian float32 bytes sent as blobValue, 6 KB per 1536 dimensions,
+            decoded in the database by the self_managed.vector_from_float4le function
+
+The storage type can be vector, or halfvec (pgvector 0.7.0 or later) to halve
+the table and index size. For fewer dimensions, ask the embedding model for them,
+e.g. amazon.titan-embed-text-v2:0 with IngestionPipeline(..., dimensions=512),
+and create the column with codec.column_type.
+
+    codec = EmbeddingCodec("blob", storage="halfvec")
+    rdsData.execute_statement(..., sql=codec.insert_sql(), ...)
+
+Create the decode function once with FLOAT4LE_FUNCTION_SQL before using the blob encoding.
+"""
+import json
+import struct
+
+ENCODINGS = ("text", "trimmed", "blob")
+STORAGE_TYPES = ("vector", "halfvec")
+
+# PostgreSQL cannot cast bytea to vector, and SQL has no float reinterpretation, so the IEEE 754 fields
+# are decoded arithmetically. Embeddings never contain infinities or NaN, which pgvector rejects anyway.
+FLOAT4LE_FUNCTION_SQL = """
+CREATE OR REPLACE FUNCTION self_managed.vector_from_float4le(b bytea) RETURNS real[]
+LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE AS $$
+SELECT array_agg(
+    CASE WHEN e = 0 THEN m * 2::float8 ^ -149 ELSE (8388608 + m) * 2::float8 ^ (e - 150) END
+    * CASE WHEN s = 1 THEN -1 ELSE 1 END ORDER BY i)::real[]
+FROM (
+    SELECT i, bits >> 31 AS s, (bits >> 23) & 255 AS e, bits & 8388607 AS m
+    FROM (
+        SELECT i, get_byte(b, 4 * i)::bigint | (get_byte(b, 4 * i + 1)::bigint << 8)
+               | (get_byte(b, 4 * i + 2)::bigint << 16) | (get_byte(b, 4 * i + 3)::bigint << 24) AS bits
+        FROM generate_series(0, length(b) / 4 - 1) AS i
+    ) AS words
+) AS fields
+$$;
+"""
+
+
+class EmbeddingCodec:
+    """
+    Encodes embeddings as RDS Data API parameters
+    :param encoding: One of ENCODINGS
+    :param storage: The column type, one of STORAGE_TYPES
+    :param dimensions: The number of dimensions of the embeddings and the column
+    :param precision: The significant digits kept by the trimmed encoding
+    :param schema: The schema of the vector_from_float4le function
+    """
+
+    def __init__(self, encoding="text", storage="vector", dimensions=1536, precision=5, schema="self_managed"):
+        if encoding not in ENCODINGS:
+            raise ValueError("Unknown encoding {0}, expected one of {1}".format(encoding, ENCODINGS))
+        if storage not in STORAGE_TYPES:
+            raise ValueError("Unknown storage {0}, expected one of {1}".format(storage, STORAGE_TYPES))
+        self.encoding = encoding
+        self.storage = storage
+        self.dimensions = dimensions
+        self.precision = precision
+        self.schema = schema
+        self._trimmed_format = "{{0:.{0}g}}".format(precision).format
+
+    @property
+    def column_type(self):
+        return "{0}({1})".format(self.storage, self.dimensions)
+
+    @property
+    def index_ops(self):
+        return "{0}_cosine_ops".format(self.storage)
+
+    def encode(self, embedding):
+        """
+        Encode an embedding
+        :param embedding: A list of floats
+        :return: The Data API parameter value, e.g. {"blobValue": b"..."}
+        """
+        if len(embedding) != self.dimensions:
+            raise ValueError("Expected {0} dimensions, got {1}".format(self.dimensions, len(embedding)))
+        if self.encoding == "blob":
+            return {"blobValue": struct.pack("<{0}f".format(len(embedding)), *embedding)}
+        if self.encoding == "trimmed":
+            return {"stringValue": "[" + ",".join(map(self._trimmed_format, embedding)) + "]"}
+        return {"stringValue": str(embedding)}
+
+    def parameter(self, name, embedding):
+        return {"name": name, "value": self.encode(embedding)}
+
+    def sql_value(self, name):
+        """
+        The SQL expression converting the parameter to the storage type
+        :param name: The parameter name
+        :return: e.g. ':embedding::vector'
+        """
+        if self.encoding == "blob":
+            return "{0}.vector_from_float4le(:{1})::{2}".format(self.schema, name, self.storage)
+        return ":{0}::{1}".format(name, self.storage)
+
+    def insert_sql(self, table="self_managed.kb"):
+        return (
+            "INSERT INTO {0}(id, embedding, chunks, metadata, tenantid) "
+            "VALUES (:id::uuid,{1},:chunks, :metadata, :tenantid::varchar(10)) "
+            "ON CONFLICT DO NOTHING"
+        ).format(table, self.sql_value("embedding"))
+
+    def query_sql(self, table="self_managed.kb", columns="id,metadata,chunks", limit=5):
+        return "SELECT {0} FROM {1} ORDER BY embedding <=> {2} LIMIT {3}".format(
+            columns, table, self.sql_value("embedding"), int(limit))
+
+
+def payload_size(parameter):
+    """
+    The size of a parameter in the JSON body of the Data API request, blobs are sent base64 encoded
+    :param parameter: A Data API parameter
+    :return: The size in bytes
+    """
+    value = parameter["value"]
+    if "blobValue" in value:
+        return len(json.dumps({"name": parameter["name"], "value": {"blobValue": ""}})) + (len(value["blobValue"]) + 2) // 3 * 4
+    return len(json.dumps(parameter))
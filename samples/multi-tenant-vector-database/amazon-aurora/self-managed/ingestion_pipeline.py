@@ -0,0 +1,212 @@
+"""
+Concurrent, batched ingestion of tenant document chunks into self_managed.kb.
+
+Embeddings are generated by a bounded thread pool and the rows are written
+with RDS Data API batch_execute_statement, so a document with N chunks costs
+roughly N / batch_size write round trips instead of N.
+
+Usage from the notebook:
+
+    pipeline = IngestionPipeline(bedrock_runtime, rdsData, cluster_arn, secret_arn, db_name)
+    stats = pipeline.ingest(chunks, file_name, "Tenant2")
+    print(stats)
+"""
+import json
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from botocore.exceptions import ClientError
+
+EMBEDDING_MODEL_ID = "amazon.titan-embed-text-v1"
+
+INSERT_SQL = (
+    "INSERT INTO self_managed.kb(id, embedding, chunks, metadata, tenantid) "
+    "VALUES (:id::uuid,:embedding::vector,:chunks, :metadata, :tenantid::varchar(10)) "
+    "ON CONFLICT DO NOTHING"
+)
+
+THROTTLING_ERROR_CODES = (
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceUnavailableException",
+    "ModelNotReadyException",
+)
+
+
+def is_throttling_error(err):
+    return isinstance(err, ClientError) and err.response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+
+
+class IngestionStats:
+    """Counters collected while ingesting a set of chunks."""
+
+    def __init__(self):
+        self.chunks = 0
+        self.batches = 0
+        self.throttles = 0
+        self.elapsed = 0.0
+
+    @property
+    def chunks_per_second(self):
+        return self.chunks / self.elapsed if self.elapsed else 0.0
+
+    def __repr__(self):
+        return "IngestionStats(chunks={0}, batches={1}, throttles={2}, elapsed={3:.2f}s, chunks_per_second={4:.1f})".format(
+            self.chunks, self.batches, self.throttles, self.elapsed, self.chunks_per_second
+        )
+
+
+class IngestionPipeline:
+    """
+    Embeds chunks concurrently and writes them to the vector store in batches
+    :param bedrock_runtime: The bedrock-runtime client used to generate embeddings
+    :param rds_data: The rds-data client used to write the rows
+    :param cluster_arn: The ARN of the Aurora cluster
+    :param secret_arn: The ARN of the secret used to connect to the database
+    :param database: The database name
+    :param model_id: The Bedrock embedding model
+    :param max_workers: The number of concurrent embedding calls
+    :param batch_size: The number of rows sent in each batch_execute_statement call
+    :param max_retries: The number of retries of a throttled call before giving up
+    :param base_delay: The initial backoff delay, in seconds, after a throttled call
+    :param max_delay: The upper bound of the backoff delay, in seconds
+    :param embedding_cache: An EmbeddingCache, so repeated chunks are only embedded once
+    :param codec: An EmbeddingCodec for a more compact encoding than str(embedding)
+    :param dimensions: The number of dimensions requested from models that support it, e.g. Titan Text Embeddings V2
+    """
+
+    def __init__(self, bedrock_runtime, rds_data, cluster_arn, secret_arn, database,
+                 model_id=EMBEDDING_MODEL_ID, max_workers=8, batch_size=25,
+                 max_retries=8, base_delay=0.2, max_delay=10.0, embedding_cache=None,
+                 codec=None, dimensions=None):
+        self.bedrock_runtime = bedrock_runtime
+        self.rds_data = rds_data
+        self.cluster_arn = cluster_arn
+        self.secret_arn = secret_arn
+        self.database = database
+        self.model_id = model_id
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.embedding_cache = embedding_cache
+        self.codec = codec
+        self.dimensions = dimensions
+        self._lock = threading.Lock()
+        self._resume_at = 0.0
+        self._stats = IngestionStats()
+
+    def _wait_for_backpressure(self):
+        # Every worker honours the latest throttle, not only the one that got it.
+        while True:
+            with self._lock:
+                delay = self._resume_at - time.monotonic()
+            if delay <= 0:
+                return
+            time.sleep(delay)
+
+    def _call_with_backoff(self, fn, **kwargs):
+        attempt = 0
+        while True:
+            self._wait_for_backpressure()
+            try:
+                return fn(**kwargs)
+            except ClientError as err:
+                if not is_throttling_error(err) or attempt >= self.max_retries:
+                    raise
+                delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+                delay = random.uniform(delay / 2, delay)
+                with self._lock:
+                    self._stats.throttles += 1
+                    self._resume_at = max(self._resume_at, time.monotonic() + delay)
+                attempt += 1
+
+    def generate_vector_embeddings(self, data):
+        """
+        Generate the embedding of a single text, retrying throttled calls
+        :param data: The text to embed
+        :return: The embedding as a list of floats
+        """
+        if self.embedding_cache is not None:
+            model_id = "{0}:{1}".format(self.model_id, self.dimensions) if self.dimensions else self.model_id
+            return self.embedding_cache.get_or_compute(model_id, data, self._invoke_embedding_model)
+        return self._invoke_embedding_model(data)
+
+    def _invoke_embedding_model(self, data):
+        request = {"inputText": data}
+        if self.dimensions:
+            request["dimensions"] = self.dimensions
+        response = self._call_with_backoff(
+            self.bedrock_runtime.invoke_model,
+            body=json.dumps(request),
+            modelId=self.model_id,
+            accept="application/json",
+            contentType="application/json",
+        )
+        return json.loads(response["body"].read()).get("embedding")
+
+    def _build_parameters(self, chunk, metadata, tenantid, chunk_id=None):
+        embedding = self.generate_vector_embeddings(chunk)
+        return [
+            {"name": "id", "value": {"stringValue": chunk_id or str(uuid.uuid4())}},
+            self.codec.parameter("embedding", embedding) if self.codec else
+            {"name": "embedding", "value": {"stringValue": str(embedding)}},
+            {"name": "chunks", "value": {"stringValue": chunk}},
+            {"name": "metadata", "value": {"stringValue": json.dumps(metadata)}, "typeHint": "JSON"},
+            {"name": "tenantid", "value": {"stringValue": tenantid}},
+        ]
+
+    def _write_batch(self, parameter_sets):
+        self._call_with_backoff(
+            self.rds_data.batch_execute_statement,
+            resourceArn=self.cluster_arn,
+            secretArn=self.secret_arn,
+            database=self.database,
+            sql=self.codec.insert_sql() if self.codec else INSERT_SQL,
+            parameterSets=parameter_sets,
+        )
+        with self._lock:
+            self._stats.chunks += len(parameter_sets)
+            self._stats.batches += 1
+
+    def ingest(self, chunks, metadata, tenantid):
+        """
+        Embed and insert the chunks of a tenant document
+        :param chunks: An iterable of strings or LangChain documents. Documents with an id keep it,
+            and a chunk whose id is already stored is not inserted again
+        :param metadata: The metadata stored with every chunk, e.g. the file name
+        :param tenantid: The tenant the document belongs to
+        :return: The IngestionStats of this run
+        """
+        self._stats = IngestionStats()
+        start = time.perf_counter()
+        # Bound the number of embeddings held in memory while the writer catches up.
+        max_in_flight = self.max_workers * 2
+        pending = set()
+        batch = []
+
+        def collect(done):
+            for future in done:
+                batch.append(future.result())
+                if len(batch) >= self.batch_size:
+                    self._write_batch(batch[:])
+                    del batch[:]
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            for chunk in chunks:
+                text = getattr(chunk, "page_content", chunk)
+                if len(pending) >= max_in_flight:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                pending.add(pool.submit(self._build_parameters, text, metadata, tenantid, getattr(chunk, "id", None)))
+            done, _ = wait(pending)
+            collect(done)
+        if batch:
+            self._write_batch(batch)
+
+        self._stats.elapsed = time.perf_counter() - start
+        return self._stats
@@ -0,0 +1,322 @@
+"""
+Local stand-ins for the Bedrock runtime, Bedrock agent, RDS Data API and S3 clients.
+
+They implement just enough of the boto3 client interface used by the notebook
+helpers to run and benchmark them offline. Latency and throttling are
+simulated so concurrency and backoff behave the same way they do against AWS.
+"""
+import hashlib
+import io
+import json
+import random
+import re
+import threading
+import time
+
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+
+
+def fake_embedding(text, dimensions=1536):
+    """
+    Build a deterministic unit-length embedding from the text digest
+    :param text: The text to embed
+    :param dimensions: The number of dimensions of the embedding
+    :return: A list of floats
+    """
+    seed = hashlib.sha256(text.encode("utf-8")).digest()
+    rng = random.Random(seed)
+    vector = [rng.gauss(0.0, 1.0) for _ in range(dimensions)]
+    norm = sum(v * v for v in vector) ** 0.5 or 1.0
+    return [v / norm for v in vector]
+
+
+def throttling_error(operation_name):
+    return ClientError(
+        {"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"}},
+        operation_name,
+    )
+
+
+class CallCounter:
+    """Thread-safe per-operation call counter shared by the stub clients."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = {}
+
+    def record(self, operation_name):
+        with self._lock:
+            self.calls[operation_name] = self.calls.get(operation_name, 0) + 1
+
+    @property
+    def total(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+
+class StubBedrockRuntime(CallCounter):
+    """
+    Stand-in for the bedrock-runtime client
+    :param latency: Seconds each invoke_model call takes
+    :param dimensions: Number of dimensions returned for embedding models
+    :param throttle_rate: Probability in [0, 1) that a call raises ThrottlingException
+    :param completion: Text returned for text generation models
+    :param token_latency: Seconds each token of the completion takes to generate, after latency
+    """
+
+    def __init__(self, latency=0.05, dimensions=1536, throttle_rate=0.0, completion="The roof is in good condition.",
+                 token_latency=0.0):
+        super().__init__()
+        self.latency = latency
+        self.dimensions = dimensions
+        self.throttle_rate = throttle_rate
+        self.completion = completion
+        self.token_latency = token_latency
+        self._rng = random.Random(7)
+
+    def _completion_tokens(self):
+        return re.findall(r"\s*\S+", self.completion)
+
+    def _maybe_throttle(self, operation_name):
+        self.record(operation_name)
+        with self._lock:
+            throttled = self._rng.random() < self.throttle_rate
+        if throttled:
+            raise throttling_error(operation_name)
+        time.sleep(self.latency)
+
+    def invoke_model(self, body, modelId, accept="application/json", contentType="application/json"):
+        self._maybe_throttle("InvokeModel")
+        request = json.loads(body)
+        if "inputText" in request:
+            result = {
+                "embedding": fake_embedding(request["inputText"], request.get("dimensions", self.dimensions)),
+                "inputTextTokenCount": len(request["inputText"].split()),
+            }
+        else:
+            time.sleep(self.token_latency * len(self._completion_tokens()))
+            result = {"completion": self.completion, "stop_reason": "stop_sequence"}
+        return {"body": io.BytesIO(json.dumps(result).encode("utf-8")), "contentType": accept}
+
+    def invoke_model_with_response_stream(self, body, modelId, accept="application/json",
+                                          contentType="application/json"):
+        self._maybe_throttle("InvokeModelWithResponseStream")
+        tokens = self._completion_tokens()
+
+        def events():
+            for n, token in enumerate(tokens):
+                if n:
+                    time.sleep(self.token_latency)
+                stop_reason = "stop_sequence" if n == len(tokens) - 1 else None
+                chunk = {"completion": token, "stop_reason": stop_reason}
+                yield {"chunk": {"bytes": json.dumps(chunk).encode("utf-8")}}
+
+        return {"body": events(), "contentType": accept}
+
+
+class StubBedrockAgentRuntime(CallCounter):
+    """
+    Stand-in for the bedrock-agent-runtime client of a knowledge base with a tenantId metadata attribute
+    :param documents: A list of dicts with tenantid, text and uri
+    :param latency: Seconds each retrieve call takes
+    """
+
+    def __init__(self, documents=(), latency=0.1):
+        super().__init__()
+        self.documents = list(documents)
+        self.latency = latency
+
+    def retrieve(self, retrievalQuery, knowledgeBaseId, retrievalConfiguration=None):
+        self.record("Retrieve")
+        time.sleep(self.latency)
+        search = (retrievalConfiguration or {}).get("vectorSearchConfiguration", {})
+        tenant_filter = search.get("filter", {}).get("equals")
+        words = set(retrievalQuery["text"].lower().split())
+        scored = []
+        for document in self.documents:
+            if tenant_filter and document["tenantid"] != tenant_filter["value"]:
+                continue
+            overlap = len(words & set(document["text"].lower().split()))
+            scored.append((overlap / float(len(words) or 1), document))
+        scored.sort(key=lambda pair: -pair[0])
+        return {"retrievalResults": [
+            {"content": {"text": document["text"]}, "score": score,
+             "location": {"type": "S3", "s3Location": {"uri": document["uri"]}},
+             "metadata": {"tenantId": document["tenantid"]}}
+            for score, document in scored[:search.get("numberOfResults", 5)]
+        ]}
+
+
+class StubRdsData(CallCounter):
+    """
+    Stand-in for the rds-data client that keeps inserted rows in memory
+    :param latency: Seconds each Data API call takes
+    :param throttle_rate: Probability in [0, 1) that a call raises ThrottlingException
+    """
+
+    def __init__(self, latency=0.01, throttle_rate=0.0):
+        super().__init__()
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.rows = []
+        self._rng = random.Random(11)
+        self._transactions = 0
+
+    def _maybe_throttle(self, operation_name):
+        self.record(operation_name)
+        with self._lock:
+            throttled = self._rng.random() < self.throttle_rate
+        if throttled:
+            raise throttling_error(operation_name)
+        time.sleep(self.latency)
+
+    @staticmethod
+    def _row(parameters):
+        row = {}
+        for param in parameters:
+            value = param["value"]
+            row[param["name"]] = next(iter(value.values()))
+        return row
+
+    def execute_statement(self, resourceArn, secretArn, database=None, sql="", parameters=None, transactionId=None, **kwargs):
+        self._maybe_throttle("ExecuteStatement")
+        if sql.lstrip().upper().startswith("INSERT"):
+            with self._lock:
+                self.rows.append(self._row(parameters or []))
+            return {"numberOfRecordsUpdated": 1, "generatedFields": []}
+        return {"numberOfRecordsUpdated": 0, "records": []}
+
+    def batch_execute_statement(self, resourceArn, secretArn, sql, parameterSets, database=None, transactionId=None, **kwargs):
+        self._maybe_throttle("BatchExecuteStatement")
+        with self._lock:
+            self.rows.extend(self._row(parameters) for parameters in parameterSets)
+        return {"updateResults": [{"generatedFields": []} for _ in parameterSets]}
+
+    def begin_transaction(self, resourceArn, secretArn, database=None, **kwargs):
+        self._maybe_throttle("BeginTransaction")
+        with self._lock:
+            self._transactions += 1
+            return {"transactionId": "tx-{0}".format(self._transactions)}
+
+    def commit_transaction(self, resourceArn, secretArn, transactionId):
+        self._maybe_throttle("CommitTransaction")
+        return {"transactionStatus": "Transaction Committed"}
+
+    def rollback_transaction(self, resourceArn, secretArn, transactionId):
+        self._maybe_throttle("RollbackTransaction")
+        return {"transactionStatus": "Rollback Complete"}
+
+
+class StubS3(CallCounter):
+    """
+    Stand-in for the S3 client that keeps objects in memory
+    :param latency: Seconds each request takes
+    :param bandwidth_mbps: The upload bandwidth of one connection, multipart uploads use
+        up to the max_concurrency of their TransferConfig in parallel
+    """
+
+    def __init__(self, latency=0.02, bandwidth_mbps=100.0):
+        super().__init__()
+        self.latency = latency
+        self.bandwidth_mbps = bandwidth_mbps
+        self.objects = {}
+
+    def _transfer(self, size, connections=1):
+        time.sleep(self.latency + size * 8 / (self.bandwidth_mbps * 1e6 * connections))
+
+    def head_object(self, Bucket, Key):
+        self.record("HeadObject")
+        time.sleep(self.latency)
+        with self._lock:
+            stored = self.objects.get((Bucket, Key))
+        if stored is None:
+            raise ClientError({"Error": {"Code": "404", "Message": "Not Found"}}, "HeadObject")
+        return {"ContentLength": len(stored["Body"]), "Metadata": dict(stored["Metadata"])}
+
+    def put_object(self, Bucket, Key, Body, Metadata=None, **kwargs):
+        self.record("PutObject")
+        self._transfer(len(Body))
+        with self._lock:
+            self.objects[(Bucket, Key)] = {"Body": bytes(Body), "Metadata": dict(Metadata or {}),
+                                           "LastModified": time.time()}
+        return {"ETag": '"{0}"'.format(hashlib.md5(Body).hexdigest())}
+
+    def upload_file(self, Filename, Bucket, Key, ExtraArgs=None, Callback=None, Config=None):
+        # upload_file uses the default TransferConfig when none is given
+        Config = Config or TransferConfig()
+        with open(Filename, "rb") as f:
+            body = f.read()
+        if len(body) >= Config.multipart_threshold:
+            parts = -(-len(body) // Config.multipart_chunksize)
+            for _ in range(parts):
+                self.record("UploadPart")
+            self._transfer(len(body), min(parts, Config.max_concurrency))
+        else:
+            self.record("PutObject")
+            self._transfer(len(body))
+        with self._lock:
+            self.objects[(Bucket, Key)] = {"Body": body, "Metadata": dict((ExtraArgs or {}).get("Metadata", {})),
+                                           "LastModified": time.time()}
+
+
+class StubBedrockAgent(CallCounter):
+    """
+    Stand-in for the ingestion jobs of the bedrock-agent client
+    :param s3: The StubS3 holding the data source documents, used for the job statistics
+    :param job_duration: Seconds an ingestion job runs
+    :param latency: Seconds each call takes
+    :param throttle_rate: Probability in [0, 1) that a get_ingestion_job call raises ThrottlingException
+    """
+
+    def __init__(self, s3=None, job_duration=1.0, latency=0.02, throttle_rate=0.0):
+        super().__init__()
+        self.s3 = s3
+        self.job_duration = job_duration
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.jobs = {}
+        self._last_sync = {}
+        self._rng = random.Random(13)
+
+    def _documents(self, since):
+        if self.s3 is None:
+            return 0, 0
+        with self.s3._lock:
+            documents = [o for (_, key), o in self.s3.objects.items() if not key.endswith(".metadata.json")]
+        return len(documents), sum(1 for o in documents if o["LastModified"] > since)
+
+    def start_ingestion_job(self, knowledgeBaseId, dataSourceId, **kwargs):
+        self.record("StartIngestionJob")
+        time.sleep(self.latency)
+        with self._lock:
+            for job in self.jobs.values():
+                if job["dataSourceId"] == dataSourceId and time.monotonic() < job["_done_at"]:
+                    raise ClientError({"Error": {"Code": "ConflictException",
+                                                 "Message": "An ingestion job is already running"}},
+                                      "StartIngestionJob")
+            job_id = "job-{0}".format(len(self.jobs) + 1)
+            scanned, modified = self._documents(self._last_sync.get(dataSourceId, 0.0))
+            self._last_sync[dataSourceId] = time.time()
+            self.jobs[job_id] = {
+                "knowledgeBaseId": knowledgeBaseId, "dataSourceId": dataSourceId, "ingestionJobId": job_id,
+                "status": "STARTING", "_done_at": time.monotonic() + self.job_duration,
+                "statistics": {"numberOfDocumentsScanned": scanned, "numberOfModifiedDocumentsIndexed": modified},
+            }
+            return {"ingestionJob": self._public(self.jobs[job_id])}
+
+    @staticmethod
+    def _public(job):
+        return {k: v for k, v in job.items() if not k.startswith("_")}
+
+    def get_ingestion_job(self, knowledgeBaseId, dataSourceId, ingestionJobId):
+        self.record("GetIngestionJob")
+        with self._lock:
+            throttled = self._rng.random() < self.throttle_rate
+        if throttled:
+            raise throttling_error("GetIngestionJob")
+        time.sleep(self.latency)
+        with self._lock:
+            job = self.jobs[ingestionJobId]
+            job["status"] = "COMPLETE" if time.monotonic() >= job["_done_at"] else "IN_PROGRESS"
+            return {"ingestionJob": self._public(job)}
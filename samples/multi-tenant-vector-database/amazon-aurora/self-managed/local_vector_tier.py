@@ -0,0 +1,266 @@
+"""
+In-process exact-search tier for per-tenant vector retrieval.
+
+The HNSW index on self_managed.kb covers all tenants and the RLS tenant_policy
+filters its results afterwards, so for a small tenant most of the ef_search
+candidates belong to other tenants and a query can return fewer than k rows.
+This tier keeps each tenant's embeddings in a contiguous float32 matrix and
+answers queries with an exact cosine top-k in NumPy, without a round trip:
+
+    tier = LocalVectorTier(DataApiKbLoader(rdsData, cluster_arn, secret_arn_rls, db_name))
+    rows = tier.search("Tenant3", embedding, k=5)
+
+Tenants are synced incrementally: the ids of the tenant's rows are compared
+with the local ones, and only new rows are fetched. Tenants that do not fit in
+max_tenant_bytes are not cached and search returns None, so the caller falls
+back to the database. When all tenants together exceed max_total_bytes the
+least recently used tenants are evicted.
+
+Requires numpy.
+"""
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+KB_IDS_SQL = "SELECT id::text AS id FROM self_managed.kb"
+KB_ROWS_SQL = (
+    "SELECT id::text AS id, embedding::text AS embedding, chunks, metadata::text AS metadata "
+    "FROM self_managed.kb WHERE id = ANY(:ids::uuid[])"
+)
+
+
+class DataApiKbLoader:
+    """
+    Reads a tenant's rows of self_managed.kb through the RDS Data API, with the RLS context set
+    :param rds_data: The rds-data client
+    :param cluster_arn: The ARN of the Aurora cluster
+    :param secret_arn: The ARN of the secret of app_user, the user the RLS policy applies to
+    :param database: The database name
+    :param batch_size: The number of rows per call, a 1536 dimension embedding is about 20 KB of
+        text and Data API responses are limited to 1 MB
+    """
+
+    def __init__(self, rds_data, cluster_arn, secret_arn, database, batch_size=25):
+        self.rds_data = rds_data
+        self.cluster_arn = cluster_arn
+        self.secret_arn = secret_arn
+        self.database = database
+        self.batch_size = batch_size
+
+    def _query(self, tenantid, statements):
+        tr = self.rds_data.begin_transaction(
+            resourceArn=self.cluster_arn, secretArn=self.secret_arn, database=self.database)
+        try:
+            self.rds_data.execute_statement(
+                resourceArn=self.cluster_arn, secretArn=self.secret_arn, database=self.database,
+                sql="SELECT set_config('self_managed.kb.tenantid', :tenantid, true)",
+                parameters=[{"name": "tenantid", "value": {"stringValue": tenantid}}],
+                transactionId=tr["transactionId"])
+            records = []
+            for sql, parameters in statements:
+                response = self.rds_data.execute_statement(
+                    resourceArn=self.cluster_arn, secretArn=self.secret_arn, database=self.database,
+                    sql=sql, parameters=parameters, formatRecordsAs="JSON", transactionId=tr["transactionId"])
+                records.extend(json.loads(response.get("formattedRecords") or "[]"))
+        except Exception:
+            self.rds_data.rollback_transaction(
+                resourceArn=self.cluster_arn, secretArn=self.secret_arn, transactionId=tr["transactionId"])
+            raise
+        self.rds_data.commit_transaction(
+            resourceArn=self.cluster_arn, secretArn=self.secret_arn, transactionId=tr["transactionId"])
+        return records
+
+    def fetch_ids(self, tenantid):
+        return [r["id"] for r in self._query(tenantid, [(KB_IDS_SQL, [])])]
+
+    def fetch_rows(self, tenantid, ids):
+        statements = []
+        for start in range(0, len(ids), self.batch_size):
+            batch = "{" + ",".join(ids[start:start + self.batch_size]) + "}"
+            statements.append((KB_ROWS_SQL, [{"name": "ids", "value": {"stringValue": batch}}]))
+        return [
+            (r["id"], json.loads(r["embedding"]), r["chunks"], r["metadata"])
+            for r in (self._query(tenantid, statements) if statements else [])
+        ]
+
+
+class TenantMatrix:
+    """The embeddings of one tenant, normalized to unit length, in a growable float32 matrix."""
+
+    def __init__(self, dimensions):
+        self.dimensions = dimensions
+        self.matrix = np.empty((0, dimensions), dtype=np.float32)
+        self.size = 0
+        self.ids = []
+        self.rows = []
+        self.positions = {}
+        self.synced_at = 0.0
+
+    @property
+    def nbytes(self):
+        return self.matrix.nbytes
+
+    def add(self, rows):
+        if not rows:
+            return
+        vectors = np.asarray([r[1] for r in rows], dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms == 0, 1, norms)
+        needed = self.size + len(rows)
+        if needed > len(self.matrix):
+            # grow geometrically so that frequent small syncs do not copy the matrix every time
+            grown = np.empty((max(needed, len(self.matrix) * 2), self.dimensions), dtype=np.float32)
+            grown[:self.size] = self.matrix[:self.size]
+            self.matrix = grown
+        self.matrix[self.size:needed] = vectors
+        for row in rows:
+            self.positions[row[0]] = len(self.ids)
+            self.ids.append(row[0])
+            self.rows.append(row)
+        self.size = needed
+
+    def remove(self, ids):
+        if not ids:
+            return
+        keep = np.ones(self.size, dtype=bool)
+        keep[[self.positions[i] for i in ids]] = False
+        self.matrix = np.ascontiguousarray(self.matrix[:self.size][keep])
+        self.ids = [i for i, k in zip(self.ids, keep) if k]
+        self.rows = [r for r, k in zip(self.rows, keep) if k]
+        self.positions = {i: p for p, i in enumerate(self.ids)}
+        self.size = len(self.ids)
+
+    def search(self, query, k):
+        if self.size == 0:
+            return []
+        scores = self.matrix[:self.size] @ query
+        if k < self.size:
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(self.size)
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [
+            {"id": self.ids[i], "distance": float(1.0 - scores[i]), "chunks": self.rows[i][2],
+             "metadata": self.rows[i][3]}
+            for i in top
+        ]
+
+
+class LocalVectorTier:
+    """
+    Exact per-tenant cosine search over in-memory copies of the tenants' embeddings
+    :param loader: Reads a tenant's rows, e.g. a DataApiKbLoader
+    :param dimensions: The number of dimensions of the embeddings
+    :param max_total_bytes: The memory of all cached tenants, least recently used tenants are evicted above it
+    :param max_tenant_bytes: Tenants with more embedding data than this are not cached
+    :param sync_interval_sec: How long a tenant is searched before it is synced again
+    :param clock: Function returning the current time, in seconds
+    """
+
+    def __init__(self, loader, dimensions=1536, max_total_bytes=512 * 1024 * 1024,
+                 max_tenant_bytes=64 * 1024 * 1024, sync_interval_sec=60, clock=time.monotonic):
+        self.loader = loader
+        self.dimensions = dimensions
+        self.max_total_bytes = max_total_bytes
+        self.max_tenant_bytes = max_tenant_bytes
+        self.sync_interval_sec = sync_interval_sec
+        self.clock = clock
+        self.metrics = {"searches": 0, "fallbacks": 0, "syncs": 0, "rows_fetched": 0, "evictions": 0}
+        self._tenants = OrderedDict()
+        self._too_large = {}
+        self._lock = threading.RLock()
+
+    @property
+    def nbytes(self):
+        with self._lock:
+            return sum(t.nbytes for t in self._tenants.values())
+
+    def _row_bytes(self, count):
+        return count * self.dimensions * 4
+
+    def sync(self, tenantid):
+        """
+        Fetch the rows added to the tenant since the last sync and drop the deleted ones. The
+        database is read without holding the lock, so searches of other tenants are not blocked.
+        :param tenantid: The tenant
+        :return: The TenantMatrix, or None when the tenant exceeds max_tenant_bytes
+        """
+        ids = self.loader.fetch_ids(tenantid)
+        if self._row_bytes(len(ids)) > self.max_tenant_bytes:
+            with self._lock:
+                self._too_large[tenantid] = self.clock()
+            self.evict(tenantid)
+            return None
+        fetched = {}
+        while True:
+            with self._lock:
+                tenant = self._tenants.get(tenantid)
+                known = tenant.positions if tenant is not None else {}
+                missing = [i for i in ids if i not in known and i not in fetched]
+            if not missing:
+                break
+            # the tenant may be evicted while the rows are read, then the next pass reads the rest
+            for row in self.loader.fetch_rows(tenantid, missing):
+                fetched[row[0]] = row
+            with self._lock:
+                self.metrics["rows_fetched"] += len(missing)
+        with self._lock:
+            self._too_large.pop(tenantid, None)
+            tenant = self._tenants.get(tenantid)
+            if tenant is None:
+                tenant = self._tenants[tenantid] = TenantMatrix(self.dimensions)
+            current = set(ids)
+            tenant.remove([i for i in tenant.ids if i not in current])
+            # a concurrent sync of the same tenant may have added some of the rows already
+            tenant.add([fetched[i] for i in ids if i in fetched and i not in tenant.positions])
+            tenant.synced_at = self.clock()
+            self.metrics["syncs"] += 1
+            self._tenants.move_to_end(tenantid)
+            self._enforce_memory_limit()
+            return tenant
+
+    def _enforce_memory_limit(self):
+        total = sum(t.nbytes for t in self._tenants.values())
+        while total > self.max_total_bytes and len(self._tenants) > 1:
+            _, evicted = self._tenants.popitem(last=False)
+            total -= evicted.nbytes
+            self.metrics["evictions"] += 1
+
+    def evict(self, tenantid):
+        with self._lock:
+            if self._tenants.pop(tenantid, None) is not None:
+                self.metrics["evictions"] += 1
+
+    def search(self, tenantid, embedding, k=5):
+        """
+        Find the k rows of a tenant closest to the embedding by cosine distance
+        :param tenantid: The tenant
+        :param embedding: The query embedding
+        :param k: The number of rows to return
+        :return: A list of dicts with id, distance, chunks and metadata, closest first, or None
+            when the tenant is too large for the tier and the database should be queried instead
+        """
+        # a copy, the caller's embedding is still used for the database fallback and the caches
+        query = np.array(embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        with self._lock:
+            self.metrics["searches"] += 1
+            tenant = self._tenants.get(tenantid)
+            checked_at = self._too_large.get(tenantid)
+            if checked_at is not None and self.clock() - checked_at < self.sync_interval_sec:
+                self.metrics["fallbacks"] += 1
+                return None
+            stale = tenant is None or self.clock() - tenant.synced_at >= self.sync_interval_sec
+        if stale:
+            tenant = self.sync(tenantid)
+            if tenant is None:
+                with self._lock:
+                    self.metrics["fallbacks"] += 1
+                return None
+        with self._lock:
+            if self._tenants.get(tenantid) is tenant:
+                self._tenants.move_to_end(tenantid)
+            return tenant.search(query, k)
@@ -0,0 +1,296 @@
+"""
+Tenant-partitioned layout of the kb vector table.
+
+In the pooled layout of 1_build_vector_db_on_aurora.sql all tenants share one
+table and one HNSW index. In the partitioned layout kb is list-partitioned by
+tenantid, with one partition and one HNSW index per tenant, so a query for one
+tenant only scans that tenant's index (see 1_build_partitioned_vector_db_on_aurora.sql).
+
+This tool creates the partitioned table, creates a partition when a tenant is
+onboarded, and copies the rows of the pooled table in batches. Progress is
+committed with each batch in kb_migration_progress, so an interrupted
+migration continues where it stopped. Rows without a tenantid are not copied.
+
+    python partitioned_kb.py --dsn "host=<cluster endpoint> dbname=postgres user=postgres" create
+    python partitioned_kb.py --dsn ... migrate --batch-size 1000
+    python partitioned_kb.py --dsn ... onboard Tenant6
+    python partitioned_kb.py --dsn ... reconcile
+    python partitioned_kb.py --dsn ... swap
+    python partitioned_kb.py --dsn ... --target kb onboard Tenant7
+
+The batches follow a (tenantid, id) cursor, so rows inserted behind the cursor
+and rows deleted after they were copied are not picked up by migrate.
+reconcile copies the missing rows and deletes the copies of deleted rows, and
+can run while the application writes to kb. swap locks kb against writes,
+reconciles once more and renames kb to kb_pooled and kb_partitioned to kb in
+the same transaction, so the notebooks use the partitioned table without
+losing a write. After the swap, onboard new tenants with --target kb.
+For the aws_managed schema, which Bedrock writes to as bedrock_user without RLS, use
+--schema aws_managed --app-role bedrock_user --privileges ALL --no-rls.
+
+Requires psycopg 3 (`pip install "psycopg[binary]"`).
+"""
+import argparse
+import hashlib
+import re
+
+import psycopg
+from psycopg import sql
+
+PROGRESS_TABLE = "kb_migration_progress"
+PARTITION_BOUND = re.compile(r"^FOR VALUES IN \('(.*)'\)$")
+
+
+def partition_name(table, tenantid):
+    """
+    Build the partition table name of a tenant
+    :param table: The partitioned table name
+    :param tenantid: The tenant
+    :return: A valid identifier, unique for the tenant even when the tenant ID has other characters
+    """
+    readable = re.sub(r"[^a-z0-9_]", "_", tenantid.lower())
+    return "{0}_{1}_{2}".format(table, readable, hashlib.sha1(tenantid.encode("utf-8")).hexdigest()[:6])
+
+
+class PartitionedKbMigrator:
+    """
+    Creates and fills the tenant-partitioned kb table
+    :param conn: A psycopg connection of the schema owner
+    :param schema: self_managed or aws_managed
+    :param source: The pooled table
+    :param target: The partitioned table
+    :param dimensions: The number of dimensions of the embeddings
+    :param app_role: The role granted access to the partitioned table, e.g. app_user, or None
+    :param privileges: The privileges granted to app_role
+    :param rls: Create the tenant_policy of the pooled table on the partitioned table
+    """
+
+    def __init__(self, conn, schema="self_managed", source="kb", target="kb_partitioned", dimensions=1536,
+                 app_role="app_user", privileges="SELECT", rls=True):
+        self.conn = conn
+        self.schema = schema
+        self.source = source
+        self.target = target
+        self.dimensions = dimensions
+        self.app_role = app_role
+        self.privileges = privileges
+        self.rls = rls
+
+    def _table(self, name):
+        return sql.Identifier(self.schema, name)
+
+    def _execute(self, query, params=None):
+        return self.conn.execute(query, params)
+
+    def create_partitioned_table(self):
+        """Create the partitioned table, its RLS policy, the grant and the migration progress table."""
+        with self.conn.transaction():
+            self._execute(sql.SQL(
+                "CREATE TABLE IF NOT EXISTS {0} (id uuid, embedding vector({1}), chunks text, metadata json, "
+                "tenantid varchar(10) NOT NULL, PRIMARY KEY (tenantid, id)) PARTITION BY LIST (tenantid)"
+            ).format(self._table(self.target), sql.Literal(self.dimensions)))
+            if self.rls:
+                # the policy on the parent applies to every partition queried through it
+                self._execute(sql.SQL(
+                    "DROP POLICY IF EXISTS tenant_policy ON {0}; "
+                    "CREATE POLICY tenant_policy ON {0} "
+                    "USING (tenantid = current_setting({1})::varchar); "
+                    "ALTER TABLE {0} ENABLE ROW LEVEL SECURITY"
+                ).format(self._table(self.target), sql.Literal("{0}.kb.tenantid".format(self.schema))))
+            if self.app_role:
+                self._execute(sql.SQL("GRANT {0} ON TABLE {1} TO {2}").format(
+                    sql.SQL(self.privileges), self._table(self.target), sql.Identifier(self.app_role)))
+            self._execute(sql.SQL(
+                "CREATE TABLE IF NOT EXISTS {0} (source text PRIMARY KEY, last_tenantid varchar(10), "
+                "last_id uuid, rows_copied bigint NOT NULL DEFAULT 0)"
+            ).format(self._table(PROGRESS_TABLE)))
+
+    def onboard_tenant(self, tenantid, create_index=True):
+        """
+        Create the partition of a tenant, with its HNSW index
+        :param tenantid: The tenant
+        :param create_index: False to create the index later with create_indexes, which is faster
+            than maintaining it while rows are copied
+        :return: The partition name
+        """
+        name = self.partitions().get(tenantid) or partition_name(self.target, tenantid)
+        with self.conn.transaction():
+            self._execute(sql.SQL("CREATE TABLE IF NOT EXISTS {0} PARTITION OF {1} FOR VALUES IN ({2})").format(
+                self._table(name), self._table(self.target), sql.Literal(tenantid)))
+            if create_index:
+                self._create_index(name)
+        return name
+
+    def _create_index(self, name):
+        self._execute(sql.SQL("CREATE INDEX IF NOT EXISTS {0} ON {1} USING hnsw (embedding vector_cosine_ops)").format(
+            sql.Identifier(name + "_embedding_idx"), self._table(name)))
+
+    def partitions(self):
+        """
+        List the partitions of the partitioned table
+        :return: A dict of tenant IDs and partition names
+        """
+        rows = self._execute(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+            "JOIN pg_namespace n ON n.oid = p.relnamespace WHERE n.nspname = %s AND p.relname = %s",
+            (self.schema, self.target)).fetchall()
+        partitions = {}
+        for name, bound in rows:
+            match = PARTITION_BOUND.match(bound)
+            if match:
+                partitions[match.group(1).replace("''", "'")] = name
+        return partitions
+
+    def create_indexes(self):
+        """Create the HNSW index of every partition that does not have one yet."""
+        for name in self.partitions().values():
+            with self.conn.transaction():
+                self._create_index(name)
+
+    def _progress(self):
+        row = self._execute(sql.SQL(
+            "SELECT last_tenantid, last_id::text, rows_copied FROM {0} WHERE source = %s FOR UPDATE"
+        ).format(self._table(PROGRESS_TABLE)), (self.source,)).fetchone()
+        return row or (None, None, 0)
+
+    def migrate_batch(self, batch_size=1000):
+        """
+        Copy the next batch of rows, in (tenantid, id) order, creating missing partitions
+        :param batch_size: The number of rows to copy
+        :return: The number of rows copied, 0 when the migration is complete
+        """
+        source, target = self._table(self.source), self._table(self.target)
+        with self.conn.transaction():
+            last_tenantid, last_id, rows_copied = self._progress()
+            after = sql.SQL("(tenantid, id) > (%(tenantid)s, %(id)s::uuid)") if last_tenantid else sql.SQL("true")
+            params = {"tenantid": last_tenantid, "id": last_id, "limit": batch_size}
+            keys = self._execute(sql.SQL(
+                "SELECT tenantid, id::text FROM {0} WHERE tenantid IS NOT NULL AND {1} ORDER BY tenantid, id LIMIT %(limit)s"
+            ).format(source, after), params).fetchall()
+            if not keys:
+                return 0
+            existing = self.partitions()
+            for tenantid in sorted({k[0] for k in keys}):
+                if tenantid not in existing:
+                    self.onboard_tenant(tenantid, create_index=False)
+            params.update(end_tenantid=keys[-1][0], end_id=keys[-1][1])
+            self._execute(sql.SQL(
+                "INSERT INTO {0} (id, embedding, chunks, metadata, tenantid) "
+                "SELECT id, embedding, chunks, metadata, tenantid FROM {1} "
+                "WHERE tenantid IS NOT NULL AND {2} AND (tenantid, id) <= (%(end_tenantid)s, %(end_id)s::uuid) "
+                "ON CONFLICT DO NOTHING"
+            ).format(target, source, after), params)
+            self._execute(sql.SQL(
+                "INSERT INTO {0} (source, last_tenantid, last_id, rows_copied) VALUES (%s, %s, %s::uuid, %s) "
+                "ON CONFLICT (source) DO UPDATE SET last_tenantid = excluded.last_tenantid, "
+                "last_id = excluded.last_id, rows_copied = excluded.rows_copied"
+            ).format(self._table(PROGRESS_TABLE)), (self.source, keys[-1][0], keys[-1][1], rows_copied + len(keys)))
+        return len(keys)
+
+    def migrate(self, batch_size=1000, max_batches=None, create_indexes=True):
+        """
+        Copy the rows of the pooled table, continuing from the last committed batch
+        :param batch_size: The number of rows per batch
+        :param max_batches: Stop after this many batches, None to copy all rows
+        :param create_indexes: Create the missing partition indexes once all rows are copied
+        :return: The number of rows copied by this call
+        """
+        # every batch seeks to the last copied key instead of sorting the pooled table again
+        self._execute(sql.SQL("CREATE INDEX IF NOT EXISTS {0} ON {1} (tenantid, id)").format(
+            sql.Identifier(self.source + "_tenantid_id_idx"), self._table(self.source)))
+        copied = batches = 0
+        while max_batches is None or batches < max_batches:
+            count = self.migrate_batch(batch_size)
+            if count == 0:
+                if create_indexes:
+                    self.create_indexes()
+                self._execute(sql.SQL("ANALYZE {0}").format(self._table(self.target)))
+                break
+            copied += count
+            batches += 1
+        return copied
+
+    def _reconcile(self):
+        source, target = self._table(self.source), self._table(self.target)
+        existing = self.partitions()
+        tenants = self._execute(sql.SQL("SELECT DISTINCT tenantid FROM {0} WHERE tenantid IS NOT NULL").format(
+            source)).fetchall()
+        for (tenantid,) in tenants:
+            if tenantid not in existing:
+                self.onboard_tenant(tenantid)
+        inserted = self._execute(sql.SQL(
+            "INSERT INTO {0} (id, embedding, chunks, metadata, tenantid) "
+            "SELECT s.id, s.embedding, s.chunks, s.metadata, s.tenantid FROM {1} s WHERE s.tenantid IS NOT NULL "
+            "AND NOT EXISTS (SELECT 1 FROM {0} t WHERE t.tenantid = s.tenantid AND t.id = s.id) "
+            "ON CONFLICT DO NOTHING"
+        ).format(target, source)).rowcount
+        deleted = self._execute(sql.SQL(
+            "DELETE FROM {0} t WHERE NOT EXISTS (SELECT 1 FROM {1} s WHERE s.tenantid = t.tenantid AND s.id = t.id)"
+        ).format(target, source)).rowcount
+        return inserted, deleted
+
+    def reconcile(self):
+        """
+        Copy the rows the migration batches missed and delete the copies of rows deleted from the pooled table
+        :return: The number of rows inserted and deleted
+        """
+        with self.conn.transaction():
+            return self._reconcile()
+
+    def swap(self, pooled_name="kb_pooled"):
+        """
+        Rename the pooled table to pooled_name and the partitioned table to the pooled table name. Writes to
+        the pooled table wait for the swap, which reconciles both tables first.
+        :param pooled_name: The new name of the pooled table
+        :return: The number of rows inserted and deleted by the reconciliation
+        """
+        with self.conn.transaction():
+            # EXCLUSIVE blocks inserts and deletes but not queries, the renames block queries only briefly
+            self._execute(sql.SQL("LOCK TABLE {0} IN EXCLUSIVE MODE").format(self._table(self.source)))
+            reconciled = self._reconcile()
+            self._execute(sql.SQL("ALTER TABLE {0} RENAME TO {1}").format(
+                self._table(self.source), sql.Identifier(pooled_name)))
+            self._execute(sql.SQL("ALTER TABLE {0} RENAME TO {1}").format(
+                self._table(self.target), sql.Identifier(self.source)))
+        return reconciled
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", required=True, help="libpq connection string of the schema owner")
+    parser.add_argument("--schema", default="self_managed")
+    parser.add_argument("--target", default="kb_partitioned", help="the partitioned table")
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--app-role", default="app_user", help="role granted access, empty for none")
+    parser.add_argument("--privileges", default="SELECT", choices=["SELECT", "ALL"])
+    parser.add_argument("--no-rls", action="store_true", help="do not create the tenant_policy")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("create", help="create the partitioned table")
+    onboard = commands.add_parser("onboard", help="create the partition of a new tenant")
+    onboard.add_argument("tenantid")
+    migrate = commands.add_parser("migrate", help="copy the rows of the pooled table")
+    migrate.add_argument("--batch-size", type=int, default=1000)
+    migrate.add_argument("--max-batches", type=int)
+    commands.add_parser("reconcile", help="copy missed rows and delete the copies of deleted rows")
+    commands.add_parser("swap", help="reconcile and use the partitioned table as kb")
+    args = parser.parse_args()
+
+    with psycopg.connect(args.dsn, autocommit=True) as conn:
+        migrator = PartitionedKbMigrator(conn, schema=args.schema, target=args.target, dimensions=args.dimensions,
+                                         app_role=args.app_role or None, privileges=args.privileges,
+                                         rls=not args.no_rls)
+        if args.command == "create":
+            migrator.create_partitioned_table()
+        elif args.command == "onboard":
+            print(migrator.onboard_tenant(args.tenantid))
+        elif args.command == "migrate":
+            migrator.create_partitioned_table()
+            print("{0} rows copied".format(migrator.migrate(args.batch_size, args.max_batches)))
+        elif args.command == "reconcile":
+            print("{0} rows inserted, {1} rows deleted".format(*migrator.reconcile()))
+        elif args.command == "swap":
+            print("{0} rows inserted, {1} rows deleted".format(*migrator.swap()))
+
+
+if __name__ == "__main__":
+    main()
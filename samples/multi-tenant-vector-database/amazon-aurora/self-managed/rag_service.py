@@ -0,0 +1,400 @@
+"""
+Asynchronous RAG query path for batches of tenant questions.
+
+The notebooks answer a question serially: embed it, query the vector store,
+put every retrieved record in the prompt and wait on invoke_model until the
+whole completion is generated. RagService answers many questions at once on
+an asyncio event loop:
+
+* the blocking boto3 calls run on a thread pool, so the embedding of one
+  question overlaps the retrieval and generation of others
+* at most max_concurrency questions are in flight, and at most
+  max_concurrency_per_tenant of them for the same tenant, so one busy tenant
+  cannot take all the Bedrock and Data API capacity
+* the completion is streamed with invoke_model_with_response_stream, so the
+  first tokens are available long before the completion is done
+* the retrieved passages are put in the prompt in ranking order until
+  context_token_budget is used, instead of the raw Data API records
+* with a SemanticRetrievalCache, a tenant's repeated or near-duplicate
+  questions are answered from the cache without retrieval or generation
+
+Usage from the self-managed notebook:
+
+    retriever = VectorDbRetriever(generate_vector_embeddings, query_vector_database_using_rls)
+    rag_service = RagService(retriever, bedrock_runtime)
+    results = await rag_service.answer_many([("Tenant3", question), ("Tenant2", question)])
+
+and from the aws-managed notebook, where the knowledge base embeds the question:
+
+    retriever = KnowledgeBaseRetriever(bedrock_agent_runtime, kb_id)
+"""
+import asyncio
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from ingestion_pipeline import is_throttling_error
+
+LLM_MODEL_ID = "anthropic.claude-v2"
+
+PROMPT_TEMPLATE = """
+Human: Use the following pieces of context to provide a concise answer to the question at the end. If you don't know the answer, just say that you don't know, don't try to make up an answer.
+<context>
+{context}
+</context>
+Question: {question}
+Assistant:
+"""
+
+_END_OF_STREAM = object()
+
+
+def estimate_tokens(text):
+    """
+    Estimate the number of tokens of a text, about 4 characters per token for English text
+    :param text: The text
+    :return: The estimated token count
+    """
+    return (len(text) + 3) // 4
+
+
+def passages_from_response(response):
+    """
+    Convert the result of a vector store query to passages
+    :param response: A Data API response of the notebook's queries, whose last column is chunks, or the
+        list of dicts returned by LocalVectorTier.search
+    :return: A list of dicts with text, score and source, best match first
+    """
+    if isinstance(response, list):
+        return [{"text": row["chunks"], "score": 1.0 - row["distance"], "source": row.get("metadata")}
+                for row in response]
+    passages = []
+    for record in response.get("records", []):
+        metadata = record[-2].get("stringValue") if len(record) > 1 else None
+        passages.append({"text": record[-1].get("stringValue", ""), "score": None, "source": metadata})
+    return passages
+
+
+def build_context(passages, token_budget, count_tokens=estimate_tokens, min_passage_tokens=50):
+    """
+    Select the passages that fit in the prompt
+    :param passages: Passages, best match first
+    :param token_budget: The number of tokens the context may use
+    :param count_tokens: Function returning the token count of a text
+    :param min_passage_tokens: A passage that does not fit is truncated if at least this many tokens are left
+    :return: The context text, the passages used and the number of tokens used
+    """
+    parts, used, seen, tokens = [], [], set(), 0
+    for passage in passages:
+        text = passage["text"].strip()
+        if not text or text in seen:
+            continue
+        seen.add(text)
+        remaining = token_budget - tokens
+        size = count_tokens(text)
+        if size > remaining:
+            if remaining < min_passage_tokens:
+                break
+            cut = len(text) * remaining // size
+            while cut > 0 and count_tokens(text[:cut]) > remaining:
+                cut = cut * 9 // 10
+            text, size = text[:cut], count_tokens(text[:cut])
+        parts.append(text)
+        used.append(passage)
+        tokens += size
+        if tokens >= token_budget:
+            break
+    return "\n\n".join(parts), used, tokens
+
+
+class VectorDbRetriever:
+    """
+    Retrieves a tenant's passages from self_managed.kb
+    :param embed: Function returning the embedding of a text, e.g. generate_vector_embeddings
+    :param search: Function of an embedding and a tenant ID returning a Data API response,
+        e.g. query_vector_database_using_rls
+    :param local_tier: A LocalVectorTier searched first, search is used when it returns None
+    :param k: The number of passages retrieved from the local tier
+    """
+
+    def __init__(self, embed, search, local_tier=None, k=5):
+        self._embed = embed
+        self._search = search
+        self.local_tier = local_tier
+        self.k = k
+
+    def embed(self, question):
+        return self._embed(question)
+
+    def retrieve(self, tenantid, question, embedding):
+        if self.local_tier is not None:
+            rows = self.local_tier.search(tenantid, embedding, k=self.k)
+            if rows is not None:
+                return passages_from_response(rows)
+        return passages_from_response(self._search(embedding, tenantid))
+
+
+class KnowledgeBaseRetriever:
+    """
+    Retrieves a tenant's passages through the Bedrock Knowledge Base retrieve API, filtered on the tenant metadata
+    :param bedrock_agent_runtime: The bedrock-agent-runtime client
+    :param knowledge_base_id: The knowledge base ID
+    :param number_of_results: The number of passages retrieved
+    :param tenant_key: The metadata attribute holding the tenant ID
+    :param embed: Function returning the embedding of a text, only used for near-duplicate lookups in a
+        SemanticRetrievalCache, the knowledge base embeds the question itself
+    """
+
+    def __init__(self, bedrock_agent_runtime, knowledge_base_id, number_of_results=5, tenant_key="tenantId",
+                 embed=None):
+        self.bedrock_agent_runtime = bedrock_agent_runtime
+        self.knowledge_base_id = knowledge_base_id
+        self.number_of_results = number_of_results
+        self.tenant_key = tenant_key
+        self._embed = embed
+
+    def embed(self, question):
+        return self._embed(question) if self._embed is not None else None
+
+    def retrieve(self, tenantid, question, embedding):
+        response = self.bedrock_agent_runtime.retrieve(
+            retrievalQuery={"text": question},
+            knowledgeBaseId=self.knowledge_base_id,
+            retrievalConfiguration={
+                "vectorSearchConfiguration": {
+                    "numberOfResults": self.number_of_results,
+                    "filter": {"equals": {"key": self.tenant_key, "value": tenantid}},
+                }
+            },
+        )
+        return [
+            {"text": result["content"]["text"], "score": result.get("score"),
+             "source": result.get("location", {}).get("s3Location", {}).get("uri")}
+            for result in response["retrievalResults"]
+        ]
+
+
+class RagResult:
+    """The answer to one question, with the passages used and the latency of each step, in seconds."""
+
+    def __init__(self, tenantid, question):
+        self.tenantid = tenantid
+        self.question = question
+        self.answer = ""
+        self.passages = []
+        self.context_tokens = 0
+        self.error = None
+        self.cached = False
+        self.queued = 0.0
+        self.embed = 0.0
+        self.retrieve = 0.0
+        self.first_token = None
+        self.total = 0.0
+
+    def to_dict(self):
+        return {
+            "tenantid": self.tenantid,
+            "question": self.question,
+            "answer": self.answer,
+            "sources": [p.get("source") for p in self.passages],
+            "context_tokens": self.context_tokens,
+            "error": repr(self.error) if self.error else None,
+            "cached": self.cached,
+            "queued": round(self.queued, 3),
+            "embed": round(self.embed, 3),
+            "retrieve": round(self.retrieve, 3),
+            "first_token": round(self.first_token, 3) if self.first_token is not None else None,
+            "total": round(self.total, 3),
+        }
+
+    def __repr__(self):
+        return "RagResult(tenantid={0!r}, context_tokens={1}, cached={2}, first_token={3}, total={4:.2f}s, answer={5!r})".format(
+            self.tenantid, self.context_tokens, self.cached,
+            "{0:.2f}s".format(self.first_token) if self.first_token is not None else None, self.total,
+            self.error or self.answer)
+
+
+class RagService:
+    """
+    Answers tenant questions concurrently with retrieval augmented generation
+    :param retriever: A VectorDbRetriever or KnowledgeBaseRetriever
+    :param bedrock_runtime: The bedrock-runtime client used to generate the answers
+    :param model_id: The Bedrock text generation model, called with the Anthropic text completions format
+    :param max_tokens_to_sample: The maximum number of tokens of an answer
+    :param context_token_budget: The maximum number of tokens of retrieved context in a prompt
+    :param max_concurrency: The number of questions answered at the same time
+    :param max_concurrency_per_tenant: The number of questions of one tenant answered at the same time
+    :param count_tokens: Function returning the token count of a text
+    :param max_retries: The number of retries of a throttled call before giving up
+    :param base_delay: The initial backoff delay, in seconds, after a throttled call
+    :param max_delay: The upper bound of the backoff delay, in seconds
+    :param retrieval_cache: A SemanticRetrievalCache of the passages and answers of each tenant's questions
+    """
+
+    def __init__(self, retriever, bedrock_runtime, model_id=LLM_MODEL_ID, max_tokens_to_sample=300,
+                 context_token_budget=2000, max_concurrency=16, max_concurrency_per_tenant=4,
+                 count_tokens=estimate_tokens, max_retries=5, base_delay=0.2, max_delay=5.0, retrieval_cache=None):
+        self.retriever = retriever
+        self.bedrock_runtime = bedrock_runtime
+        self.model_id = model_id
+        self.max_tokens_to_sample = max_tokens_to_sample
+        self.context_token_budget = context_token_budget
+        self.max_concurrency = max_concurrency
+        self.max_concurrency_per_tenant = max_concurrency_per_tenant
+        self.count_tokens = count_tokens
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retrieval_cache = retrieval_cache
+        # a streamed completion holds its thread until the last token, so every question in flight needs one
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency + 4, thread_name_prefix="rag")
+        self._loop = None
+        self._semaphore = None
+        self._tenant_semaphores = {}
+
+    def _semaphores(self, tenantid):
+        # asyncio primitives belong to one event loop, recreate them when the service is used from another
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._tenant_semaphores = {}
+        if tenantid not in self._tenant_semaphores:
+            self._tenant_semaphores[tenantid] = asyncio.Semaphore(self.max_concurrency_per_tenant)
+        return self._tenant_semaphores[tenantid], self._semaphore
+
+    def _call_with_backoff(self, fn, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return fn(**kwargs)
+            except ClientError as err:
+                if not is_throttling_error(err) or attempt >= self.max_retries:
+                    raise
+                delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+                time.sleep(random.uniform(delay / 2, delay))
+                attempt += 1
+
+    def _run(self, fn, *args):
+        return asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def build_prompt(self, question, passages):
+        """
+        Build the prompt of a question from the passages that fit in context_token_budget
+        :param question: The question
+        :param passages: The retrieved passages, best match first
+        :return: The prompt, the passages used and the number of context tokens
+        """
+        context, used, tokens = build_context(passages, self.context_token_budget, self.count_tokens)
+        return PROMPT_TEMPLATE.format(context=context, question=question), used, tokens
+
+    def _request_body(self, prompt):
+        return json.dumps({"prompt": prompt, "max_tokens_to_sample": self.max_tokens_to_sample})
+
+    def _stream_completion(self, prompt, push):
+        try:
+            response = self._call_with_backoff(
+                self.bedrock_runtime.invoke_model_with_response_stream,
+                body=self._request_body(prompt),
+                modelId=self.model_id,
+                accept="application/json",
+                contentType="application/json",
+            )
+            for event in response["body"]:
+                chunk = event.get("chunk")
+                if chunk:
+                    text = json.loads(chunk["bytes"]).get("completion")
+                    if text:
+                        push(text)
+        except Exception as err:
+            push(err)
+        push(_END_OF_STREAM)
+
+    async def stream(self, prompt):
+        """
+        Stream the completion of a prompt
+        :param prompt: The prompt
+        :return: An async generator of completion text fragments
+        """
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+
+        def push(item):
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+
+        producer = self._run(self._stream_completion, prompt, push)
+        try:
+            while True:
+                item = await queue.get()
+                if item is _END_OF_STREAM:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            await producer
+
+    async def answer(self, tenantid, question, on_token=None):
+        """
+        Answer one question of a tenant
+        :param tenantid: The tenant
+        :param question: The question
+        :param on_token: Function called with the tenant ID and each streamed text fragment
+        :return: The RagResult, whose error is set when a step failed
+        """
+        result = RagResult(tenantid, question)
+        start = time.perf_counter()
+        tenant_semaphore, semaphore = self._semaphores(tenantid)
+        try:
+            # wait for the tenant's own limit first, so a busy tenant does not hold shared slots while it waits
+            async with tenant_semaphore, semaphore:
+                result.queued = time.perf_counter() - start
+                cache = self.retrieval_cache
+                version = cache.version(tenantid) if cache is not None else None
+                step = time.perf_counter()
+                embedding = await self._run(self.retriever.embed, question)
+                result.embed = time.perf_counter() - step
+                cached = cache.get(tenantid, question, embedding) if cache is not None else None
+                if cached is not None:
+                    result.cached = True
+                    result.answer, result.passages, result.context_tokens = (
+                        cached["answer"], cached["passages"], cached["context_tokens"])
+                    result.first_token = time.perf_counter() - start
+                    if on_token is not None:
+                        on_token(tenantid, result.answer)
+                    result.total = result.first_token
+                    return result
+                step = time.perf_counter()
+                passages = await self._run(self.retriever.retrieve, tenantid, question, embedding)
+                result.retrieve = time.perf_counter() - step
+                prompt, result.passages, result.context_tokens = self.build_prompt(question, passages)
+                fragments = []
+                async for text in self.stream(prompt):
+                    if result.first_token is None:
+                        result.first_token = time.perf_counter() - start
+                    fragments.append(text)
+                    if on_token is not None:
+                        on_token(tenantid, text)
+                result.answer = "".join(fragments)
+                if cache is not None:
+                    cache.put(tenantid, question, {"answer": result.answer, "passages": result.passages,
+                                                   "context_tokens": result.context_tokens}, embedding, version=version)
+        except Exception as err:
+            result.error = err
+        result.total = time.perf_counter() - start
+        return result
+
+    async def answer_many(self, questions, on_token=None):
+        """
+        Answer a batch of questions concurrently
+        :param questions: An iterable of (tenant ID, question) pairs
+        :param on_token: Function called with the tenant ID and each streamed text fragment
+        :return: The RagResults, in the order of the questions
+        """
+        return await asyncio.gather(*(self.answer(tenantid, question, on_token) for tenantid, question in questions))
+
+    def close(self):
+        self._executor.shutdown(wait=False)
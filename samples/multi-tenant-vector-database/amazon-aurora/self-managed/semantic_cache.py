@@ -0,0 +1,252 @@
+"""
+Tenant-scoped semantic cache of retrieval results and answers.
+
+Tenants ask the same questions over documents that rarely change, and every
+repeat costs an embedding, a vector search or knowledge base retrieve, and an
+LLM call. SemanticRetrievalCache keeps the results per tenant and finds them
+by:
+
+* exact match - the same normalized question
+* near-duplicate - a cached question whose embedding has a cosine similarity
+  of at least similarity_threshold with the new one
+
+Every tenant has its own entries, TTL and size limit, and a lookup only ever
+searches the entries of the tenant it is made for. Each tenant also has a
+version that invalidate bumps when its documents are ingested, e.g. from
+DocumentSync(..., on_change=...) or KnowledgeBaseIngestion(..., on_ingested=...).
+Entries of older versions are dropped, and a result computed while an
+ingestion ran is not stored when put is given the version read before it:
+
+    version = retrieval_cache.version("Tenant3")
+    cached = retrieval_cache.get("Tenant3", question, embedding)
+    if cached is None:
+        ...
+        retrieval_cache.put("Tenant3", question, result, embedding, version=version)
+
+Requires numpy.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from embedding_cache import normalize_text
+
+
+class SemanticCacheStats:
+    """Hit and miss counters of a tenant, or of all tenants."""
+
+    def __init__(self):
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale_puts = 0
+
+    @property
+    def lookups(self):
+        return self.exact_hits + self.similar_hits + self.misses
+
+    @property
+    def hit_rate(self):
+        return (self.exact_hits + self.similar_hits) / float(self.lookups) if self.lookups else 0.0
+
+    def add(self, other):
+        for name, value in vars(other).items():
+            setattr(self, name, getattr(self, name) + value)
+
+    def to_dict(self):
+        return dict(vars(self), hit_rate=round(self.hit_rate, 3))
+
+    def __repr__(self):
+        return ("SemanticCacheStats(exact_hits={0}, similar_hits={1}, misses={2}, hit_rate={3:.2f}, expirations={4}, "
+                "evictions={5}, invalidations={6})").format(
+            self.exact_hits, self.similar_hits, self.misses, self.hit_rate, self.expirations, self.evictions,
+            self.invalidations)
+
+
+class _Entry:
+    __slots__ = ("key", "embedding", "value", "expires_at")
+
+    def __init__(self, key, embedding, value, expires_at):
+        self.key = key
+        self.embedding = embedding
+        self.value = value
+        self.expires_at = expires_at
+
+
+class _TenantCache:
+    def __init__(self):
+        self.version = 0
+        self.entries = OrderedDict()
+        self.stats = SemanticCacheStats()
+        self._matrix = None
+
+    def clear(self):
+        self.entries.clear()
+        self._matrix = None
+
+    def remove(self, key):
+        del self.entries[key]
+        self._matrix = None
+
+    def matrix(self):
+        # rebuilt lazily, a tenant's cache changes far less often than it is searched
+        if self._matrix is None:
+            keyed = [(key, entry.embedding) for key, entry in self.entries.items() if entry.embedding is not None]
+            if keyed:
+                self._matrix = ([key for key, _ in keyed], np.stack([embedding for _, embedding in keyed]))
+            else:
+                self._matrix = ([], None)
+        return self._matrix
+
+
+class SemanticRetrievalCache:
+    """
+    Per-tenant cache of retrieval results with exact and near-duplicate question lookup
+    :param similarity_threshold: The minimum cosine similarity of a near-duplicate question, None to only
+        match exactly
+    :param ttl_sec: How long an entry is served
+    :param max_entries_per_tenant: The number of entries of a tenant, least recently used ones are evicted above it
+    :param tenant_limits: A dict of tenant IDs and dicts overriding ttl_sec and max_entries_per_tenant,
+        e.g. {"Tenant1": {"ttl_sec": 300}}
+    :param clock: Function returning the current time, in seconds
+    """
+
+    def __init__(self, similarity_threshold=0.95, ttl_sec=3600, max_entries_per_tenant=1000, tenant_limits=None,
+                 clock=time.monotonic):
+        self.similarity_threshold = similarity_threshold
+        self.ttl_sec = ttl_sec
+        self.max_entries_per_tenant = max_entries_per_tenant
+        self.tenant_limits = dict(tenant_limits or {})
+        self.clock = clock
+        self._tenants = {}
+        self._lock = threading.Lock()
+
+    def _limit(self, tenantid, name):
+        return self.tenant_limits.get(tenantid, {}).get(name, getattr(self, name))
+
+    def _tenant(self, tenantid):
+        tenant = self._tenants.get(tenantid)
+        if tenant is None:
+            tenant = self._tenants[tenantid] = _TenantCache()
+        return tenant
+
+    @staticmethod
+    def _key(question):
+        return hashlib.sha256(normalize_text(question).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def _normalize(embedding):
+        if embedding is None:
+            return None
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def version(self, tenantid):
+        """The current version of a tenant's documents, pass it to put."""
+        with self._lock:
+            return self._tenant(tenantid).version
+
+    def get(self, tenantid, question, embedding=None):
+        """
+        Look up the cached result of a question of a tenant
+        :param tenantid: The tenant
+        :param question: The question
+        :param embedding: The question embedding, None to only match the question exactly
+        :return: The cached value, or None
+        """
+        key = self._key(question)
+        query = self._normalize(embedding)
+        now = self.clock()
+        with self._lock:
+            tenant = self._tenant(tenantid)
+            entry = tenant.entries.get(key)
+            if entry is not None and entry.expires_at <= now:
+                tenant.remove(key)
+                tenant.stats.expirations += 1
+                entry = None
+            if entry is not None:
+                tenant.entries.move_to_end(key)
+                tenant.stats.exact_hits += 1
+                return entry.value
+            if query is not None and self.similarity_threshold is not None:
+                keys, matrix = tenant.matrix()
+                if matrix is not None:
+                    scores = matrix @ query
+                    for i in np.argsort(-scores):
+                        if scores[i] < self.similarity_threshold:
+                            break
+                        entry = tenant.entries[keys[i]]
+                        if entry.expires_at > now:
+                            tenant.entries.move_to_end(keys[i])
+                            tenant.stats.similar_hits += 1
+                            return entry.value
+            tenant.stats.misses += 1
+            return None
+
+    def put(self, tenantid, question, value, embedding=None, version=None):
+        """
+        Cache the result of a question of a tenant
+        :param tenantid: The tenant
+        :param question: The question
+        :param value: The result, e.g. the retrieved passages and the answer
+        :param embedding: The question embedding, needed for near-duplicate lookups
+        :param version: The tenant version read before the result was computed, the value is not cached
+            when the tenant was invalidated since
+        :return: True when the value was cached
+        """
+        key = self._key(question)
+        normalized = self._normalize(embedding)
+        with self._lock:
+            tenant = self._tenant(tenantid)
+            if version is not None and version != tenant.version:
+                tenant.stats.stale_puts += 1
+                return False
+            if key in tenant.entries:
+                tenant.remove(key)
+            tenant.entries[key] = _Entry(key, normalized, value, self.clock() + self._limit(tenantid, "ttl_sec"))
+            tenant._matrix = None
+            max_entries = self._limit(tenantid, "max_entries_per_tenant")
+            while len(tenant.entries) > max_entries:
+                tenant.entries.popitem(last=False)
+                tenant.stats.evictions += 1
+            return True
+
+    def invalidate(self, tenantid):
+        """
+        Drop the entries of a tenant and bump its version, call it when the tenant's documents change
+        :param tenantid: The tenant
+        :return: The new version
+        """
+        with self._lock:
+            tenant = self._tenant(tenantid)
+            tenant.version += 1
+            tenant.clear()
+            tenant.stats.invalidations += 1
+            return tenant.version
+
+    def stats(self, tenantid=None):
+        """
+        The hit and miss counters
+        :param tenantid: A tenant, None for the totals of all tenants
+        :return: A SemanticCacheStats
+        """
+        with self._lock:
+            if tenantid is not None:
+                total = SemanticCacheStats()
+                if tenantid in self._tenants:
+                    total.add(self._tenants[tenantid].stats)
+                return total
+            total = SemanticCacheStats()
+            for tenant in self._tenants.values():
+                total.add(tenant.stats)
+            return total
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(tenant.entries) for tenant in self._tenants.values())
@@ -0,0 +1,108 @@
+"""
+Compare the transaction, function and inline RLS strategies of TenantScopedExecutor.
+
+Runs against a local PostgreSQL through LocalDataApi, which adds a simulated
+Data API round trip to every call. The schema of the samples is created in the
+target database, and every query is checked to only return its tenant's rows:
+
+    python benchmark_rls_strategies.py --dsn postgresql://postgres@localhost/postgres --round-trip-ms 20
+"""
+import argparse
+import statistics
+import time
+
+import psycopg
+
+from local_data_api import LocalDataApi
+from tenant_scoped_executor import TENANT_ROWS_FUNCTION_SQL, TenantScopedExecutor
+
+SETUP_SQL = """
+DROP TABLE IF EXISTS tenant CASCADE;
+CREATE TABLE tenant ( tenant_id integer PRIMARY KEY, tenant_name text, account_balance numeric );
+INSERT INTO tenant SELECT i, 'Tenant' || i, 1000 * i FROM generate_series(1, {tenants}) AS i;
+CREATE POLICY tenant_policy ON tenant USING (tenant_id = current_setting('tenant.id')::integer);
+ALTER TABLE tenant enable row level security;
+DO $$ BEGIN
+   IF NOT EXISTS (SELECT FROM pg_roles WHERE rolname = 'app_user') THEN CREATE ROLE app_user; END IF;
+END $$;
+GRANT SELECT ON tenant TO app_user;
+
+CREATE OR REPLACE FUNCTION get_tenant_data(p_tenant_id integer)
+  RETURNS SETOF text AS
+$func$
+BEGIN
+   EXECUTE format('SET "tenant.id" = %s', p_tenant_id);
+   RETURN QUERY
+   SELECT tenant_name
+   FROM tenant;
+END
+$func$  LANGUAGE plpgsql;
+"""
+
+QUERIES = {
+    'transaction': ('select tenant_name from tenant', lambda tenant_id: None),
+    'function': ('select get_tenant_data(:tenant_id::integer) as tenant_name', lambda tenant_id: None),
+    'inline': ('select tenant_name from tenant', lambda tenant_id: None),
+}
+
+
+def setup(dsn, tenants):
+    with psycopg.connect(dsn, autocommit=True) as conn:
+        conn.execute(SETUP_SQL.format(tenants=tenants))
+        conn.execute(TENANT_ROWS_FUNCTION_SQL)
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
+
+
+def run_strategy(executor, data_api, strategy, tenants, iterations):
+    sql, params = QUERIES[strategy]
+    data_api.reset_calls()
+    latencies = []
+    for i in range(iterations):
+        tenant_id = i % tenants + 1
+        start = time.perf_counter()
+        rows = executor.execute(tenant_id, sql, params(tenant_id), strategy=strategy)
+        latencies.append((time.perf_counter() - start) * 1000)
+        assert rows == [{'tenant_name': 'Tenant{0}'.format(tenant_id)}], rows
+    return latencies, data_api.total_calls / float(iterations)
+
+
+def run_grouped(executor, data_api, tenants, iterations):
+    # One transaction for a batch of tenant queries, the context is set once per tenant.
+    data_api.reset_calls()
+    start = time.perf_counter()
+    with executor.transaction() as tx:
+        for i in range(iterations):
+            tenant_id = i % tenants + 1
+            rows = tx.execute(tenant_id, 'select tenant_name from tenant')
+            assert rows == [{'tenant_name': 'Tenant{0}'.format(tenant_id)}], rows
+    return (time.perf_counter() - start) * 1000 / iterations, data_api.total_calls / float(iterations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dsn', required=True, help='libpq connection string of a superuser')
+    parser.add_argument('--round-trip-ms', type=float, default=20.0, help='simulated Data API latency per call')
+    parser.add_argument('--tenants', type=int, default=3)
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    setup(args.dsn, args.tenants)
+    data_api = LocalDataApi(args.dsn, role='app_user', round_trip_ms=args.round_trip_ms)
+    executor = TenantScopedExecutor(data_api, 'cluster-arn', 'secret-arn', 'postgres')
+
+    print('{0:<22} {1:>12} {2:>10} {3:>10}'.format('strategy', 'calls/query', 'p50 ms', 'p95 ms'))
+    for strategy in ('transaction', 'function', 'inline'):
+        latencies, calls = run_strategy(executor, data_api, strategy, args.tenants, args.iterations)
+        print('{0:<22} {1:>12.2f} {2:>10.2f} {3:>10.2f}'.format(
+            strategy, calls, statistics.median(latencies), percentile(latencies, 95)))
+
+    mean_ms, calls = run_grouped(executor, data_api, args.tenants, args.iterations)
+    print('{0:<22} {1:>12.2f} {2:>10.2f} {3:>10}'.format('grouped transaction', calls, mean_ms, '-'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""
+Local stand-in for the RDS Data API client, backed by a PostgreSQL connection.
+
+It accepts the same execute_statement, begin_transaction, commit_transaction
+and rollback_transaction calls as boto3.client('rds-data'), so the samples can
+run against a local PostgreSQL (for example `docker run -e POSTGRES_HOST_AUTH_METHOD=trust
+-p 5432:5432 pgvector/pgvector:pg16`). Each call sleeps for round_trip_ms to
+model the HTTPS round trip of the real Data API, and calls are counted.
+
+Requires psycopg 3 (`pip install "psycopg[binary]"`).
+"""
+import itertools
+import json
+import re
+import threading
+import time
+
+import psycopg
+
+PLACEHOLDER = re.compile(r'(?<!:):([A-Za-z_][A-Za-z0-9_]*)')
+
+
+def _value(field):
+    if field.get('isNull'):
+        return None
+    if 'blobValue' in field:
+        return bytes(field['blobValue'])
+    if 'arrayValue' in field:
+        array = field['arrayValue']
+        return list(next(iter(array.values())))
+    return next(iter(field.values()))
+
+
+def _field(value):
+    if value is None:
+        return {'isNull': True}
+    if isinstance(value, bool):
+        return {'booleanValue': value}
+    if isinstance(value, int):
+        return {'longValue': value}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {'blobValue': bytes(value)}
+    if isinstance(value, (dict, list)):
+        return {'stringValue': json.dumps(value)}
+    return {'stringValue': str(value)}
+
+
+class LocalDataApi:
+    """
+    rds-data client stand-in
+    :param conninfo: The libpq connection string of the local database
+    :param role: A role to SET ROLE to on every connection, so that RLS policies apply
+    :param round_trip_ms: Simulated network latency added to every call
+    """
+
+    def __init__(self, conninfo, role=None, round_trip_ms=0.0):
+        self.conninfo = conninfo
+        self.role = role
+        self.round_trip_ms = round_trip_ms
+        self.calls = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._transactions = {}
+        # connections of finished transactions are reused, like the Data API's own pool
+        self._idle = []
+        self._ids = itertools.count(1)
+
+    def _connect(self, autocommit):
+        conn = psycopg.connect(self.conninfo, autocommit=autocommit)
+        if self.role:
+            conn.execute('SET ROLE {0}'.format(self.role))
+            if not autocommit:
+                conn.commit()
+        return conn
+
+    def _autocommit_connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect(autocommit=True)
+        return conn
+
+    def _round_trip(self, operation_name):
+        with self._lock:
+            self.calls[operation_name] = self.calls.get(operation_name, 0) + 1
+        if self.round_trip_ms:
+            time.sleep(self.round_trip_ms / 1000.0)
+
+    @property
+    def total_calls(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+    def reset_calls(self):
+        with self._lock:
+            self.calls = {}
+
+    def execute_statement(self, resourceArn, secretArn, sql, database=None, parameters=None, transactionId=None,
+                          formatRecordsAs='NONE', includeResultMetadata=False, **kwargs):
+        self._round_trip('ExecuteStatement')
+        conn = self._transactions[transactionId] if transactionId else self._autocommit_connection()
+        values = {p['name']: _value(p['value']) for p in parameters or []}
+        query = PLACEHOLDER.sub(lambda m: '%({0})s'.format(m.group(1)), sql.replace('%', '%%'))
+        with conn.cursor() as cur:
+            cur.execute(query, values)
+            response = {'numberOfRecordsUpdated': max(cur.rowcount, 0) if cur.description is None else 0}
+            if cur.description is not None:
+                columns = [c.name for c in cur.description]
+                rows = cur.fetchall()
+                if formatRecordsAs == 'JSON':
+                    response['formattedRecords'] = json.dumps([dict(zip(columns, row)) for row in rows], default=str)
+                else:
+                    response['records'] = [[_field(v) for v in row] for row in rows]
+                if includeResultMetadata:
+                    response['columnMetadata'] = [{'name': name} for name in columns]
+        return response
+
+    def batch_execute_statement(self, resourceArn, secretArn, sql, parameterSets, database=None, transactionId=None,
+                                **kwargs):
+        self._round_trip('BatchExecuteStatement')
+        conn = self._transactions[transactionId] if transactionId else self._autocommit_connection()
+        query = PLACEHOLDER.sub(lambda m: '%({0})s'.format(m.group(1)), sql.replace('%', '%%'))
+        with conn.cursor() as cur:
+            cur.executemany(query, [{p['name']: _value(p['value']) for p in params} for params in parameterSets])
+        return {'updateResults': [{'generatedFields': []} for _ in parameterSets]}
+
+    def begin_transaction(self, resourceArn, secretArn, database=None, **kwargs):
+        self._round_trip('BeginTransaction')
+        transaction_id = 'tx-{0}'.format(next(self._ids))
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        self._transactions[transaction_id] = conn or self._connect(autocommit=False)
+        return {'transactionId': transaction_id}
+
+    def commit_transaction(self, resourceArn, secretArn, transactionId):
+        self._round_trip('CommitTransaction')
+        conn = self._transactions.pop(transactionId)
+        conn.commit()
+        with self._lock:
+            self._idle.append(conn)
+        return {'transactionStatus': 'Transaction Committed'}
+
+    def rollback_transaction(self, resourceArn, secretArn, transactionId):
+        self._round_trip('RollbackTransaction')
+        conn = self._transactions.pop(transactionId)
+        conn.rollback()
+        with self._lock:
+            self._idle.append(conn)
+        return {'transactionStatus': 'Rollback Complete'}
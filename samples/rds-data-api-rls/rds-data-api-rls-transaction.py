@@ -21,10 +21,12 @@ tr = rdsData.begin_transaction(
      secretArn = secret_arn,
      database = db_name)
 
+# the tenant ID is bound as a parameter, set_config(..., true) keeps it local to the transaction
 rdsData.execute_statement(resourceArn=cluster_arn,
                           secretArn=secret_arn,
                           database=db_name,
-                          sql='set tenant.id = {0}'.format(get_tenant_id_from_context()),
+                          sql="select set_config('tenant.id', :id::text, true)",
+                          parameters = [{'name':'id', 'value':{'longValue': get_tenant_id_from_context()}}],
                           transactionId = tr['transactionId'])
 
 response = rdsData.execute_statement(resourceArn=cluster_arn,
@@ -0,0 +1,185 @@
+"""
+Tenant-scoped query execution with row-level security through the RDS Data API.
+
+Three strategies set the tenant context that the RLS policy reads with
+current_setting('tenant.id'):
+
+* transaction - begin_transaction, set_config, the query and commit_transaction (4 round trips)
+* function    - a per-query PostgreSQL function that sets the context itself, see rds-data-api-rls-function.py (1 round trip)
+* inline      - the generic tenant_rows function below sets the context and runs any query (1 round trip)
+
+A CTE such as WITH ctx AS (SELECT set_config(...)) is not used for the inline
+strategy: PostgreSQL does not guarantee that the CTE runs before the RLS
+policy of the main query is evaluated. In a PL/pgSQL function the order is
+guaranteed. set_config(..., true) only lasts for the current transaction, so
+the context never leaks to another statement on the same connection.
+
+Create the tenant_rows function once, as the schema owner, with TENANT_ROWS_FUNCTION_SQL.
+"""
+import json
+import re
+from contextlib import contextmanager
+
+TENANT_ROWS_FUNCTION_SQL = """
+CREATE OR REPLACE FUNCTION tenant_rows(p_setting text, p_tenant_id text, p_query text, p_params jsonb DEFAULT '{}')
+  RETURNS SETOF jsonb AS
+$func$
+BEGIN
+   PERFORM set_config(p_setting, p_tenant_id, true);
+   RETURN QUERY EXECUTE format('SELECT to_jsonb(q) FROM (%s) q', p_query) USING p_params;
+END
+$func$  LANGUAGE plpgsql;
+"""
+
+STRATEGIES = ('transaction', 'function', 'inline')
+
+# :name placeholders, but not the :: of a cast
+PLACEHOLDER = re.compile(r'(?<!:):([A-Za-z_][A-Za-z0-9_]*)')
+
+
+def to_parameters(params):
+    """
+    Convert a dict of Python values to RDS Data API parameters
+    :param params: A dict of parameter names and values
+    :return: The list of parameters for execute_statement
+    """
+    parameters = []
+    for name, value in (params or {}).items():
+        if value is None:
+            field = {'isNull': True}
+        elif isinstance(value, bool):
+            field = {'booleanValue': value}
+        elif isinstance(value, int):
+            field = {'longValue': value}
+        elif isinstance(value, float):
+            field = {'doubleValue': value}
+        else:
+            field = {'stringValue': str(value)}
+        parameters.append({'name': name, 'value': field})
+    return parameters
+
+
+def _records(response):
+    return json.loads(response.get('formattedRecords') or '[]')
+
+
+class TenantTransaction:
+    """
+    Several tenant queries grouped in one Data API transaction
+
+    The tenant context is only set again when the tenant changes.
+    """
+
+    def __init__(self, executor, transaction_id):
+        self.executor = executor
+        self.transaction_id = transaction_id
+        self._tenant_id = None
+
+    def execute(self, tenant_id, sql, params=None):
+        if tenant_id != self._tenant_id:
+            self.executor._call(
+                "SELECT set_config('{0}', :tenant_id, true)".format(self.executor.setting),
+                {'tenant_id': str(tenant_id)}, self.transaction_id,
+            )
+            self._tenant_id = tenant_id
+        return _records(self.executor._call(sql, params, self.transaction_id))
+
+
+class TenantScopedExecutor:
+    """
+    Runs queries for a tenant with the RLS context set and all values bound as parameters
+    :param rds_data: The rds-data client
+    :param cluster_arn: The ARN of the Aurora cluster
+    :param secret_arn: The ARN of the secret of the database user the RLS policy applies to
+    :param database: The database name
+    :param setting: The setting read by the RLS policy
+    :param strategy: The default strategy, one of STRATEGIES
+    """
+
+    def __init__(self, rds_data, cluster_arn, secret_arn, database, setting='tenant.id', strategy='inline'):
+        if strategy not in STRATEGIES:
+            raise ValueError('Unknown strategy {0}, expected one of {1}'.format(strategy, STRATEGIES))
+        self.rds_data = rds_data
+        self.cluster_arn = cluster_arn
+        self.secret_arn = secret_arn
+        self.database = database
+        self.setting = setting
+        self.strategy = strategy
+
+    def _call(self, sql, params=None, transaction_id=None):
+        request = {
+            'resourceArn': self.cluster_arn,
+            'secretArn': self.secret_arn,
+            'database': self.database,
+            'sql': sql,
+            'parameters': to_parameters(params),
+            'formatRecordsAs': 'JSON',
+        }
+        if transaction_id:
+            request['transactionId'] = transaction_id
+        return self.rds_data.execute_statement(**request)
+
+    def execute(self, tenant_id, sql, params=None, strategy=None):
+        """
+        Run a query with the tenant context set
+        :param tenant_id: The tenant the query runs for
+        :param sql: The query, with :name placeholders. For the function strategy, a call to a
+            function that sets the context itself from the :tenant_id placeholder, e.g.
+            'select get_tenant_data(:tenant_id::integer)', which is bound to tenant_id. With the
+            inline strategy the values are read from a jsonb document, so cast placeholders that
+            are not compared to text
+        :param params: A dict of values bound to the placeholders
+        :param strategy: Overrides the executor strategy
+        :return: A list of dicts, one per row
+        """
+        strategy = strategy or self.strategy
+        if strategy == 'inline':
+            return self._execute_inline(tenant_id, sql, params)
+        if strategy == 'function':
+            return _records(self._call(sql, self._function_params(tenant_id, sql, params)))
+        if strategy == 'transaction':
+            with self.transaction() as tx:
+                return tx.execute(tenant_id, sql, params)
+        raise ValueError('Unknown strategy {0}, expected one of {1}'.format(strategy, STRATEGIES))
+
+    def _function_params(self, tenant_id, sql, params):
+        # the function sets the context from :tenant_id, so it must be the tenant the query runs for
+        if 'tenant_id' not in PLACEHOLDER.findall(sql):
+            raise ValueError('The function strategy needs a :tenant_id placeholder in {0!r}'.format(sql))
+        params = dict(params or {})
+        if 'tenant_id' in params and str(params['tenant_id']) != str(tenant_id):
+            raise ValueError('params tenant_id {0!r} does not match the tenant {1!r}'.format(
+                params['tenant_id'], tenant_id))
+        params['tenant_id'] = tenant_id
+        return params
+
+    def _execute_inline(self, tenant_id, sql, params):
+        # The values travel as one jsonb parameter, the query reads them as $1->>'name'.
+        query = PLACEHOLDER.sub(lambda m: "($1->>'{0}')".format(m.group(1)), sql)
+        response = self._call(
+            'SELECT tenant_rows AS row FROM tenant_rows(:setting, :tenant_id, :query, :params::jsonb)',
+            {'setting': self.setting, 'tenant_id': str(tenant_id), 'query': query, 'params': json.dumps(params or {})},
+        )
+        rows = []
+        for record in _records(response):
+            row = record['row']
+            rows.append(json.loads(row) if isinstance(row, str) else row)
+        return rows
+
+    @contextmanager
+    def transaction(self):
+        """
+        Group several tenant queries in one transaction, committed when the block exits
+        and rolled back when it raises
+        :return: A TenantTransaction
+        """
+        transaction_id = self.rds_data.begin_transaction(
+            resourceArn=self.cluster_arn, secretArn=self.secret_arn, database=self.database)['transactionId']
+        try:
+            yield TenantTransaction(self, transaction_id)
+        except Exception:
+            self.rds_data.rollback_transaction(
+                resourceArn=self.cluster_arn, secretArn=self.secret_arn, transactionId=transaction_id)
+            raise
+        self.rds_data.commit_transaction(
+            resourceArn=self.cluster_arn, secretArn=self.secret_arn, transactionId=transaction_id)
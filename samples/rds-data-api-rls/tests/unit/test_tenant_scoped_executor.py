@@ -0,0 +1,35 @@
+import pytest
+
+from tenant_scoped_executor import TenantScopedExecutor
+
+
+class RecordingRdsData:
+    def __init__(self):
+        self.statements = []
+
+    def execute_statement(self, **request):
+        self.statements.append(request)
+        return {'formattedRecords': '[{"tenant_name": "Tenant1"}]'}
+
+
+@pytest.fixture
+def executor():
+    return TenantScopedExecutor(RecordingRdsData(), 'cluster-arn', 'secret-arn', 'postgres', strategy='function')
+
+
+def test_function_strategy_binds_the_tenant(executor):
+    rows = executor.execute(1, 'select get_tenant_data(:tenant_id::integer) as tenant_name')
+    assert rows == [{'tenant_name': 'Tenant1'}]
+    assert executor.rds_data.statements[0]['parameters'] == [{'name': 'tenant_id', 'value': {'longValue': 1}}]
+
+
+def test_function_strategy_rejects_another_tenant_in_params(executor):
+    with pytest.raises(ValueError):
+        executor.execute('tenant-1', 'select * from tenant_orders(:tenant_id)', {'tenant_id': 'tenant-2'})
+    assert executor.rds_data.statements == []
+
+
+def test_function_strategy_requires_the_tenant_placeholder(executor):
+    with pytest.raises(ValueError):
+        executor.execute(1, 'select get_tenant_data(:id::integer)', {'id': 1})
+    assert executor.rds_data.statements == []
@@ -0,0 +1,157 @@
+"""
+Measure routed-query throughput as the number of tenants grows.
+
+Creates one database per shard on a local PostgreSQL (shard_1, shard_2, ...),
+spreads the tenants over them and writes their mappings to the mapping table.
+Each tenant count is then run three ways:
+
+* naive    - a GetItem and a new connection for every request
+* routed   - ShardRouter, with the mapping cache and per-shard pools
+* prefetch - ShardRouter after loading all mappings with BatchGetItem
+
+The mapping table is LocalDynamoDB unless --dynamodb-endpoint points to DynamoDB Local:
+
+    python benchmark_shard_router.py --dsn postgresql://postgres@localhost/postgres --tenants 10 100 1000
+"""
+import argparse
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg
+from psycopg.conninfo import make_conninfo
+
+from local_dynamodb import LocalDynamoDB
+from shard_router import ShardRouter, TenantShardMap
+
+TABLE_NAME = 'tenant_shard_mapping'
+QUERY = 'SELECT count(*), sum(amount) FROM orders WHERE tenant_id = %s'
+
+
+def shard_conninfo(dsn, shard_id):
+    return make_conninfo(dsn, dbname=shard_id.replace('-', '_'))
+
+
+def setup(dsn, dynamodb, shards, tenants):
+    shard_ids = ['shard-{0}'.format(n) for n in range(1, shards + 1)]
+    with psycopg.connect(dsn, autocommit=True) as conn:
+        existing = {row[0] for row in conn.execute('SELECT datname FROM pg_database')}
+        for shard_id in shard_ids:
+            if shard_id.replace('-', '_') not in existing:
+                conn.execute('CREATE DATABASE {0}'.format(shard_id.replace('-', '_')))
+    assignment = {'tenant-{0}'.format(i): shard_ids[i % shards] for i in range(tenants)}
+    for shard_id in shard_ids:
+        with psycopg.connect(shard_conninfo(dsn, shard_id), autocommit=True) as conn:
+            conn.execute('DROP TABLE IF EXISTS orders')
+            conn.execute('CREATE TABLE orders (tenant_id text, amount integer)')
+            conn.execute('CREATE INDEX ON orders (tenant_id)')
+            with conn.cursor() as cur:
+                cur.executemany('INSERT INTO orders SELECT %s, generate_series(1, 10)',
+                                [(t,) for t, s in assignment.items() if s == shard_id])
+    for tenant_id, shard_id in assignment.items():
+        dynamodb.put_item(TableName=TABLE_NAME, Item={
+            'tenant_id': {'S': tenant_id}, 'shard_id': {'S': shard_id}, 'version': {'N': '1'}})
+    return list(assignment)
+
+
+def create_table(dynamodb):
+    try:
+        dynamodb.create_table(TableName=TABLE_NAME, BillingMode='PAY_PER_REQUEST',
+                              AttributeDefinitions=[{'AttributeName': 'tenant_id', 'AttributeType': 'S'}],
+                              KeySchema=[{'AttributeName': 'tenant_id', 'KeyType': 'HASH'}])
+        dynamodb.get_waiter('table_exists').wait(TableName=TABLE_NAME)
+    except dynamodb.exceptions.ResourceInUseException:
+        pass
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def add(self, n=1):
+        with self._lock:
+            self.value += n
+
+
+def naive_request(dsn, dynamodb, connections):
+    def request(tenant_id):
+        item = dynamodb.get_item(TableName=TABLE_NAME, Key={'tenant_id': {'S': tenant_id}})['Item']
+        connections.add()
+        with psycopg.connect(shard_conninfo(dsn, item['shard_id']['S'])) as conn:
+            return conn.execute(QUERY, (tenant_id,)).fetchall()
+    return request
+
+
+def run(request, tenant_ids, requests, concurrency, seed=7):
+    rng = random.Random(seed)
+    workload = [rng.choice(tenant_ids) for _ in range(requests)]
+
+    def timed(tenant_id):
+        start = time.perf_counter()
+        rows = request(tenant_id)
+        assert rows[0][0] == 10, rows
+        return (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(timed, workload))
+    return requests / (time.perf_counter() - start), latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dsn', required=True, help='libpq connection string of a user that can create databases')
+    parser.add_argument('--shards', type=int, default=4)
+    parser.add_argument('--tenants', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--pool-size', type=int, default=4, help='maximum connections per shard')
+    parser.add_argument('--dynamodb-round-trip-ms', type=float, default=5.0, help='simulated LocalDynamoDB latency')
+    parser.add_argument('--dynamodb-endpoint', help='use DynamoDB Local at this URL instead of LocalDynamoDB')
+    args = parser.parse_args()
+
+    if args.dynamodb_endpoint:
+        import boto3
+        dynamodb = boto3.client('dynamodb', endpoint_url=args.dynamodb_endpoint)
+        create_table(dynamodb)
+    else:
+        dynamodb = LocalDynamoDB(round_trip_ms=args.dynamodb_round_trip_ms)
+
+    print('{0:>8} {1:<9} {2:>10} {3:>9} {4:>9} {5:>14} {6:>12}'.format(
+        'tenants', 'mode', 'req/s', 'p50 ms', 'p95 ms', 'ddb reads/req', 'connections'))
+    for tenants in args.tenants:
+        tenant_ids = setup(args.dsn, dynamodb, args.shards, tenants)
+        connections = Counter()
+        modes = [('naive', naive_request(args.dsn, dynamodb, connections), None)]
+        for mode in ('routed', 'prefetch'):
+            shard_map = TenantShardMap(dynamodb, TABLE_NAME)
+            router = ShardRouter(shard_map, lambda shard_id: shard_conninfo(args.dsn, shard_id),
+                                 max_size=args.pool_size)
+            modes.append((mode, lambda tenant_id, router=router: router.execute(tenant_id, QUERY, (tenant_id,)), router))
+
+        for mode, request, router in modes:
+            if mode == 'prefetch':
+                router.shard_map.prefetch(tenant_ids)
+            reads_before = router.shard_map.metrics['reads'] if router else 0
+            throughput, latencies = run(request, tenant_ids, args.requests, args.concurrency)
+            if router:
+                reads = router.shard_map.metrics['reads'] - reads_before
+                opened = sum(pool.opened for pool in router._pools.values())
+                router.close()
+            else:
+                reads, opened = args.requests, connections.value
+            print('{0:>8} {1:<9} {2:>10.0f} {3:>9.2f} {4:>9.2f} {5:>14.3f} {6:>12}'.format(
+                tenants, mode, throughput, statistics.median(latencies), percentile(latencies, 95),
+                reads / float(args.requests), opened))
+
+
+if __name__ == '__main__':
+    main()
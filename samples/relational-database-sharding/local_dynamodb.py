@@ -0,0 +1,74 @@
+"""
+In-memory stand-in for the DynamoDB calls of the shard mapping table.
+
+It accepts the get_item, put_item and batch_get_item calls of
+boto3.client('dynamodb') for a table keyed by tenant_id. Each call sleeps for
+round_trip_ms, and batch_get_item returns at most max_batch_keys items per call
+with the rest as UnprocessedKeys, like DynamoDB does when a batch is throttled
+or exceeds 16 MB. For DynamoDB Local, pass a real client instead
+(`boto3.client('dynamodb', endpoint_url='http://localhost:8000')`).
+"""
+import copy
+import threading
+import time
+
+
+class LocalDynamoDB:
+    """
+    dynamodb client stand-in
+    :param round_trip_ms: Simulated network latency added to every call
+    :param max_batch_keys: The number of keys a batch_get_item call processes
+    """
+
+    def __init__(self, round_trip_ms=0.0, max_batch_keys=100):
+        self.round_trip_ms = round_trip_ms
+        self.max_batch_keys = max_batch_keys
+        self.tables = {}
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def _round_trip(self, operation_name):
+        with self._lock:
+            self.calls[operation_name] = self.calls.get(operation_name, 0) + 1
+        if self.round_trip_ms:
+            time.sleep(self.round_trip_ms / 1000.0)
+
+    @property
+    def total_calls(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+    def reset_calls(self):
+        with self._lock:
+            self.calls = {}
+
+    def put_item(self, TableName, Item, **kwargs):
+        self._round_trip('PutItem')
+        with self._lock:
+            self.tables.setdefault(TableName, {})[Item['tenant_id']['S']] = copy.deepcopy(Item)
+        return {}
+
+    def get_item(self, TableName, Key, ConsistentRead=False, **kwargs):
+        self._round_trip('GetItem')
+        with self._lock:
+            item = self.tables.get(TableName, {}).get(Key['tenant_id']['S'])
+        return {'Item': copy.deepcopy(item)} if item is not None else {}
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        self._round_trip('BatchGetItem')
+        responses, unprocessed, budget = {}, {}, self.max_batch_keys
+        with self._lock:
+            for table_name, request in RequestItems.items():
+                keys = request['Keys']
+                if len(keys) > 100:
+                    raise ValueError('Too many items requested for the BatchGetItem call')
+                table = self.tables.get(table_name, {})
+                found = responses.setdefault(table_name, [])
+                for key in keys[:budget]:
+                    item = table.get(key['tenant_id']['S'])
+                    if item is not None:
+                        found.append(copy.deepcopy(item))
+                if keys[budget:]:
+                    unprocessed[table_name] = {'Keys': keys[budget:]}
+                budget = max(0, budget - len(keys))
+        return {'Responses': responses, 'UnprocessedKeys': unprocessed}
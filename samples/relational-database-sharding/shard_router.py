@@ -0,0 +1,341 @@
+"""
+Data access manager for the relational database sharding reference architecture.
+
+Resolves the shard of a tenant from a DynamoDB mapping table and hands out a
+connection to that shard:
+
+* TenantShardMap caches tenant -> shard items with a TTL. An item is dropped
+  when a newer mapping version is announced, e.g. after a tenant is moved, and
+  BatchGetItem prefetches the mappings of many tenants at once.
+* ShardConnectionPool keeps a bounded set of connections per shard. Connections
+  are opened lazily, and closed after they have been idle for idle_timeout_sec.
+* ShardRouter combines both.
+
+Mapping table items look like {'tenant_id': 'tenant-1', 'shard_id': 'shard-2', 'version': 3}.
+"""
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+BATCH_GET_MAX_KEYS = 100
+
+
+class TenantNotMappedError(KeyError):
+    pass
+
+
+class PoolExhaustedError(RuntimeError):
+    pass
+
+
+class ShardMapping:
+    def __init__(self, tenant_id, shard_id, version, fetched_at):
+        self.tenant_id = tenant_id
+        self.shard_id = shard_id
+        self.version = version
+        self.fetched_at = fetched_at
+
+    def __repr__(self):
+        return 'ShardMapping({0!r}, {1!r}, version={2})'.format(self.tenant_id, self.shard_id, self.version)
+
+
+class TenantShardMap:
+    """
+    TTL cache of the tenant to shard mapping table
+    :param dynamodb: A low-level boto3 DynamoDB client
+    :param table_name: The mapping table, with tenant_id as its partition key
+    :param ttl_sec: How long a mapping is used before it is read again
+    :param max_retries: Retries of the unprocessed keys of a BatchGetItem call, and of a read that
+        returns a version older than the one announced with invalidate
+    :param clock: Function returning the current time, in seconds
+    """
+
+    def __init__(self, dynamodb, table_name, ttl_sec=300, max_retries=5, clock=time.monotonic):
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+        self.ttl_sec = ttl_sec
+        self.max_retries = max_retries
+        self.clock = clock
+        self.metrics = {'hits': 0, 'misses': 0, 'reads': 0, 'invalidations': 0}
+        self._mappings = {}
+        self._min_versions = {}
+        self._lock = threading.Lock()
+
+    def _parse(self, item, fetched_at):
+        return ShardMapping(item['tenant_id']['S'], item['shard_id']['S'], int(item.get('version', {'N': '0'})['N']),
+                            fetched_at)
+
+    def _store(self, mapping):
+        with self._lock:
+            if mapping.version < self._min_versions.get(mapping.tenant_id, 0):
+                return False
+            self._mappings[mapping.tenant_id] = mapping
+            return True
+
+    def lookup(self, tenant_id):
+        """
+        Get the shard mapping of a tenant
+        :param tenant_id: The tenant identifier
+        :return: The ShardMapping
+        """
+        now = self.clock()
+        with self._lock:
+            mapping = self._mappings.get(tenant_id)
+            if mapping is not None and now - mapping.fetched_at < self.ttl_sec:
+                self.metrics['hits'] += 1
+                return mapping
+            self.metrics['misses'] += 1
+        attempt = 0
+        while True:
+            with self._lock:
+                self.metrics['reads'] += 1
+                # a newer version was announced, possibly during the previous read, so read past any stale replica
+                consistent = attempt > 0 or tenant_id in self._min_versions
+            response = self.dynamodb.get_item(TableName=self.table_name, Key={'tenant_id': {'S': tenant_id}},
+                                              ConsistentRead=consistent)
+            if 'Item' not in response:
+                raise TenantNotMappedError(tenant_id)
+            mapping = self._parse(response['Item'], now)
+            if self._store(mapping):
+                return mapping
+            # the announced version is not written yet, never route to the shard the tenant left
+            if attempt >= self.max_retries:
+                raise RuntimeError('Mapping of {0} is at version {1}, version {2} was announced'.format(
+                    tenant_id, mapping.version, self._min_versions.get(tenant_id)))
+            time.sleep(random.uniform(0, 0.05 * (2 ** attempt)))
+            attempt += 1
+
+    def prefetch(self, tenant_ids):
+        """
+        Load the mappings of many tenants with BatchGetItem, retrying unprocessed keys
+        :param tenant_ids: The tenant identifiers
+        :return: The number of mappings loaded, leaving out versions older than an announced one
+        """
+        tenant_ids = list(dict.fromkeys(tenant_ids))
+        loaded = 0
+        for start in range(0, len(tenant_ids), BATCH_GET_MAX_KEYS):
+            keys = [{'tenant_id': {'S': t}} for t in tenant_ids[start:start + BATCH_GET_MAX_KEYS]]
+            request = {self.table_name: {'Keys': keys}}
+            attempt = 0
+            while request:
+                with self._lock:
+                    self.metrics['reads'] += 1
+                response = self.dynamodb.batch_get_item(RequestItems=request)
+                now = self.clock()
+                for item in response.get('Responses', {}).get(self.table_name, []):
+                    if self._store(self._parse(item, now)):
+                        loaded += 1
+                request = response.get('UnprocessedKeys') or {}
+                if request:
+                    if attempt >= self.max_retries:
+                        raise RuntimeError('BatchGetItem left {0} keys unprocessed'.format(
+                            len(request[self.table_name]['Keys'])))
+                    time.sleep(random.uniform(0, 0.05 * (2 ** attempt)))
+                    attempt += 1
+        return loaded
+
+    def invalidate(self, tenant_id, min_version=None):
+        """
+        Drop the cached mapping of a tenant
+        :param tenant_id: The tenant identifier
+        :param min_version: Only drop it when it is older than this version, and ignore
+            older versions read afterwards
+        """
+        with self._lock:
+            mapping = self._mappings.get(tenant_id)
+            if min_version is not None:
+                self._min_versions[tenant_id] = max(min_version, self._min_versions.get(tenant_id, 0))
+            if mapping is not None and (min_version is None or mapping.version < min_version):
+                del self._mappings[tenant_id]
+                self.metrics['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._mappings.clear()
+
+
+class ShardConnectionPool:
+    """
+    Bounded pool of connections to one shard
+    :param connect: Function opening a new connection
+    :param max_size: The maximum number of open connections
+    :param idle_timeout_sec: Idle connections older than this are closed
+    :param acquire_timeout_sec: How long to wait for a free connection
+    :param clock: Function returning the current time, in seconds
+    """
+
+    def __init__(self, connect, max_size=10, idle_timeout_sec=300, acquire_timeout_sec=5, clock=time.monotonic):
+        self.connect = connect
+        self.max_size = max_size
+        self.idle_timeout_sec = idle_timeout_sec
+        self.acquire_timeout_sec = acquire_timeout_sec
+        self.clock = clock
+        self.opened = 0
+        self.closed = 0
+        self._idle = deque()
+        self._size = 0
+        self._available = threading.Condition()
+
+    @property
+    def size(self):
+        with self._available:
+            return self._size
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        finally:
+            self.closed += 1
+
+    def evict_idle(self):
+        """
+        Close the connections that have been idle for longer than idle_timeout_sec
+        :return: The number of connections closed
+        """
+        expired = []
+        with self._available:
+            now = self.clock()
+            while self._idle and now - self._idle[0][1] > self.idle_timeout_sec:
+                expired.append(self._idle.popleft()[0])
+                self._size -= 1
+            if expired:
+                self._available.notify(len(expired))
+        for conn in expired:
+            self._close(conn)
+        return len(expired)
+
+    def warm_up(self, count):
+        """
+        Open connections ahead of the first requests
+        :param count: The number of connections to have open, bounded by max_size
+        """
+        while True:
+            with self._available:
+                if self._size >= min(count, self.max_size):
+                    return
+                self._size += 1
+            conn = self._open()
+            self.release(conn)
+
+    def _open(self):
+        try:
+            conn = self.connect()
+        except Exception:
+            with self._available:
+                self._size -= 1
+                self._available.notify()
+            raise
+        self.opened += 1
+        return conn
+
+    def acquire(self):
+        self.evict_idle()
+        deadline = self.clock() + self.acquire_timeout_sec
+        with self._available:
+            while True:
+                if self._idle:
+                    # most recently used first, so rarely used connections age out
+                    return self._idle.pop()[0]
+                if self._size < self.max_size:
+                    self._size += 1
+                    break
+                remaining = deadline - self.clock()
+                if remaining <= 0:
+                    raise PoolExhaustedError('No connection available within {0}s'.format(self.acquire_timeout_sec))
+                self._available.wait(remaining)
+        return self._open()
+
+    def release(self, conn, discard=False):
+        if discard:
+            with self._available:
+                self._size -= 1
+                self._available.notify()
+            self._close(conn)
+            return
+        with self._available:
+            self._idle.append((conn, self.clock()))
+            self._available.notify()
+
+    def close(self):
+        with self._available:
+            idle, self._idle = list(self._idle), deque()
+            self._size -= len(idle)
+        for conn, _ in idle:
+            self._close(conn)
+
+
+class ShardRouter:
+    """
+    Routes tenant requests to a pooled connection of the tenant's shard
+    :param shard_map: The TenantShardMap
+    :param shard_conninfo: A dict, or a function, giving the connection string of a shard ID
+    :param connect: Function opening a connection from a connection string, psycopg.connect by default
+    :param pool_kwargs: Arguments of each ShardConnectionPool
+    """
+
+    def __init__(self, shard_map, shard_conninfo, connect=None, **pool_kwargs):
+        if connect is None:
+            import psycopg
+            connect = psycopg.connect
+        self.shard_map = shard_map
+        self.shard_conninfo = shard_conninfo if callable(shard_conninfo) else shard_conninfo.__getitem__
+        self.connect = connect
+        self.pool_kwargs = pool_kwargs
+        self._pools = {}
+        self._lock = threading.Lock()
+
+    def pool(self, shard_id):
+        with self._lock:
+            pool = self._pools.get(shard_id)
+            if pool is None:
+                conninfo = self.shard_conninfo(shard_id)
+                pool = self._pools[shard_id] = ShardConnectionPool(lambda: self.connect(conninfo), **self.pool_kwargs)
+        return pool
+
+    @contextmanager
+    def connection(self, tenant_id):
+        """
+        Borrow a connection to the shard of a tenant. Work the caller did not commit is rolled back
+        before the connection goes back to the pool.
+        :param tenant_id: The tenant identifier
+        :return: A context manager yielding the connection
+        """
+        pool = self.pool(self.shard_map.lookup(tenant_id).shard_id)
+        conn = pool.acquire()
+        try:
+            yield conn
+            # an open transaction would hold its locks and leak into the next tenant's request
+            conn.rollback()
+        except Exception:
+            # the connection may be in a failed transaction or broken, do not hand it out again
+            pool.release(conn, discard=True)
+            raise
+        pool.release(conn)
+
+    def execute(self, tenant_id, sql, params=None):
+        """
+        Run a query on the shard of a tenant
+        :param tenant_id: The tenant identifier
+        :param sql: The query
+        :param params: The query parameters
+        :return: The rows, or None for statements without a result set
+        """
+        with self.connection(tenant_id) as conn:
+            with conn.cursor() as cur:
+                cur.execute(sql, params)
+                rows = cur.fetchall() if cur.description is not None else None
+            conn.commit()
+            return rows
+
+    def evict_idle(self):
+        with self._lock:
+            pools = list(self._pools.values())
+        return sum(pool.evict_idle() for pool in pools)
+
+    def close(self):
+        with self._lock:
+            pools, self._pools = list(self._pools.values()), {}
+        for pool in pools:
+            pool.close()
@@ -0,0 +1,301 @@
+"""
+In-memory stand-ins for the STS, Athena and S3 calls of the data lake tenant isolation sample.
+
+Clients are built from the credentials of an assumed role, and every call is
+authorized by the TenantID session tag of those credentials, which
+TaggedSts records when it issues them:
+
+* LocalAthena runs queries on SQLite. The orders table holds the CSV objects
+  written under s3://<data_bucket>/orders/, loaded when a query starts. A
+  client only sees the rows of its tenant, the way the Lake Formation data
+  filter of the TenantID session tag does: its queries run with orders
+  replaced by 'SELECT * FROM orders WHERE tenant_id = <tenant>'. A query stays
+  RUNNING for query_ms.
+* LocalS3 only lets a client read and write the data bucket under
+  orders/tenant=<tenant>/. Query results are read from the results bucket.
+
+Credentials that were not issued by TaggedSts are rejected with AccessDenied.
+Every call sleeps for round_trip_ms.
+"""
+import csv
+import io
+import itertools
+import sqlite3
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+TENANT_TAG = 'TenantID'
+
+
+def access_denied(operation_name, message):
+    return ClientError({'Error': {'Code': 'AccessDenied', 'Message': message}}, operation_name)
+
+
+class TaggedSts:
+    """
+    sts client wrapper recording the session tags of the credentials it issues
+    :param sts: The sts client stand-in, e.g. LocalSts
+    """
+
+    def __init__(self, sts):
+        self.sts = sts
+        self._tags = {}
+        self._lock = threading.Lock()
+
+    @property
+    def calls(self):
+        return self.sts.calls
+
+    def assume_role(self, **kwargs):
+        response = self.sts.assume_role(**kwargs)
+        with self._lock:
+            self._tags[response['Credentials']['AccessKeyId']] = {t['Key']: t['Value'] for t in kwargs.get('Tags', [])}
+        return response
+
+    def tenant_id(self, credentials, operation_name):
+        """
+        :param credentials: A dict with the AccessKeyId of the caller
+        :param operation_name: The operation being authorized, for the error
+        :return: The TenantID session tag of the credentials
+        """
+        with self._lock:
+            tags = self._tags.get(credentials.get('AccessKeyId'))
+        if not tags or not tags.get(TENANT_TAG):
+            raise access_denied(operation_name, 'The credentials have no {0} session tag'.format(TENANT_TAG))
+        return tags[TENANT_TAG]
+
+
+class LocalS3:
+    """
+    s3 stand-in holding the objects, see client
+    :param sts: The TaggedSts that issued the credentials of the clients
+    :param data_bucket: The bucket of the orders CSV objects, tenants only reach their own prefix in it
+    :param round_trip_ms: Simulated network latency added to every call
+    """
+
+    def __init__(self, sts, data_bucket='data-lake', round_trip_ms=0.0):
+        self.sts = sts
+        self.data_bucket = data_bucket
+        self.round_trip_ms = round_trip_ms
+        self.objects = {}
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def _round_trip(self, operation_name):
+        with self._lock:
+            self.calls[operation_name] = self.calls.get(operation_name, 0) + 1
+        if self.round_trip_ms:
+            time.sleep(self.round_trip_ms / 1000.0)
+
+    @property
+    def total_calls(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+    def client(self, credentials):
+        """
+        :param credentials: The Credentials of an AssumeRole response of the TaggedSts
+        :return: An s3 client authorized by the TenantID session tag of the credentials
+        """
+        return TenantS3Client(self, credentials)
+
+    def tenant_prefix(self, tenant_id):
+        return 'orders/tenant={0}/'.format(tenant_id)
+
+    def _authorize(self, credentials, operation_name, bucket, key):
+        tenant_id = self.sts.tenant_id(credentials, operation_name)
+        if bucket == self.data_bucket and not key.startswith(self.tenant_prefix(tenant_id)):
+            raise access_denied(operation_name, '{0} cannot access s3://{1}/{2}'.format(tenant_id, bucket, key))
+
+    def put_object(self, credentials, Bucket, Key, Body, **kwargs):
+        self._round_trip('PutObject')
+        self._authorize(credentials, 'PutObject', Bucket, Key)
+        with self._lock:
+            self.objects[(Bucket, Key)] = Body if isinstance(Body, bytes) else Body.encode('utf-8')
+        return {}
+
+    def get_object(self, credentials, Bucket, Key, **kwargs):
+        self._round_trip('GetObject')
+        self._authorize(credentials, 'GetObject', Bucket, Key)
+        with self._lock:
+            body = self.objects.get((Bucket, Key))
+        if body is None:
+            raise ClientError({'Error': {'Code': 'NoSuchKey', 'Message': 'The specified key does not exist.'}},
+                              'GetObject')
+        return {'Body': io.BytesIO(body), 'ContentLength': len(body)}
+
+    def head_object(self, credentials, Bucket, Key, **kwargs):
+        self._round_trip('HeadObject')
+        self._authorize(credentials, 'HeadObject', Bucket, Key)
+        with self._lock:
+            return {'ContentLength': len(self.objects[(Bucket, Key)])}
+
+    def keys(self, bucket, prefix):
+        with self._lock:
+            return sorted(key for b, key in self.objects if b == bucket and key.startswith(prefix))
+
+
+class LocalAthena:
+    """
+    athena stand-in shared by all tenants, see client
+    :param s3: The LocalS3 holding the data and the query results, its data bucket holds the orders CSV
+        objects, with the columns tenant_id and amount
+    :param round_trip_ms: Simulated network latency added to every call
+    :param query_ms: How long a query stays RUNNING
+    """
+
+    def __init__(self, s3, round_trip_ms=0.0, query_ms=0.0):
+        self.s3 = s3
+        self.sts = s3.sts
+        self.data_bucket = s3.data_bucket
+        self.round_trip_ms = round_trip_ms
+        self.query_ms = query_ms
+        self.calls = {}
+        self.reused = 0
+        self._db = sqlite3.connect(':memory:', check_same_thread=False)
+        self._db.execute('CREATE TABLE orders (tenant_id text, amount integer)')
+        self._db.execute('CREATE INDEX orders_tenant ON orders (tenant_id)')
+        self._loaded = set()
+        self._executions = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _round_trip(self, operation_name):
+        with self._lock:
+            self.calls[operation_name] = self.calls.get(operation_name, 0) + 1
+        if self.round_trip_ms:
+            time.sleep(self.round_trip_ms / 1000.0)
+
+    @property
+    def total_calls(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+    def client(self, credentials):
+        """
+        :param credentials: The Credentials of an AssumeRole response of the TaggedSts
+        :return: An athena client that only sees the rows of the TenantID session tag of the credentials
+        """
+        return TenantAthenaClient(self, credentials)
+
+    def _load_new_objects(self):
+        # called with the lock held, like a table over an S3 prefix new objects are visible to the next query
+        for key in self.s3.keys(self.data_bucket, 'orders/'):
+            if key in self._loaded:
+                continue
+            body = self.s3.objects[(self.data_bucket, key)].decode('utf-8')
+            rows = [(row['tenant_id'], int(row['amount'])) for row in csv.DictReader(io.StringIO(body))]
+            self._db.executemany('INSERT INTO orders VALUES (?, ?)', rows)
+            self._loaded.add(key)
+
+    def start_query_execution(self, credentials, QueryString, QueryExecutionContext, ResultConfiguration=None,
+                              WorkGroup=None, ExecutionParameters=None, ResultReuseConfiguration=None, **kwargs):
+        self._round_trip('StartQueryExecution')
+        tenant_id = self.sts.tenant_id(credentials, 'StartQueryExecution')
+        key = (tenant_id, QueryString, tuple(ExecutionParameters or ()))
+        reuse = (ResultReuseConfiguration or {}).get('ResultReuseByAgeConfiguration', {})
+        now = time.monotonic()
+        with self._lock:
+            if reuse.get('Enabled'):
+                max_age = reuse.get('MaxAgeInMinutes', 60) * 60
+                for execution in self._executions.values():
+                    if execution['key'] == key and execution['error'] is None and now - execution['started'] <= max_age:
+                        self.reused += 1
+                        return {'QueryExecutionId': execution['id']}
+            self._load_new_objects()
+            query = 'WITH orders AS (SELECT * FROM main.orders WHERE tenant_id = ?) ' + QueryString
+            execution = {'id': 'q-{0}'.format(next(self._ids)), 'key': key, 'started': now, 'tenant_id': tenant_id,
+                         'columns': [], 'rows': [], 'error': None}
+            try:
+                cursor = self._db.execute(query, [tenant_id] + list(ExecutionParameters or ()))
+                execution['columns'] = [c[0] for c in cursor.description]
+                execution['rows'] = [['' if v is None else str(v) for v in row] for row in cursor.fetchall()]
+            except sqlite3.Error as err:
+                execution['error'] = str(err)
+            output = (ResultConfiguration or {}).get('OutputLocation', 's3://athena-results/')
+            execution['output'] = '{0}{1}.csv'.format(output, execution['id'])
+            self._executions[execution['id']] = execution
+        if execution['error'] is None:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(execution['columns'])
+            writer.writerows(execution['rows'])
+            bucket, _, result_key = execution['output'][len('s3://'):].partition('/')
+            with self.s3._lock:
+                self.s3.objects[(bucket, result_key)] = buffer.getvalue().encode('utf-8')
+        return {'QueryExecutionId': execution['id']}
+
+    def _execution(self, tenant_id, query_execution_id):
+        execution = self._executions.get(query_execution_id)
+        if execution is None or execution['tenant_id'] != tenant_id:
+            raise ClientError({'Error': {'Code': 'InvalidRequestException',
+                                         'Message': 'QueryExecution {0} was not found'.format(query_execution_id)}},
+                              'GetQueryExecution')
+        return execution
+
+    def get_query_execution(self, credentials, QueryExecutionId):
+        self._round_trip('GetQueryExecution')
+        tenant_id = self.sts.tenant_id(credentials, 'GetQueryExecution')
+        with self._lock:
+            execution = self._execution(tenant_id, QueryExecutionId)
+        if time.monotonic() - execution['started'] < self.query_ms / 1000.0:
+            status = {'State': 'RUNNING'}
+        elif execution['error'] is not None:
+            status = {'State': 'FAILED', 'StateChangeReason': execution['error']}
+        else:
+            status = {'State': 'SUCCEEDED'}
+        return {'QueryExecution': {'QueryExecutionId': QueryExecutionId, 'Status': status,
+                                   'ResultConfiguration': {'OutputLocation': execution['output']}}}
+
+    def get_query_results(self, credentials, QueryExecutionId, MaxResults=1000, NextToken=None):
+        self._round_trip('GetQueryResults')
+        tenant_id = self.sts.tenant_id(credentials, 'GetQueryResults')
+        with self._lock:
+            execution = self._execution(tenant_id, QueryExecutionId)
+        rows = [execution['columns']] + execution['rows']
+        start = int(NextToken or 0)
+        page = {
+            'ResultSet': {
+                'Rows': [{'Data': [{'VarCharValue': value} for value in row]} for row in rows[start:start + MaxResults]],
+                'ResultSetMetadata': {'ColumnInfo': [{'Name': name} for name in execution['columns']]},
+            }
+        }
+        if start + MaxResults < len(rows):
+            page['NextToken'] = str(start + MaxResults)
+        return page
+
+
+class TenantAthenaClient:
+    """The athena client of a set of credentials, see LocalAthena.client"""
+
+    def __init__(self, athena, credentials):
+        self.athena = athena
+        self.credentials = credentials
+
+    def start_query_execution(self, **kwargs):
+        return self.athena.start_query_execution(self.credentials, **kwargs)
+
+    def get_query_execution(self, **kwargs):
+        return self.athena.get_query_execution(self.credentials, **kwargs)
+
+    def get_query_results(self, **kwargs):
+        return self.athena.get_query_results(self.credentials, **kwargs)
+
+
+class TenantS3Client:
+    """The s3 client of a set of credentials, see LocalS3.client"""
+
+    def __init__(self, s3, credentials):
+        self.s3 = s3
+        self.credentials = credentials
+
+    def put_object(self, **kwargs):
+        return self.s3.put_object(self.credentials, **kwargs)
+
+    def get_object(self, **kwargs):
+        return self.s3.get_object(self.credentials, **kwargs)
+
+    def head_object(self, **kwargs):
+        return self.s3.head_object(self.credentials, **kwargs)
@@ -0,0 +1,117 @@
+"""
+Run the same multi-tenant workload against each tenant isolation pattern.
+
+Every pattern runs with each of its variants (see targets.py) on local
+stand-ins, and reports the latency percentiles, throughput and round trips
+per request. The PostgreSQL patterns need --dsn and are skipped without it:
+
+    docker run -e POSTGRES_HOST_AUTH_METHOD=trust -p 5432:5432 pgvector/pgvector:pg16
+    python run_benchmarks.py --dsn postgresql://postgres@localhost/postgres --output baseline.json
+    python run_benchmarks.py --dsn postgresql://postgres@localhost/postgres --compare baseline.json
+
+Results are saved as JSON with --output. --compare prints the change of each
+metric against a saved run, for the patterns and variants both runs have.
+"""
+import argparse
+import json
+import sys
+
+from targets import (DataLakeTarget, DynamoDbPooledTarget, PgvectorRlsTarget, RdsDataApiRlsTarget, ShardingTarget,
+                     TARGETS)
+from workload import Workload, compare_results, environment, parse_mix, run_workload
+
+
+def build_target(pattern, variant, args):
+    if pattern == RdsDataApiRlsTarget.name:
+        return RdsDataApiRlsTarget(args.dsn, variant, round_trip_ms=args.round_trip_ms)
+    if pattern == PgvectorRlsTarget.name:
+        return PgvectorRlsTarget(args.dsn, variant, round_trip_ms=args.round_trip_ms, bedrock_ms=args.bedrock_ms,
+                                 dimensions=args.dimensions)
+    if pattern == DataLakeTarget.name:
+        return DataLakeTarget(variant, round_trip_ms=args.round_trip_ms, sts_ms=args.sts_ms,
+                              query_ms=args.athena_query_ms)
+    if pattern == DynamoDbPooledTarget.name:
+        return DynamoDbPooledTarget(variant, round_trip_ms=args.round_trip_ms, sts_ms=args.sts_ms,
+                                    endpoint=args.dynamodb_endpoint)
+    return ShardingTarget(args.dsn, variant, round_trip_ms=args.round_trip_ms, endpoint=args.dynamodb_endpoint)
+
+
+def print_result(result):
+    latency = result['latency_ms']
+    print('{0:<18} {1:<12} {2:>9.1f} {3:>9.2f} {4:>9.2f} {5:>9.2f} {6:>8.2f} {7:>7}'.format(
+        result['pattern'], result['variant'], result['throughput_rps'], latency['p50'] or 0, latency['p95'] or 0,
+        latency['p99'] or 0, result['round_trips_per_request'], result['errors']))
+    for error in result['error_samples']:
+        print('    {0}'.format(error))
+
+
+def print_comparison(baseline, current):
+    if baseline.get('workload') != current.get('workload'):
+        print('\nThe workloads differ: {0} against {1}'.format(baseline.get('workload'), current.get('workload')))
+    print('\n{0:<18} {1:<12} {2:<15} {3:>11} {4:>11} {5:>9}'.format(
+        'pattern', 'variant', 'metric', 'baseline', 'current', 'change'))
+    for pattern, variant, label, old, new, change in compare_results(baseline, current):
+        print('{0:<18} {1:<12} {2:<15} {3:>11} {4:>11} {5:>9}'.format(
+            pattern, variant, label, '-' if old is None else old, '-' if new is None else new,
+            '-' if change is None else '{0:+.1f}%'.format(change)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--patterns', nargs='+', choices=sorted(TARGETS), default=list(TARGETS))
+    parser.add_argument('--variants', nargs='+', help='only run these variants, e.g. inline cached pooled')
+    parser.add_argument('--tenants', type=int, default=20)
+    parser.add_argument('--skew', type=float, default=1.0, help='Zipf exponent of the tenant sizes, 0 for equal tenants')
+    parser.add_argument('--rows', type=int, default=10000, help='rows, items or chunks over all tenants')
+    parser.add_argument('--mix', type=parse_mix, default='read=0.9,write=0.1', help='e.g. read=0.9,write=0.1')
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--warmup', type=int, default=0, help='requests sent before measuring')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--round-trip-ms', type=float, default=5.0,
+                        help='simulated latency of the Data API, DynamoDB, Athena and S3 calls')
+    parser.add_argument('--sts-ms', type=float, default=30.0, help='simulated AssumeRole latency')
+    parser.add_argument('--bedrock-ms', type=float, default=20.0, help='simulated embedding latency')
+    parser.add_argument('--athena-query-ms', type=float, default=200.0, help='how long each Athena query runs')
+    parser.add_argument('--dimensions', type=int, default=256, help='embedding dimensions of the pgvector pattern')
+    parser.add_argument('--dsn', help='libpq connection string of a PostgreSQL superuser, with pgvector')
+    parser.add_argument('--dynamodb-endpoint', help='use DynamoDB Local at this URL, it has no partition limits')
+    parser.add_argument('--output', help='save the results to this JSON file')
+    parser.add_argument('--compare', help='a JSON file saved by an earlier run')
+    args = parser.parse_args()
+
+    workload = Workload(args.tenants, args.skew, args.rows, args.mix, args.requests, args.concurrency, args.warmup,
+                        args.seed)
+    print('{0:<18} {1:<12} {2:>9} {3:>9} {4:>9} {5:>9} {6:>8} {7:>7}'.format(
+        'pattern', 'variant', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'rt/req', 'errors'))
+    results = []
+    for pattern in args.patterns:
+        if pattern in (RdsDataApiRlsTarget.name, PgvectorRlsTarget.name, ShardingTarget.name) and not args.dsn:
+            print('{0:<18} skipped, needs --dsn'.format(pattern))
+            continue
+        for variant in TARGETS[pattern].variants:
+            if args.variants and variant not in args.variants:
+                continue
+            target = build_target(pattern, variant, args)
+            try:
+                result = run_workload(target, workload)
+            finally:
+                target.close()
+            print_result(result)
+            results.append(result)
+
+    report = {'workload': workload.to_dict(), 'settings': {
+        'round_trip_ms': args.round_trip_ms, 'sts_ms': args.sts_ms, 'bedrock_ms': args.bedrock_ms,
+        'athena_query_ms': args.athena_query_ms, 'dimensions': args.dimensions,
+        'dynamodb_endpoint': args.dynamodb_endpoint}, 'environment': environment(), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(json.load(f), report)
+    return 1 if any(result['errors'] for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,527 @@
+"""
+Benchmark targets, one per tenant isolation pattern of the repository.
+
+Each target drives the pattern's own code from the samples directory against
+local stand-ins, and checks that every read only returns the tenant's data:
+
+* RdsDataApiRlsTarget   - TenantScopedExecutor through LocalDataApi on PostgreSQL
+* PgvectorRlsTarget     - similarity search under the self_managed.kb RLS policy, with StubBedrockRuntime embeddings
+* DataLakeTarget        - TenantAthenaExecutor with the TenantSessionCache of the Lambda layer, on LocalAthena
+* DynamoDbPooledTarget  - PooledTable with tenant-scoped sessions, on LocalDynamoDB or DynamoDB Local
+* ShardingTarget        - ShardRouter over one PostgreSQL database per shard
+
+The operations of every target are 'read' and 'write'. STS is always the
+LocalSts stand-in of the DynamoDB pooled isolation sample.
+"""
+import importlib.util
+import itertools
+import json
+import os
+import sys
+import threading
+import uuid
+
+from local_athena import LocalAthena, LocalS3, TaggedSts
+
+SAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+ROLE_ARN = 'arn:aws:iam::111122223333:role/TenantRole'
+
+
+def load_sample_module(path, module_name):
+    """
+    Import a module of another sample
+    :param path: The directory of the module, relative to the samples directory
+    :param module_name: The module, e.g. 'local_dynamodb'
+    :return: The module
+    """
+    # several samples ship a local_dynamodb.py, so each module is registered under the path of its sample
+    qualified_name = '{0}.{1}'.format(path.replace('/', '.').replace('-', '_'), module_name)
+    if qualified_name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(qualified_name, os.path.join(SAMPLES, path, module_name + '.py'))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[qualified_name] = module
+        spec.loader.exec_module(module)
+    return sys.modules[qualified_name]
+
+
+def count_boto3_calls(client, counter):
+    """
+    Count the requests a boto3 client sends, for clients of DynamoDB Local
+    :param client: The boto3 client
+    :param counter: A CallCounter
+    :return: The client
+    """
+    client.meta.events.register('before-send', lambda **kwargs: counter.add())
+    return client
+
+
+def dynamodb_local_client(endpoint, credentials=None):
+    import boto3
+    credentials = credentials or {'AccessKeyId': 'local', 'SecretAccessKey': 'local', 'SessionToken': None}
+    return boto3.client('dynamodb', endpoint_url=endpoint, region_name='us-east-1',
+                        aws_access_key_id=credentials['AccessKeyId'],
+                        aws_secret_access_key=credentials['SecretAccessKey'],
+                        aws_session_token=credentials['SessionToken'])
+
+
+def recreate_table(client, table_name, key_schema):
+    """
+    Drop and create a DynamoDB Local table with string keys
+    :param client: A dynamodb client of DynamoDB Local
+    :param table_name: The table
+    :param key_schema: A list of (attribute, 'HASH' or 'RANGE')
+    """
+    try:
+        client.delete_table(TableName=table_name)
+        client.get_waiter('table_not_exists').wait(TableName=table_name)
+    except client.exceptions.ResourceNotFoundException:
+        pass
+    client.create_table(
+        TableName=table_name,
+        KeySchema=[{'AttributeName': name, 'KeyType': key_type} for name, key_type in key_schema],
+        AttributeDefinitions=[{'AttributeName': name, 'AttributeType': 'S'} for name, _ in key_schema],
+        BillingMode='PAY_PER_REQUEST',
+    )
+    client.get_waiter('table_exists').wait(TableName=table_name)
+
+
+class CallCounter:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def add(self, n=1):
+        with self._lock:
+            self.value += n
+
+
+def check_tenant(tenant_id, rows, column='tenant_id'):
+    # the isolation check of every read: no row of another tenant
+    leaked = [row for row in rows if row[column] != tenant_id]
+    if leaked:
+        raise AssertionError('{0} rows of other tenants returned for {1}'.format(len(leaked), tenant_id))
+    return rows
+
+
+class RdsDataApiRlsTarget:
+    """
+    Row-level security through the RDS Data API, see samples/rds-data-api-rls
+    :param dsn: The libpq connection string of a superuser of the local PostgreSQL
+    :param variant: The TenantScopedExecutor strategy of the reads: 'inline', 'function' or 'transaction'
+    :param round_trip_ms: Simulated Data API latency per call
+
+    Writes use a transaction with the transaction strategy, and a function that
+    sets the tenant context with the other two: tenant_rows only runs queries.
+    """
+
+    name = 'rds-data-api-rls'
+    variants = ('inline', 'function', 'transaction')
+
+    SETUP_SQL = """
+    DROP TABLE IF EXISTS bench_orders CASCADE;
+    CREATE TABLE bench_orders ( order_id bigserial PRIMARY KEY, tenant_id text NOT NULL, amount integer NOT NULL );
+    CREATE INDEX ON bench_orders (tenant_id);
+    CREATE POLICY tenant_policy ON bench_orders USING (tenant_id = current_setting('tenant.id'));
+    ALTER TABLE bench_orders ENABLE ROW LEVEL SECURITY;
+    DO $$ BEGIN
+       IF NOT EXISTS (SELECT FROM pg_roles WHERE rolname = 'app_user') THEN CREATE ROLE app_user; END IF;
+    END $$;
+    GRANT SELECT, INSERT ON bench_orders TO app_user;
+    GRANT USAGE ON SEQUENCE bench_orders_order_id_seq TO app_user;
+
+    CREATE OR REPLACE FUNCTION tenant_order_totals(p_tenant_id text)
+      RETURNS TABLE (tenant_id text, orders bigint, amount bigint) AS
+    $func$
+    BEGIN
+       PERFORM set_config('tenant.id', p_tenant_id, true);
+       RETURN QUERY SELECT o.tenant_id, count(*), sum(o.amount) FROM bench_orders o GROUP BY o.tenant_id;
+    END
+    $func$  LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION add_tenant_order(p_tenant_id text, p_amount integer)
+      RETURNS bigint AS
+    $func$
+    DECLARE new_id bigint;
+    BEGIN
+       PERFORM set_config('tenant.id', p_tenant_id, true);
+       INSERT INTO bench_orders (tenant_id, amount) VALUES (p_tenant_id, p_amount) RETURNING order_id INTO new_id;
+       RETURN new_id;
+    END
+    $func$  LANGUAGE plpgsql;
+    """
+
+    READ_SQL = 'SELECT tenant_id, count(*) AS orders, sum(amount) AS amount FROM bench_orders GROUP BY tenant_id'
+
+    def __init__(self, dsn, variant='inline', round_trip_ms=5.0):
+        self.dsn = dsn
+        self.variant = variant
+        self.round_trip_ms = round_trip_ms
+        self.data_api = None
+        self.executor = None
+
+    def setup(self, workload):
+        import psycopg
+        local_data_api = load_sample_module('rds-data-api-rls', 'local_data_api')
+        tenant_scoped_executor = load_sample_module('rds-data-api-rls', 'tenant_scoped_executor')
+        with psycopg.connect(self.dsn, autocommit=True) as conn:
+            conn.execute(self.SETUP_SQL)
+            conn.execute(tenant_scoped_executor.TENANT_ROWS_FUNCTION_SQL)
+            with conn.cursor() as cur:
+                cur.executemany('INSERT INTO bench_orders (tenant_id, amount) SELECT %s, generate_series(1, %s)',
+                                list(workload.tenant_rows().items()))
+        self.data_api = local_data_api.LocalDataApi(self.dsn, role='app_user', round_trip_ms=self.round_trip_ms)
+        self.executor = tenant_scoped_executor.TenantScopedExecutor(self.data_api, 'cluster-arn', 'secret-arn',
+                                                                    'postgres', strategy=self.variant)
+
+    def run(self, tenant_id, operation):
+        if operation == 'read':
+            if self.variant == 'function':
+                rows = self.executor.execute(tenant_id, 'SELECT * FROM tenant_order_totals(:tenant_id)',
+                                             {'tenant_id': tenant_id})
+            else:
+                rows = self.executor.execute(tenant_id, self.READ_SQL)
+            return check_tenant(tenant_id, rows)
+        if self.variant == 'transaction':
+            with self.executor.transaction() as tx:
+                return tx.execute(tenant_id, 'INSERT INTO bench_orders (tenant_id, amount) VALUES (:tenant_id, 1)',
+                                  {'tenant_id': tenant_id})
+        return self.executor.execute(tenant_id, 'SELECT add_tenant_order(:tenant_id, 1) AS order_id',
+                                     {'tenant_id': tenant_id}, strategy='function')
+
+    def round_trips(self):
+        return self.data_api.total_calls
+
+    def close(self):
+        pass
+
+
+class PgvectorRlsTarget:
+    """
+    Tenant-isolated similarity search with pgvector, see samples/multi-tenant-vector-database
+    :param dsn: The libpq connection string of a superuser of a local PostgreSQL with pgvector
+    :param variant: The TenantScopedExecutor strategy of the searches: 'inline' or 'transaction',
+        the transaction is the SET and query of query_vector_database_using_rls in the notebook
+    :param round_trip_ms: Simulated Data API latency per call
+    :param bedrock_ms: Simulated latency of each embedding
+    :param dimensions: The number of dimensions of the embeddings
+
+    Reads embed a question and return the 5 nearest chunks as app_user, writes
+    embed a chunk and insert it with the owner's credentials, like IngestionPipeline.
+    """
+
+    name = 'pgvector-rls'
+    variants = ('inline', 'transaction')
+
+    SEARCH_SQL = 'SELECT id, tenantid, chunks FROM self_managed.kb_bench ORDER BY embedding <-> (:embedding)::vector LIMIT 5'
+    INSERT_SQL = ('INSERT INTO self_managed.kb_bench (id, embedding, chunks, metadata, tenantid) '
+                  'VALUES (:id::uuid, :embedding::vector, :chunks, :metadata::json, :tenantid)')
+
+    def __init__(self, dsn, variant='inline', round_trip_ms=5.0, bedrock_ms=20.0, dimensions=256):
+        self.dsn = dsn
+        self.variant = variant
+        self.round_trip_ms = round_trip_ms
+        self.bedrock_ms = bedrock_ms
+        self.dimensions = dimensions
+        self._ids = itertools.count(1)
+
+    def setup(self, workload):
+        import numpy as np
+        import psycopg
+        local_data_api = load_sample_module('rds-data-api-rls', 'local_data_api')
+        tenant_scoped_executor = load_sample_module('rds-data-api-rls', 'tenant_scoped_executor')
+        local_stubs = load_sample_module('multi-tenant-vector-database/amazon-aurora/self-managed', 'local_stubs')
+        rng = np.random.default_rng(workload.seed)
+        with psycopg.connect(self.dsn, autocommit=True) as conn:
+            conn.execute('CREATE EXTENSION IF NOT EXISTS vector; CREATE SCHEMA IF NOT EXISTS self_managed')
+            conn.execute('DROP TABLE IF EXISTS self_managed.kb_bench')
+            conn.execute('CREATE TABLE self_managed.kb_bench (id uuid PRIMARY KEY, embedding vector({0}), chunks text, '
+                         'metadata json, tenantid text)'.format(self.dimensions))
+            conn.execute("CREATE POLICY tenant_policy ON self_managed.kb_bench "
+                         "USING (tenantid = current_setting('self_managed.kb.tenantid'))")
+            conn.execute('ALTER TABLE self_managed.kb_bench ENABLE ROW LEVEL SECURITY')
+            conn.execute("DO $$ BEGIN IF NOT EXISTS (SELECT FROM pg_roles WHERE rolname = 'app_user') "
+                         "THEN CREATE ROLE app_user; END IF; END $$")
+            conn.execute('GRANT USAGE ON SCHEMA self_managed TO app_user')
+            conn.execute('GRANT SELECT ON self_managed.kb_bench TO app_user')
+            conn.execute(tenant_scoped_executor.TENANT_ROWS_FUNCTION_SQL)
+            with conn.cursor() as cur:
+                for tenant_id, rows in workload.tenant_rows().items():
+                    vectors = rng.standard_normal((rows, self.dimensions)).astype(np.float32)
+                    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+                    cur.executemany('INSERT INTO self_managed.kb_bench VALUES (%s, %s::vector, %s, %s, %s)', [
+                        (str(uuid.uuid4()), '[' + ','.join(map(str, v.tolist())) + ']', 'chunk {0}'.format(n), '{}',
+                         tenant_id) for n, v in enumerate(vectors)])
+            conn.execute('CREATE INDEX ON self_managed.kb_bench USING hnsw (embedding vector_l2_ops)')
+        self.bedrock_runtime = local_stubs.StubBedrockRuntime(latency=self.bedrock_ms / 1000.0,
+                                                              dimensions=self.dimensions)
+        self.data_api = local_data_api.LocalDataApi(self.dsn, role='app_user', round_trip_ms=self.round_trip_ms)
+        self.owner_data_api = local_data_api.LocalDataApi(self.dsn, round_trip_ms=self.round_trip_ms)
+        self.executor = tenant_scoped_executor.TenantScopedExecutor(
+            self.data_api, 'cluster-arn', 'secret-arn', 'postgres', setting='self_managed.kb.tenantid',
+            strategy=self.variant)
+        self.to_parameters = tenant_scoped_executor.to_parameters
+
+    def embed(self, text):
+        response = self.bedrock_runtime.invoke_model(body=json.dumps({'inputText': text}),
+                                                     modelId='amazon.titan-embed-text-v1')
+        return json.loads(response['body'].read())['embedding']
+
+    def run(self, tenant_id, operation):
+        text = '{0} {1} {2}'.format(operation, tenant_id, next(self._ids))
+        embedding = str(self.embed(text))
+        if operation == 'read':
+            rows = self.executor.execute(tenant_id, self.SEARCH_SQL, {'embedding': embedding})
+            return check_tenant(tenant_id, rows, column='tenantid')
+        return self.owner_data_api.execute_statement(
+            resourceArn='cluster-arn', secretArn='owner-secret-arn', database='postgres', sql=self.INSERT_SQL,
+            parameters=self.to_parameters({'id': str(uuid.uuid4()), 'embedding': embedding, 'chunks': text,
+                                           'metadata': '{}', 'tenantid': tenant_id}))
+
+    def round_trips(self):
+        return self.data_api.total_calls + self.owner_data_api.total_calls + self.bedrock_runtime.total
+
+    def close(self):
+        pass
+
+
+class DataLakeTarget:
+    """
+    STS-scoped Athena queries of the getTenantData Lambda, see samples/data-lake-tenant-isolation
+    :param variant: 'cached' uses the Lambda's TenantSessionCache and Athena result reuse,
+        'uncached' assumes the tenant role for every client and never reuses results
+    :param round_trip_ms: Simulated Athena and S3 latency per call
+    :param sts_ms: Simulated AssumeRole latency
+    :param query_ms: How long each Athena query runs
+
+    Reads run an aggregate over the tenant's orders, writes put a CSV object
+    under the tenant's prefix with the tenant-scoped S3 client.
+    """
+
+    name = 'data-lake'
+    variants = ('cached', 'uncached')
+
+    READ_SQL = 'SELECT tenant_id, count(*) AS orders, sum(amount) AS amount FROM orders GROUP BY tenant_id'
+
+    def __init__(self, variant='cached', round_trip_ms=5.0, sts_ms=30.0, query_ms=200.0):
+        self.variant = variant
+        self.round_trip_ms = round_trip_ms
+        self.sts_ms = sts_ms
+        self.query_ms = query_ms
+        self._ids = itertools.count(1)
+
+    def setup(self, workload):
+        layer = 'data-lake-tenant-isolation/compute_layer/lambda/layers/python'
+        temp_session = load_sample_module(layer, 'tempSession')
+        athena_executor = load_sample_module(layer, 'athenaExecutor')
+        self.sts = TaggedSts(load_sample_module('dynamodb-pooled-isolation', 'local_dynamodb').LocalSts(self.sts_ms))
+        self.s3 = LocalS3(self.sts, round_trip_ms=self.round_trip_ms)
+        self.athena = LocalAthena(self.s3, round_trip_ms=self.round_trip_ms, query_ms=self.query_ms)
+        for tenant_id, rows in workload.tenant_rows().items():
+            body = 'tenant_id,amount\n' + ''.join('{0},{1}\n'.format(tenant_id, n) for n in range(1, rows + 1))
+            self.s3.objects[('data-lake', 'orders/tenant={0}/initial.csv'.format(tenant_id))] = body.encode('utf-8')
+        session_cache = temp_session.TenantSessionCache(
+            max_tenants=256 if self.variant == 'cached' else 0, sts_client=self.sts)
+        self.clients = TenantScopedClients(session_cache, self.athena, self.s3)
+        self.executor = athena_executor.TenantAthenaExecutor(
+            self.clients, ROLE_ARN, output_location='s3://athena-results/',
+            reuse_max_age_minutes=60 if self.variant == 'cached' else 0, initial_poll_sec=0.05, max_poll_sec=1.0)
+
+    def run(self, tenant_id, operation):
+        if operation == 'read':
+            return check_tenant(tenant_id, list(self.executor.execute(tenant_id, self.READ_SQL, 'data_lake')))
+        self.clients.client('s3', ROLE_ARN, tenant_id).put_object(
+            Bucket='data-lake', Key='orders/tenant={0}/{1}.csv'.format(tenant_id, next(self._ids)),
+            Body='tenant_id,amount\n{0},1\n'.format(tenant_id))
+
+    def round_trips(self):
+        return self.sts.calls + self.s3.total_calls + self.athena.total_calls
+
+    def close(self):
+        pass
+
+
+class TenantScopedClients:
+    """
+    TenantSessionCache.client stand-in: the tenant session is taken from the real cache, assuming the
+    role when it is not cached, and local Athena and S3 clients are built from the session's credentials.
+    They only see what the TenantID session tag of those credentials allows, so a session of the wrong
+    tenant fails the tenant check of the reads or is denied its writes.
+    """
+
+    def __init__(self, session_cache, athena, s3):
+        self.session_cache = session_cache
+        self.athena = athena
+        self.s3 = s3
+
+    def client(self, service_name, access_role_arn, tenant_id, session_name='tenantSession', tags=None, **kwargs):
+        session = self.session_cache.get_session(access_role_arn, tenant_id, session_name=session_name, tags=tags)
+        credentials = session.get_credentials()
+        credentials = {'AccessKeyId': credentials.access_key, 'SecretAccessKey': credentials.secret_key,
+                       'SessionToken': credentials.token}
+        return self.athena.client(credentials) if service_name == 'athena' else self.s3.client(credentials)
+
+
+class DynamoDbPooledTarget:
+    """
+    One DynamoDB table for all tenants with tenant-scoped credentials, see samples/dynamodb-pooled-isolation
+    :param variant: 'pooled' keeps each tenant on one partition key, 'sharded' spreads the tenants
+        with more than 10% of the requests over shards partition keys
+    :param round_trip_ms: Simulated DynamoDB latency per call
+    :param sts_ms: Simulated AssumeRole latency
+    :param endpoint: The URL of DynamoDB Local, which has no partition limits, in place of LocalDynamoDB
+    :param shards: The number of partition keys of a sharded tenant
+
+    Reads get one of the tenant's items by key, writes put a new item.
+    """
+
+    name = 'dynamodb-pooled'
+    variants = ('pooled', 'sharded')
+    TABLE_NAME = 'bench_pooled_table'
+
+    def __init__(self, variant='pooled', round_trip_ms=5.0, sts_ms=30.0, endpoint=None, shards=8):
+        self.variant = variant
+        self.round_trip_ms = round_trip_ms
+        self.sts_ms = sts_ms
+        self.endpoint = endpoint
+        self.shards = shards
+        self.calls = CallCounter()
+        self._ids = itertools.count(1)
+        self.table = None
+
+    def setup(self, workload):
+        local_dynamodb = load_sample_module('dynamodb-pooled-isolation', 'local_dynamodb')
+        pooled_table = load_sample_module('dynamodb-pooled-isolation', 'pooled_table')
+        self.sts = local_dynamodb.LocalSts(self.sts_ms)
+        if self.endpoint:
+            recreate_table(dynamodb_local_client(self.endpoint), self.TABLE_NAME, [('pk', 'HASH'), ('sk', 'RANGE')])
+
+            def client_factory(credentials):
+                return count_boto3_calls(dynamodb_local_client(self.endpoint, credentials), self.calls)
+        else:
+            local = local_dynamodb.LocalDynamoDB(self.round_trip_ms)
+            self.local = local
+
+            def client_factory(credentials):
+                return local
+        shard_counts = {}
+        if self.variant == 'sharded':
+            shard_counts = {tenant_id: self.shards for tenant_id, share in workload.shares().items() if share > 0.1}
+        sessions = pooled_table.TenantSessionCache(self.sts, ROLE_ARN, client_factory)
+        self.table = pooled_table.PooledTable(sessions, self.TABLE_NAME, shard_counts=shard_counts,
+                                              max_workers=workload.concurrency, max_retries=20)
+        self.sizes = workload.tenant_rows()
+        for tenant_id, rows in self.sizes.items():
+            self.table.batch_write(tenant_id, [{'sk': 'order#{0:07d}'.format(n), 'tenant_id': tenant_id, 'amount': n}
+                                               for n in range(rows)])
+
+    def run(self, tenant_id, operation):
+        n = next(self._ids)
+        if operation == 'read':
+            item = self.table.get_item(tenant_id, 'order#{0:07d}'.format(n % self.sizes[tenant_id]))
+            return check_tenant(tenant_id, [item])
+        self.table.put_item(tenant_id, {'sk': 'new#{0:09d}'.format(n), 'tenant_id': tenant_id, 'amount': 1})
+
+    def round_trips(self):
+        return self.sts.calls + (self.calls.value if self.endpoint else self.local.total_calls)
+
+    def close(self):
+        if self.table is not None:
+            self.table.close()
+
+
+class ShardingTarget:
+    """
+    Tenants routed to their shard database, see samples/relational-database-sharding
+    :param dsn: The libpq connection string of a user of the local PostgreSQL that can create databases
+    :param variant: 'routed' uses ShardRouter, 'naive' reads the mapping and opens a connection for every request
+    :param round_trip_ms: Simulated DynamoDB latency per call
+    :param endpoint: The URL of DynamoDB Local for the mapping table, in place of LocalDynamoDB
+    :param shards: The number of shard databases
+    :param pool_size: The maximum connections per shard of ShardRouter
+
+    Round trips are the mapping table calls, the connections opened and the queries.
+    """
+
+    name = 'sharding'
+    variants = ('routed', 'naive')
+    TABLE_NAME = 'bench_tenant_shard_mapping'
+    READ_SQL = 'SELECT tenant_id, count(*), sum(amount) FROM orders WHERE tenant_id = %s GROUP BY tenant_id'
+    WRITE_SQL = 'INSERT INTO orders (tenant_id, amount) VALUES (%s, 1)'
+
+    def __init__(self, dsn, variant='routed', round_trip_ms=5.0, endpoint=None, shards=4, pool_size=4):
+        self.dsn = dsn
+        self.variant = variant
+        self.round_trip_ms = round_trip_ms
+        self.endpoint = endpoint
+        self.shards = shards
+        self.pool_size = pool_size
+        self.calls = CallCounter()
+        self.router = None
+
+    def shard_conninfo(self, shard_id):
+        from psycopg.conninfo import make_conninfo
+        return make_conninfo(self.dsn, dbname='bench_' + shard_id.replace('-', '_'))
+
+    def connect(self, conninfo):
+        import psycopg
+        self.calls.add()
+        return psycopg.connect(conninfo)
+
+    def setup(self, workload):
+        import psycopg
+        shard_router = load_sample_module('relational-database-sharding', 'shard_router')
+        if self.endpoint:
+            self.dynamodb = count_boto3_calls(dynamodb_local_client(self.endpoint), self.calls)
+            recreate_table(self.dynamodb, self.TABLE_NAME, [('tenant_id', 'HASH')])
+        else:
+            self.dynamodb = load_sample_module('relational-database-sharding', 'local_dynamodb').LocalDynamoDB(
+                round_trip_ms=self.round_trip_ms)
+        shard_ids = ['shard-{0}'.format(n) for n in range(1, self.shards + 1)]
+        assignment = {tenant_id: shard_ids[n % self.shards] for n, tenant_id in enumerate(workload.tenant_ids())}
+        with psycopg.connect(self.dsn, autocommit=True) as conn:
+            existing = {row[0] for row in conn.execute('SELECT datname FROM pg_database')}
+            for shard_id in shard_ids:
+                if 'bench_' + shard_id.replace('-', '_') not in existing:
+                    conn.execute('CREATE DATABASE bench_{0}'.format(shard_id.replace('-', '_')))
+        rows = workload.tenant_rows()
+        for shard_id in shard_ids:
+            with psycopg.connect(self.shard_conninfo(shard_id), autocommit=True) as conn:
+                conn.execute('DROP TABLE IF EXISTS orders')
+                conn.execute('CREATE TABLE orders (tenant_id text, amount integer)')
+                conn.execute('CREATE INDEX ON orders (tenant_id)')
+                with conn.cursor() as cur:
+                    cur.executemany('INSERT INTO orders SELECT %s, generate_series(1, %s)',
+                                    [(t, rows[t]) for t, s in assignment.items() if s == shard_id])
+        for tenant_id, shard_id in assignment.items():
+            self.dynamodb.put_item(TableName=self.TABLE_NAME, Item={
+                'tenant_id': {'S': tenant_id}, 'shard_id': {'S': shard_id}, 'version': {'N': '1'}})
+        if self.variant == 'routed':
+            self.router = shard_router.ShardRouter(shard_router.TenantShardMap(self.dynamodb, self.TABLE_NAME),
+                                                   self.shard_conninfo, connect=self.connect,
+                                                   max_size=self.pool_size, acquire_timeout_sec=30)
+
+    def run(self, tenant_id, operation):
+        sql = self.READ_SQL if operation == 'read' else self.WRITE_SQL
+        self.calls.add()
+        if self.router is not None:
+            rows = self.router.execute(tenant_id, sql, (tenant_id,))
+        else:
+            item = self.dynamodb.get_item(TableName=self.TABLE_NAME, Key={'tenant_id': {'S': tenant_id}})['Item']
+            with self.connect(self.shard_conninfo(item['shard_id']['S'])) as conn:
+                cursor = conn.execute(sql, (tenant_id,))
+                rows = cursor.fetchall() if cursor.description is not None else None
+        if operation == 'read':
+            return check_tenant(tenant_id, [{'tenant_id': row[0]} for row in rows])
+
+    def round_trips(self):
+        if self.endpoint:
+            return self.calls.value
+        return self.calls.value + self.dynamodb.total_calls
+
+    def close(self):
+        if self.router is not None:
+            self.router.close()
+
+
+TARGETS = {target.name: target for target in (
+    RdsDataApiRlsTarget, PgvectorRlsTarget, DataLakeTarget, DynamoDbPooledTarget, ShardingTarget)}
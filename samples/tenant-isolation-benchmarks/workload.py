@@ -0,0 +1,255 @@
+"""
+Multi-tenant workload generator and load runner.
+
+A Workload is a reproducible stream of (tenant_id, operation) requests. Tenant
+sizes and request shares follow a Zipf distribution with exponent skew, so
+'tenant-1' is the largest tenant and gets the most requests. run_workload
+sends the stream to a target with a fixed number of requests in flight and
+summarizes the latency percentiles, throughput and round trips per request
+as a dict that can be saved as JSON and compared with compare_results.
+
+A target is any object with:
+
+* name and variant - the pattern and the way it is used, e.g. 'rds-data-api-rls' and 'inline'
+* setup(workload)  - creates and loads the tenants' data
+* run(tenant_id, operation) - sends one request, raising an exception when it fails
+* round_trips()    - the number of calls made to the services so far
+* close()
+"""
+import platform
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
+
+
+def latency_stats(samples):
+    if not samples:
+        return {'p50': None, 'p95': None, 'p99': None, 'mean': None, 'max': None}
+    return {
+        'p50': round(percentile(samples, 50), 3),
+        'p95': round(percentile(samples, 95), 3),
+        'p99': round(percentile(samples, 99), 3),
+        'mean': round(sum(samples) / len(samples), 3),
+        'max': round(max(samples), 3),
+    }
+
+
+def parse_mix(text):
+    """
+    Parse a request mix
+    :param text: Operations and weights, e.g. 'read=0.9,write=0.1'
+    :return: A dict of operations and their share of the requests
+    """
+    mix = {}
+    for part in text.split(','):
+        operation, _, weight = part.partition('=')
+        mix[operation.strip()] = float(weight) if weight else 1.0
+    total = sum(mix.values())
+    if total <= 0:
+        raise ValueError('Invalid request mix {0!r}'.format(text))
+    return {operation: weight / total for operation, weight in mix.items()}
+
+
+class Workload:
+    """
+    A reproducible multi-tenant request stream
+    :param tenants: The number of tenants, 'tenant-1' ... 'tenant-<tenants>'
+    :param skew: The Zipf exponent of the tenant sizes and request shares, 0 for equal tenants
+    :param rows: The number of rows, items or chunks loaded over all tenants
+    :param mix: A dict of operations and their share of the requests, e.g. {'read': 0.9, 'write': 0.1}
+    :param requests: The number of measured requests
+    :param concurrency: The number of requests in flight
+    :param warmup: Requests sent before the measured ones and left out of the results
+    :param seed: Seed of the tenant and operation of each request
+    """
+
+    def __init__(self, tenants=20, skew=1.0, rows=10000, mix=None, requests=2000, concurrency=16, warmup=0, seed=7):
+        self.tenants = tenants
+        self.skew = skew
+        self.rows = rows
+        self.mix = dict(mix or {'read': 0.9, 'write': 0.1})
+        self.requests = requests
+        self.concurrency = concurrency
+        self.warmup = warmup
+        self.seed = seed
+
+    def tenant_ids(self):
+        return ['tenant-{0}'.format(n) for n in range(1, self.tenants + 1)]
+
+    def shares(self):
+        """
+        :return: A dict of tenant IDs and their share of the rows and requests, largest first
+        """
+        weights = [1.0 / (n ** self.skew) for n in range(1, self.tenants + 1)]
+        total = sum(weights)
+        return {tenant_id: weight / total for tenant_id, weight in zip(self.tenant_ids(), weights)}
+
+    def tenant_rows(self):
+        """
+        :return: A dict of tenant IDs and their number of rows, at least 1
+        """
+        return {tenant_id: max(1, int(round(self.rows * share))) for tenant_id, share in self.shares().items()}
+
+    def generate(self, count, stream=0):
+        """
+        Build a request stream
+        :param count: The number of requests
+        :param stream: Selects an independent stream with the same distribution, e.g. for the warmup
+        :return: A list of (tenant_id, operation)
+        """
+        rng = random.Random('{0}-{1}'.format(self.seed, stream))
+        shares = self.shares()
+        tenant_ids = rng.choices(list(shares), weights=list(shares.values()), k=count)
+        operations = rng.choices(list(self.mix), weights=list(self.mix.values()), k=count)
+        return list(zip(tenant_ids, operations))
+
+    def to_dict(self):
+        return {
+            'tenants': self.tenants,
+            'skew': self.skew,
+            'rows': self.rows,
+            'mix': self.mix,
+            'requests': self.requests,
+            'concurrency': self.concurrency,
+            'warmup': self.warmup,
+            'seed': self.seed,
+        }
+
+
+def drive(target, requests, concurrency):
+    """
+    Send requests to a target from concurrency threads, each sending its next request when the previous one returns
+    :param target: The target
+    :param requests: A list of (tenant_id, operation)
+    :param concurrency: The number of threads
+    :return: The list of (tenant_id, operation, latency in ms, error message or None) and the elapsed seconds
+    """
+    pending = iter(requests)
+    lock = threading.Lock()
+    samples = []
+
+    def worker():
+        recorded = []
+        while True:
+            with lock:
+                request = next(pending, None)
+            if request is None:
+                break
+            tenant_id, operation = request
+            error = None
+            start = time.perf_counter()
+            try:
+                target.run(tenant_id, operation)
+            except Exception as err:
+                error = '{0}: {1}'.format(type(err).__name__, err)
+            recorded.append((tenant_id, operation, (time.perf_counter() - start) * 1000, error))
+        with lock:
+            samples.extend(recorded)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    return samples, time.perf_counter() - start
+
+
+def summarize(target, workload, samples, elapsed, round_trips):
+    """
+    Summarize a run
+    :return: A dict of plain values, see README.md for the fields
+    """
+    latencies = [ms for _, _, ms, error in samples if error is None]
+    errors = [error for _, _, _, error in samples if error is not None]
+    operations = {}
+    for operation in sorted({operation for _, operation, _, _ in samples}):
+        selected = [(ms, error) for _, op, ms, error in samples if op == operation]
+        operations[operation] = {
+            'requests': len(selected),
+            'errors': sum(1 for _, error in selected if error is not None),
+            'latency_ms': latency_stats([ms for ms, error in selected if error is None]),
+        }
+    largest = workload.tenant_ids()[0]
+    largest_latencies = [ms for tenant_id, _, ms, error in samples if tenant_id == largest and error is None]
+    return {
+        'pattern': target.name,
+        'variant': target.variant,
+        'requests': len(samples),
+        'errors': len(errors),
+        'error_samples': sorted(set(errors))[:3],
+        'elapsed_sec': round(elapsed, 3),
+        'throughput_rps': round(len(samples) / elapsed, 2) if elapsed else None,
+        'round_trips': round_trips,
+        'round_trips_per_request': round(round_trips / float(len(samples)), 3) if samples else None,
+        'latency_ms': latency_stats(latencies),
+        'operations': operations,
+        'largest_tenant': {
+            'tenant_id': largest,
+            'requests': sum(1 for tenant_id, _, _, _ in samples if tenant_id == largest),
+            'latency_ms': latency_stats(largest_latencies),
+        },
+    }
+
+
+def run_workload(target, workload):
+    """
+    Load the target's data, run the warmup and the measured requests
+    :param target: The target
+    :param workload: The Workload
+    :return: The summary of the measured requests, see summarize
+    """
+    target.setup(workload)
+    if workload.warmup:
+        drive(target, workload.generate(workload.warmup, stream=1), workload.concurrency)
+    before = target.round_trips()
+    samples, elapsed = drive(target, workload.generate(workload.requests), workload.concurrency)
+    return summarize(target, workload, samples, elapsed, target.round_trips() - before)
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+    }
+
+
+COMPARED_FIELDS = (
+    ('throughput_rps', ('throughput_rps',)),
+    ('p50 ms', ('latency_ms', 'p50')),
+    ('p95 ms', ('latency_ms', 'p95')),
+    ('p99 ms', ('latency_ms', 'p99')),
+    ('rt/req', ('round_trips_per_request',)),
+)
+
+
+def _field(result, path):
+    for key in path:
+        result = result.get(key) if result is not None else None
+    return result
+
+
+def compare_results(baseline, current):
+    """
+    Compare two saved runs pattern by pattern
+    :param baseline: The saved results of the earlier run
+    :param current: The saved results of the later run
+    :return: A list of (pattern, variant, field, baseline value, current value, change in percent)
+    """
+    earlier = {(r['pattern'], r['variant']): r for r in baseline['results']}
+    rows = []
+    for result in current['results']:
+        previous = earlier.get((result['pattern'], result['variant']))
+        if previous is None:
+            continue
+        for label, path in COMPARED_FIELDS:
+            old, new = _field(previous, path), _field(result, path)
+            change = (new - old) / old * 100 if old and new is not None else None
+            rows.append((result['pattern'], result['variant'], label, old, new, change))
+    return rows